@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,6 +49,7 @@ STATICFILES_DIRS = [
 ]
 
 MIDDLEWARE = [
+    "main.metricas.MetricasMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -55,6 +57,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "main.instrumentacao.InstrumentacaoMiddleware",
 ]
 
 ROOT_URLCONF = "habitas.urls"
@@ -131,6 +134,9 @@ STATIC_ROOT = BASE_DIR / "staticfiles"  # Para coletar arquivos estáticos em pr
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Arquivos gerados nos testes (métricas) ficam em diretório temporário
+TEST_RUNNER = 'main.tests.executor.ExecutorTestes'
+
 # Custom User Model
 AUTH_USER_MODEL = 'main.CustomUser'
 
@@ -138,6 +144,108 @@ AUTH_USER_MODEL = 'main.CustomUser'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Laudos e credenciais passam pela view (controle de acesso). Atrás do nginx,
+# use 'x-accel' com uma location interna apontando para o MEDIA_ROOT:
+#   location /protegido/ { internal; alias /caminho/para/media/; }
+# No Apache com mod_xsendfile, use 'x-sendfile'. None: o Django envia o arquivo.
+MEDIA_OFFLOAD = None
+MEDIA_ACCEL_PREFIX = '/protegido/'
+
+# Sincronização incremental (api/trees/changes/): alterações mais novas que
+# isto são reenviadas, pois transações abertas ainda podem gravar ids menores.
+# Deve ser maior que a transação mais longa que grava TreeChange (importação).
+SYNC_ATRASO_SEGUNDOS = 300
+
+# Mapa de calor dos serviços ecossistêmicos (tiles PNG em cache no disco)
+HEATMAP_ZOOM_MIN = 11
+HEATMAP_ZOOM_MAX = 17
+HEATMAP_CACHE_DIR = BASE_DIR / 'cache' / 'heatmap'
+HEATMAP_CACHE_MAX_BYTES = 512 * 1024 ** 2
+HEATMAP_VERIFICACAO_SEGUNDOS = 300  # nova medição do tamanho do cache em disco
+
+# Variantes reduzidas das fotos das notificações (geradas após o upload)
+FOTOS_PROCESSAMENTO_ASSINCRONO = True
+FOTOS_MAX_WORKERS = 2
+
+# Avaliação das fórmulas dos serviços em processos isolados (main/sandbox.py)
+FORMULAS_SANDBOX = True
+FORMULAS_SANDBOX_WORKERS = 2
+FORMULAS_SANDBOX_TEMPO_CPU = 2  # segundos de CPU por tarefa
+FORMULAS_SANDBOX_MEMORIA_MB = 512  # espaço de endereçamento de cada worker
+FORMULAS_SANDBOX_ESPERA_FILA = 30  # segundos aguardando um worker livre
+
+# Projeção de crescimento (main/projecao.py). Espécies sem CrescimentoEspecie
+# usam estes parâmetros (DAP em cm/ano, alturas em m, taxa por ano)
+PROJECAO_CRESCIMENTO_PADRAO = {
+    'incremento_dap': 0.8,
+    'dap_maximo': 100.0,
+    'altura_maxima': 18.0,
+    'taxa_altura': 0.05,
+}
+PROJECAO_ANOS_MAX = 100
+PROJECAO_CACHE_SEGUNDOS = 300
+# Largura das faixas de DAP (cm) e altura (m) que formam as coortes
+PROJECAO_FAIXA_DAP = 1.0
+PROJECAO_FAIXA_ALTURA = 0.5
+# Projeções fora do cache são calculadas em segundo plano (a API responde 202)
+PROJECAO_ASSINCRONA = True
+PROJECAO_TEMPO_MAXIMO = 600  # segundos até outro pedido poder recomeçar o cálculo
+
+# Cenários "e se" (main/cenarios.py): tamanho das mudas plantadas quando o
+# cenário não informa (DAP em cm, altura em m)
+CENARIOS_MUDA_DAP = 3
+CENARIOS_MUDA_ALTURA = 2
+CENARIOS_PLANTIO_MAX = 100000
+CENARIOS_CACHE_SEGUNDOS = 3600
+# Inventário em memória: recarga completa periódica, limite de árvores
+# alteradas para atualizar só as alteradas e de serviços com valores guardados
+CENARIOS_RECARGA_SEGUNDOS = 3600
+CENARIOS_ALTERACOES_MAX = 5000
+CENARIOS_VALORES_MAX = 32
+
+# Cache local das imagens e laudos do site da prefeitura (TreeMedia)
+ACERVO_ORIGEM = 'https://arvores.sjc.sp.gov.br'
+ACERVO_CACHE_DIR = BASE_DIR / 'cache' / 'acervo'
+ACERVO_CACHE_MAX_BYTES = 2 * 1024 ** 3
+ACERVO_ARQUIVO_MAX_BYTES = 25 * 1024 ** 2
+ACERVO_TIMEOUT = 15
+ACERVO_VERIFICACAO_SEGUNDOS = 300  # nova medição do tamanho do cache em disco
+
+# Instrumentação das requisições (main/instrumentacao.py): consultas SQL,
+# tempo no banco e nas fórmulas. Requisições acima de qualquer limite são
+# registradas (WARNING) no logger 'habitas.instrumentacao' com as consultas
+# mais repetidas; as demais, em DEBUG.
+INSTRUMENTACAO_ATIVA = False
+INSTRUMENTACAO_LIMITE_MS = 1000
+INSTRUMENTACAO_LIMITE_CONSULTAS = 50
+INSTRUMENTACAO_LIMITE_REPETICOES = 10  # mesma consulta (N+1)
+INSTRUMENTACAO_SERVER_TIMING = True  # cabeçalho Server-Timing nas respostas
+
+# Métricas para o Prometheus em /metrics (main/metricas.py). Cada processo
+# grava seus valores em METRICAS_DIR (compartilhado entre os workers do
+# gunicorn); limpe o diretório ao reiniciar o serviço. O Prometheus se
+# autentica com Authorization: Bearer <METRICAS_TOKEN> (variável de
+# ambiente); sem token, só gestores logados acessam o endpoint.
+METRICAS_ATIVAS = True
+METRICAS_DIR = BASE_DIR / 'cache' / 'metricas'
+METRICAS_INTERVALO = 5  # segundos entre gravações de cada processo
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN') or None
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'habitas.instrumentacao': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 if DEBUG:
     import mimetypes
     mimetypes.add_type("application/javascript", ".js", True)
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""
+Cache local das imagens e laudos das árvores hospedados no site da prefeitura.
+
+TreeMedia.url guarda caminhos relativos à ACERVO_ORIGEM. Cada
+arquivo é baixado uma única vez e guardado em disco, identificado pelo
+SHA-256 da URL remota. O diretório tem tamanho máximo: ao ultrapassá-lo,
+os arquivos menos usados recentemente (mtime, atualizado a cada acesso)
+são removidos. Para imagens também é gerada uma miniatura WebP.
+
+Redirecionamentos da origem só são seguidos dentro do mesmo host. O
+tamanho do cache é mantido em memória a cada download e medido de novo
+(varrendo o diretório) só quando passa do limite ou a cada
+ACERVO_VERIFICACAO_SEGUNDOS, para incluir o que outros processos gravaram.
+"""
+
+import io
+import json
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from . import metricas
+
+TAMANHO_MINIATURA = 320
+MAX_REDIRECIONAMENTOS = 5
+
+# Tamanho do cache conhecido por este processo (None: ainda não medido)
+_uso = {'bytes': None, 'medido_em': 0.0, 'diretorio': None}
+_trava_uso = threading.Lock()
+
+class ErroAcervo(Exception):
+    """Falha ao obter o arquivo na origem"""
+
+
+class ArquivoGrande(ErroAcervo):
+    """Arquivo maior que ACERVO_ARQUIVO_MAX_BYTES (servido direto da origem)"""
+
+
+def origem():
+    return getattr(settings, 'ACERVO_ORIGEM', 'https://arvores.sjc.sp.gov.br').rstrip('/')
+
+
+def diretorio_cache():
+    return Path(getattr(settings, 'ACERVO_CACHE_DIR', settings.BASE_DIR / 'cache' / 'acervo'))
+
+
+def url_remota(caminho, base=None):
+    """URL absoluta na origem; recusa caminhos que apontem para outro host"""
+    url = urljoin(base or origem() + '/', caminho)
+    if urlsplit(url).netloc != urlsplit(origem()).netloc:
+        raise ErroAcervo(f'Caminho fora da origem: {caminho}')
+    return url
+
+
+def _arquivos(url):
+    chave = hashlib.sha256(url.encode()).hexdigest()
+    pasta = diretorio_cache() / chave[:2]
+    return chave, pasta / chave, pasta / f"{chave}.json", pasta / f"{chave}.mini.webp"
+
+
+def _gravar(destino, conteudo):
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    temporario = destino.with_name(f"{destino.name}.{os.getpid()}.tmp")
+    temporario.write_bytes(conteudo)
+    temporario.replace(destino)
+
+
+def _baixar(url):
+    limite = getattr(settings, 'ACERVO_ARQUIVO_MAX_BYTES', 25 * 1024 * 1024)
+    try:
+        for _ in range(MAX_REDIRECIONAMENTOS + 1):
+            resposta = requests.get(
+                url, stream=True, allow_redirects=False, timeout=getattr(settings, 'ACERVO_TIMEOUT', 15)
+            )
+            if not resposta.is_redirect:
+                break
+            resposta.close()
+            url = url_remota(resposta.headers['Location'], base=url)
+        else:
+            raise ErroAcervo(f'Redirecionamentos demais: {url}')
+        with resposta:
+            resposta.raise_for_status()
+            if int(resposta.headers.get('Content-Length') or 0) > limite:
+                raise ArquivoGrande(url)
+            partes, total = [], 0
+            for parte in resposta.iter_content(64 * 1024):
+                total += len(parte)
+                if total > limite:
+                    raise ArquivoGrande(url)
+                partes.append(parte)
+            content_type = resposta.headers.get('Content-Type', 'application/octet-stream')
+    except ArquivoGrande:
+        metricas.incrementar('habitas_acervo_downloads_total', 'grande')
+        raise
+    except ErroAcervo:
+        metricas.incrementar('habitas_acervo_downloads_total', 'erro')
+        raise
+    except requests.RequestException as e:
+        metricas.incrementar('habitas_acervo_downloads_total', 'erro')
+        raise ErroAcervo(str(e))
+    metricas.incrementar('habitas_acervo_downloads_total', 'ok')
+    return b''.join(partes), content_type.split(';')[0].strip()
+
+
+def _miniatura(conteudo):
+    with Image.open(io.BytesIO(conteudo)) as original:
+        imagem = ImageOps.exif_transpose(original).convert('RGB')
+    imagem.thumbnail((TAMANHO_MINIATURA, TAMANHO_MINIATURA), Image.LANCZOS)
+    buffer = io.BytesIO()
+    imagem.save(buffer, format='WEBP', quality=80)
+    return buffer.getvalue()
+
+
+def obter(caminho, miniatura=False):
+    """Retorna (arquivo local, content_type, etag), baixando da origem se preciso"""
+    url = url_remota(caminho)
+    chave, arquivo, metadados, arquivo_miniatura = _arquivos(url)
+
+    em_cache = arquivo.exists() and metadados.exists()
+    metricas.cache('acervo', em_cache)
+    if not em_cache:
+        conteudo, content_type = _baixar(url)
+        _gravar(arquivo, conteudo)
+        _gravar(metadados, json.dumps({'url': url, 'content_type': content_type}).encode())
+        if content_type.startswith('image/'):
+            try:
+                _gravar(arquivo_miniatura, _miniatura(conteudo))
+            except (OSError, Image.DecompressionBombError):
+                pass
+        _registrar_gravacao(chave, arquivo, metadados, arquivo_miniatura)
+
+    content_type = json.loads(metadados.read_bytes())['content_type']
+    if miniatura and arquivo_miniatura.exists():
+        arquivo, content_type, chave = arquivo_miniatura, 'image/webp', f"{chave}-mini"
+
+    # Marca o uso para a política LRU
+    try:
+        os.utime(arquivo)
+    except FileNotFoundError:
+        pass
+    return arquivo, content_type, chave
+
+
+def _registrar_gravacao(chave, *arquivos):
+    """Soma os arquivos gravados ao tamanho conhecido e limita o cache se preciso"""
+    gravados = sum(arquivo.stat().st_size for arquivo in arquivos if arquivo.exists())
+    with _trava_uso:
+        if _uso['diretorio'] != diretorio_cache():
+            _uso['bytes'] = None
+        if _uso['bytes'] is not None:
+            _uso['bytes'] += gravados
+        precisa_medir = (
+            _uso['bytes'] is None
+            or _uso['bytes'] > getattr(settings, 'ACERVO_CACHE_MAX_BYTES', 2 * 1024 ** 3)
+            or time.monotonic() - _uso['medido_em'] > getattr(settings, 'ACERVO_VERIFICACAO_SEGUNDOS', 300)
+        )
+    if precisa_medir:
+        limitar_tamanho(manter=chave)
+
+
+def limitar_tamanho(manter=None):
+    """Remove os arquivos menos usados até o cache caber em ACERVO_CACHE_MAX_BYTES"""
+    maximo = getattr(settings, 'ACERVO_CACHE_MAX_BYTES', 2 * 1024 ** 3)
+    grupos = {}
+    for arquivo in diretorio_cache().glob('*/*'):
+        if arquivo.name.endswith('.tmp'):
+            continue
+        try:
+            info = arquivo.stat()
+        except FileNotFoundError:
+            continue
+        grupo = grupos.setdefault(arquivo.name.split('.')[0], [0, 0, []])
+        grupo[0] += info.st_size
+        grupo[1] = max(grupo[1], info.st_mtime)
+        grupo[2].append(arquivo)
+
+    total = sum(tamanho for tamanho, _, _ in grupos.values())
+    if total > maximo:
+        # Remove por grupo (original + metadados + miniatura), do uso mais antigo
+        # para o mais recente, até ficar 10% abaixo do limite
+        # (o arquivo recém-baixado, "manter", nunca é removido)
+        grupos.pop(manter, None)
+        for tamanho, _, arquivos in sorted(grupos.values(), key=lambda grupo: grupo[1]):
+            if total <= maximo * 0.9:
+                break
+            for arquivo in arquivos:
+                arquivo.unlink(missing_ok=True)
+            total -= tamanho
+    with _trava_uso:
+        _uso.update(bytes=total, medido_em=time.monotonic(), diretorio=diretorio_cache())
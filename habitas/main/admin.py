@@ -1,12 +1,16 @@
 from django.contrib import admin
 from django.contrib import messages
+from django.http import JsonResponse
+from django.urls import path
 from django.contrib.auth.admin import UserAdmin
 from import_export import resources
 from import_export.admin import ImportExportModelAdmin
 from .models import (
     Tree, Post, CustomUser, Laudo, Notificacao, HistoricoNotificacao,
-    EcosystemServiceConfig, EcosystemServiceHistory
+    EcosystemServiceConfig, EcosystemServiceHistory, TreeMedia, CrescimentoEspecie,
+    CenarioSimulacao, SinonimoEspecie, SnapshotInventario
 )
+from .impacto import previa_do_formulario
 
 
 class CustomUserAdmin(UserAdmin):
@@ -48,11 +52,19 @@ class TreeResource(resources.ModelResource):
     class Meta:
         model = Tree
         import_id_fields = ("N_placa",)
-        fields = ["N_placa", "nome_popular", "nome_cientifico", "dap", "altura", "latitude", "longitude", "laudo"]
+        fields = ["N_placa", "nome_popular", "nome_cientifico", "dap", "altura", "latitude", "longitude"]
+
+
+class TreeMediaInline(admin.TabularInline):
+    model = TreeMedia
+    extra = 0
+    fields = ['tipo', 'ordem', 'url', 'arquivo_local']
+    readonly_fields = ['arquivo_local']
 
 
 class MedicamentoDataAdmin(ImportExportModelAdmin):
     resource_class = TreeResource
+    inlines = [TreeMediaInline]
 
 
 # ============ ADMIN PARA SERVIÇOS ECOSSISTÊMICOS ============
@@ -77,6 +89,8 @@ class EcosystemServiceConfigAdmin(admin.ModelAdmin):
     search_fields = ['nome', 'codigo', 'descricao']
     readonly_fields = ['data_criacao', 'data_atualizacao', 'criado_por']
     inlines = [EcosystemServiceHistoryInline]
+    # Botão "Prévia do impacto" abaixo dos campos
+    change_form_template = 'admin/main/ecosystemserviceconfig/change_form.html'
     
     fieldsets = (
         ('Informações Básicas', {
@@ -85,7 +99,7 @@ class EcosystemServiceConfigAdmin(admin.ModelAdmin):
         }),
         ('Cálculo', {
             'fields': ('formula', 'coeficientes'),
-            'description': 'Fórmula Python que será avaliada. Use variáveis: dap, altura, biomassa, tree. Exemplo: "math.exp(coeficientes[\'BETA0\'] + coeficientes[\'BETA1\'] * math.log(dap) + coeficientes[\'BETA2\'] * math.log(altura)) / 1000"'
+            'description': 'Fórmula Python que será avaliada. Use variáveis: dap, altura, biomassa, area_copa, tree. Exemplo: "math.exp(coeficientes[\'BETA0\'] + coeficientes[\'BETA1\'] * math.log(dap) + coeficientes[\'BETA2\'] * math.log(altura)) / 1000"'
         }),
         ('Valoração', {
             'fields': ('valor_monetario_unitario', 'unidade_medida'),
@@ -101,6 +115,24 @@ class EcosystemServiceConfigAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_urls(self):
+        return [
+            path(
+                'previa-impacto/',
+                self.admin_site.admin_view(self.previa_impacto_view),
+                name='main_ecosystemserviceconfig_previa_impacto',
+            ),
+        ] + super().get_urls()
+
+    def previa_impacto_view(self, request):
+        """Mesma prévia da tela de gestão, para o formulário do admin"""
+        if request.method != 'POST' or not self.has_change_permission(request):
+            return JsonResponse({'erro': 'Método não permitido'}, status=405)
+        try:
+            return JsonResponse(previa_do_formulario(request.POST))
+        except ValueError as e:
+            return JsonResponse({'erro': str(e)}, status=400)
+
     def save_model(self, request, obj, form, change):
         """Registra quem criou/atualizou e salva histórico"""
         if not change:  # Novo objeto
@@ -176,6 +208,44 @@ class EcosystemServiceHistoryAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(CrescimentoEspecie)
+class CrescimentoEspecieAdmin(admin.ModelAdmin):
+    """Parâmetros de crescimento usados na projeção dos serviços"""
+    list_display = ['species', 'incremento_dap', 'dap_maximo', 'altura_maxima', 'taxa_altura']
+    search_fields = ['species__name']
+    raw_id_fields = ['species']
+
+
+@admin.register(SinonimoEspecie)
+class SinonimoEspecieAdmin(admin.ModelAdmin):
+    """Sinônimos e nomes populares usados por vincular_especies"""
+    list_display = ['nome', 'tipo', 'species', 'nome_normalizado']
+    list_filter = ['tipo']
+    search_fields = ['nome', 'nome_normalizado', 'species__name']
+    raw_id_fields = ['species']
+
+
+@admin.register(CenarioSimulacao)
+class CenarioSimulacaoAdmin(admin.ModelAdmin):
+    """Cenários "e se" criados pelos gestores"""
+    list_display = ['__str__', 'chave', 'criado_por', 'criado_em']
+    search_fields = ['nome', 'chave']
+    readonly_fields = ['chave', 'definicao', 'criado_por', 'criado_em']
+
+
+@admin.register(SnapshotInventario)
+class SnapshotInventarioAdmin(admin.ModelAdmin):
+    """Catálogo dos snapshots (gravados por registrar_snapshot)"""
+    list_display = ['criado_em', 'descricao', 'arvores', 'tamanho']
+    readonly_fields = [
+        'criado_em', 'arquivo', 'arvores', 'versao_inventario', 'versao_configuracao',
+        'tamanho', 'totais', 'servicos',
+    ]
+
+    def has_add_permission(self, request):
+        return False
+
+
 # ============ REGISTROS PADRÃO ============
 
 admin.site.register(CustomUser, CustomUserAdmin)
@@ -0,0 +1,132 @@
+"""
+Entrega dos arquivos enviados (laudos e credenciais) com suporte a
+requisições parciais.
+
+servir_arquivo() responde a GET condicional (ETag/Last-Modified) e ao
+cabeçalho Range, para que o leitor de PDF do celular mostre a primeira
+página sem baixar o arquivo inteiro. Atrás do nginx (ou Apache), com
+MEDIA_OFFLOAD configurado, a view só confere a permissão e delega a
+leitura do disco ao servidor web via X-Accel-Redirect / X-Sendfile.
+"""
+
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+TAMANHO_BLOCO = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _intervalo(cabecalho, tamanho):
+    """(inicio, fim) inclusivos do cabeçalho Range, None se ausente ou
+    não suportado (vários intervalos) e ValueError se insatisfazível"""
+    casamento = RANGE_RE.match((cabecalho or '').replace(' ', ''))
+    if not casamento or not any(casamento.groups()):
+        return None
+    inicio, fim = casamento.groups()
+    if not inicio:
+        # "bytes=-N": últimos N bytes
+        sufixo = int(fim)
+        if sufixo == 0 or tamanho == 0:
+            raise ValueError
+        return max(tamanho - sufixo, 0), tamanho - 1
+    inicio = int(inicio)
+    fim = min(int(fim), tamanho - 1) if fim else tamanho - 1
+    if inicio >= tamanho or fim < inicio:
+        raise ValueError
+    return inicio, fim
+
+
+def _if_range_vale(request, etag, modificado):
+    """If-Range: só usa o Range se o arquivo não mudou desde a primeira parte"""
+    valor = request.headers.get('If-Range')
+    if not valor:
+        return True
+    if valor.startswith(('"', 'W/')):
+        return valor == etag
+    return parse_http_date_safe(valor) == int(modificado)
+
+
+def _ler(caminho, inicio, quantidade):
+    with open(caminho, 'rb') as arquivo:
+        arquivo.seek(inicio)
+        while quantidade > 0:
+            bloco = arquivo.read(min(TAMANHO_BLOCO, quantidade))
+            if not bloco:
+                break
+            quantidade -= len(bloco)
+            yield bloco
+
+
+def servir_arquivo(request, campo, nome_download=None):
+    """Resposta para o FieldFile "campo" (arquivo no MEDIA_ROOT)"""
+    try:
+        caminho = campo.path
+        info = os.stat(caminho)
+    except (ValueError, FileNotFoundError):
+        raise Http404('Arquivo não encontrado')
+
+    # No armazenamento deduplicado o nome já é o hash do conteúdo
+    base = os.path.splitext(os.path.basename(campo.name))[0]
+    if re.fullmatch(r'[0-9a-f]{64}', base):
+        etag = f'"{base}"'
+    else:
+        etag = f'"{int(info.st_mtime):x}-{info.st_size:x}"'
+    modificado = info.st_mtime
+    content_type = mimetypes.guess_type(caminho)[0] or 'application/octet-stream'
+    nome_download = nome_download or os.path.basename(campo.name)
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(modificado))
+    if response is None:
+        offload = getattr(settings, 'MEDIA_OFFLOAD', None)
+        if offload == 'x-accel':
+            # O nginx trata Range e envia o arquivo (location "internal")
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = quote(
+                getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protegido/') + campo.name
+            )
+        elif offload == 'x-sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = caminho
+        else:
+            response = _resposta_arquivo(request, caminho, info.st_size, content_type, etag, modificado)
+        response['Content-Disposition'] = f"inline; filename*=UTF-8''{quote(nome_download)}"
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modificado)
+    response['Accept-Ranges'] = 'bytes'
+    # Arquivos com controle de acesso: nunca em caches compartilhados
+    response['Cache-Control'] = 'private, max-age=3600'
+    response['Vary'] = 'Cookie'
+    return response
+
+
+def _resposta_arquivo(request, caminho, tamanho, content_type, etag, modificado):
+    intervalo = None
+    if request.method in ('GET', 'HEAD') and _if_range_vale(request, etag, modificado):
+        try:
+            intervalo = _intervalo(request.headers.get('Range'), tamanho)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{tamanho}'
+            return response
+
+    if intervalo is None:
+        response = StreamingHttpResponse(_ler(caminho, 0, tamanho), content_type=content_type)
+        response['Content-Length'] = str(tamanho)
+        return response
+
+    inicio, fim = intervalo
+    response = StreamingHttpResponse(
+        _ler(caminho, inicio, fim - inicio + 1), status=206, content_type=content_type
+    )
+    response['Content-Range'] = f'bytes {inicio}-{fim}/{tamanho}'
+    response['Content-Length'] = str(fim - inicio + 1)
+    return response
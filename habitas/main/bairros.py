@@ -0,0 +1,68 @@
+"""
+Localização do bairro de um ponto a partir dos polígonos de static/js/bairros.js
+(o mesmo GeoJSON exibido no mapa).
+
+Os polígonos são lidos uma vez por processo; cada consulta filtra pelos
+retângulos envolventes antes do teste ponto-no-polígono (ray casting).
+"""
+
+import json
+from functools import lru_cache
+
+from django.conf import settings
+
+
+def _arquivo():
+    return getattr(settings, 'BAIRROS_GEOJSON', settings.BASE_DIR / 'static' / 'js' / 'bairros.js')
+
+
+@lru_cache(maxsize=1)
+def poligonos():
+    """[(nome, (lon_min, lat_min, lon_max, lat_max), anéis)] de cada bairro"""
+    texto = open(_arquivo(), encoding='utf-8').read()
+    # O arquivo é um script: "const BAIRROS = {...};"
+    dados = json.loads(texto[texto.index('{'):texto.rindex('}') + 1])
+    resultado = []
+    for feature in dados['features']:
+        geometria = feature.get('geometry') or {}
+        if geometria.get('type') == 'Polygon':
+            partes = [geometria['coordinates']]
+        elif geometria.get('type') == 'MultiPolygon':
+            partes = geometria['coordinates']
+        else:
+            continue
+        nome = (feature.get('properties') or {}).get('bairro') or ''
+        for aneis in partes:
+            aneis = [[(ponto[0], ponto[1]) for ponto in anel] for anel in aneis]
+            longitudes = [lon for lon, _ in aneis[0]]
+            latitudes = [lat for _, lat in aneis[0]]
+            caixa = (min(longitudes), min(latitudes), max(longitudes), max(latitudes))
+            resultado.append((nome.strip(), caixa, aneis))
+    return resultado
+
+
+def _dentro(lon, lat, anel):
+    dentro = False
+    j = len(anel) - 1
+    for i in range(len(anel)):
+        xi, yi = anel[i]
+        xj, yj = anel[j]
+        if (yi > lat) != (yj > lat) and lon < (xj - xi) * (lat - yi) / (yj - yi) + xi:
+            dentro = not dentro
+        j = i
+    return dentro
+
+
+def localizar(latitude, longitude):
+    """Nome do bairro que contém o ponto ('' se nenhum)"""
+    if latitude is None or longitude is None:
+        return ''
+    for nome, (lon_min, lat_min, lon_max, lat_max), aneis in poligonos():
+        if not (lon_min <= longitude <= lon_max and lat_min <= latitude <= lat_max):
+            continue
+        # Primeiro anel: contorno; os demais são buracos
+        if _dentro(longitude, latitude, aneis[0]) and not any(
+            _dentro(longitude, latitude, buraco) for buraco in aneis[1:]
+        ):
+            return nome
+    return ''
@@ -0,0 +1,367 @@
+"""
+Simulação de cenários "e se" sobre o inventário, sem gravar em Tree.
+
+Um cenário combina:
+- plantios: [{"especie": id, "bairro": nome, "quantidade": K, "dap"?, "altura"?}]
+- remocoes: [{filtros do mapa, ex. {"bairro": "...", "nome_popular": "..."}}]
+- coeficientes: {"codigo_do_servico": {"CHAVE": valor}} (sobrepostos aos atuais)
+
+O inventário é mantido em memória (por processo) em forma colunar: para
+cada árvore, a posição do seu "estado" (espécie, DAP, altura e valores das
+variáveis usadas nas fórmulas) e o bairro. Os valores dos serviços são
+calculados uma vez por estado distinto (calcular_lote, no sandbox) e
+reaproveitados por todos os cenários; um cenário só avalia os estados
+novos (mudas) e os serviços com coeficientes alterados.
+
+Quando o inventário muda (TreeChange), só as árvores alteradas são relidas
+e só os estados novos são avaliados; a cópia é refeita por inteiro quando
+muda a configuração dos serviços ou a cada CENARIOS_RECARGA_SEGUNDOS (que
+também traz valores de variáveis editados à parte). Os valores por estado
+ficam para no máximo CENARIOS_VALORES_MAX serviços/coeficientes. O
+resultado de cada cenário fica no cache do Django pela chave (hash da
+definição), para comparar vários lado a lado; fórmulas bloqueadas no
+sandbox levantam FormulaBloqueada e não entram em cache.
+"""
+
+import copy
+import hashlib
+import json
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict, defaultdict
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metricas
+from .bairros import poligonos
+from .configuracao import obter_configuracao
+from .filtros import filtros_arvores
+from .models import Species, Tree, TreeChange
+from .projecao import avaliar_estados, resolvedor_variaveis
+
+SEM_MEDIDAS = -1
+
+_inventario = None
+_trava = threading.Lock()
+
+
+@dataclass
+class Inventario:
+    versao: tuple
+    variaveis: list
+    resolver: object
+    # (species_id, dap, altura, valores das variáveis)
+    estados: list
+    # Colunas, uma posição por árvore
+    ids: array
+    estado: array
+    bairro: list
+    # TreeChange.versao_segura() da última leitura (ver _atualizar)
+    segura: int = 0
+    carregado_em: float = field(default_factory=time.monotonic)
+    posicao_por_id: dict = field(default_factory=dict)
+    posicao_estado: dict = field(default_factory=dict)
+    # (estado, bairro) -> número de árvores
+    contagem: Counter = field(default_factory=Counter)
+    # assinatura do serviço -> valor de cada estado (os mais recentes primeiro a sair)
+    valores: OrderedDict = field(default_factory=OrderedDict)
+
+    def valores_servico(self, servico):
+        """Valor do serviço em cada estado do inventário
+
+        Só avalia os estados ainda sem valor (incluídos depois). Guarda no
+        máximo CENARIOS_VALORES_MAX assinaturas; uma fórmula bloqueada
+        levanta FormulaBloqueada e nada é guardado.
+        """
+        assinatura = _assinatura(servico)
+        valores = self.valores.get(assinatura, [])
+        if len(valores) < len(self.estados):
+            valores = valores + avaliar_estados(servico, self.estados[len(valores):], self.variaveis)
+        self.valores[assinatura] = valores
+        self.valores.move_to_end(assinatura)
+        while len(self.valores) > getattr(settings, 'CENARIOS_VALORES_MAX', 32):
+            self.valores.popitem(last=False)
+        return valores
+
+    def incluir(self, tree_id, dap, altura, species_id, bairro, resolver=None):
+        """Inclui (ou atualiza) uma árvore nas colunas e na contagem"""
+        if not dap or not altura or dap <= 0 or altura <= 0:
+            estado = SEM_MEDIDAS
+        else:
+            chave = (species_id, float(dap), float(altura), (resolver or self.resolver)(tree_id, species_id))
+            estado = self.posicao_estado.get(chave)
+            if estado is None:
+                estado = self.posicao_estado[chave] = len(self.estados)
+                self.estados.append(chave)
+        posicao = self.posicao_por_id.get(tree_id)
+        if posicao is None:
+            posicao = self.posicao_por_id[tree_id] = len(self.ids)
+            self.ids.append(tree_id)
+            self.estado.append(estado)
+            self.bairro.append(bairro)
+        else:
+            self._descontar(posicao)
+            self.estado[posicao] = estado
+            self.bairro[posicao] = bairro
+        if estado != SEM_MEDIDAS:
+            self.contagem[(estado, bairro)] += 1
+
+    def remover(self, tree_id):
+        posicao = self.posicao_por_id.get(tree_id)
+        if posicao is not None:
+            self._descontar(posicao)
+            self.estado[posicao] = SEM_MEDIDAS
+
+    def _descontar(self, posicao):
+        chave = (self.estado[posicao], self.bairro[posicao])
+        if chave[0] != SEM_MEDIDAS:
+            self.contagem[chave] -= 1
+            if not self.contagem[chave]:
+                del self.contagem[chave]
+
+    def copia(self, versao):
+        """Cópia independente das colunas (a atual segue servindo outras threads)"""
+        return Inventario(
+            versao=versao, variaveis=self.variaveis, resolver=self.resolver,
+            estados=list(self.estados), ids=array(self.ids.typecode, self.ids),
+            estado=array(self.estado.typecode, self.estado), bairro=list(self.bairro),
+            segura=self.segura, carregado_em=self.carregado_em,
+            posicao_por_id=dict(self.posicao_por_id), posicao_estado=dict(self.posicao_estado),
+            contagem=Counter(self.contagem), valores=OrderedDict(self.valores),
+        )
+
+
+def _assinatura(servico):
+    return (servico.codigo, servico.formula, json.dumps(servico.coeficientes or {}, sort_keys=True))
+
+
+def _versao():
+    return (obter_configuracao().versao, TreeChange.versao_atual())
+
+
+def _colunas(arvores):
+    return arvores.values_list('id', 'dap', 'altura', 'species_id', 'bairro')
+
+
+def _carregar(versao):
+    configuracao = obter_configuracao()
+    dependencias = set().union(*(servico.dependencias() for servico in configuracao.servicos)) \
+        if configuracao.servicos else set()
+    variaveis = [variavel for variavel in configuracao.variaveis if variavel.codigo in dependencias]
+
+    inventario = Inventario(
+        versao=versao, variaveis=variaveis, resolver=resolvedor_variaveis(variaveis),
+        estados=[], ids=array('q'), estado=array('q'), bairro=[],
+        segura=TreeChange.versao_segura(),
+    )
+    nomes = {}
+    for tree_id, dap, altura, species_id, bairro in _colunas(Tree.objects.order_by('id')).iterator(chunk_size=5000):
+        inventario.incluir(tree_id, dap, altura, species_id, nomes.setdefault(bairro, bairro))
+    return inventario
+
+
+def _atualizar(inventario, versao):
+    """Cópia do inventário com as árvores alteradas desde a última leitura
+
+    Relê as alterações desde a versão segura anterior (não só as acima da
+    versão atual), para pegar transações que terminaram fora de ordem;
+    reaplicar uma árvore é inofensivo. Os valores dos estados já avaliados
+    são reaproveitados. Acima de CENARIOS_ALTERACOES_MAX árvores, recarrega.
+    """
+    alteradas = set(TreeChange.objects.filter(id__gt=inventario.segura).values_list('tree_id', flat=True))
+    if len(alteradas) > getattr(settings, 'CENARIOS_ALTERACOES_MAX', 5000):
+        return _carregar(versao)
+    novo = inventario.copia(versao)
+    novo.segura = TreeChange.versao_segura()
+    # Valores das variáveis lidos de novo só para as árvores alteradas
+    resolver = resolvedor_variaveis(novo.variaveis, alteradas)
+    encontradas = set()
+    for tree_id, dap, altura, species_id, bairro in _colunas(Tree.objects.filter(id__in=alteradas)):
+        novo.incluir(tree_id, dap, altura, species_id, bairro, resolver)
+        encontradas.add(tree_id)
+    for tree_id in alteradas - encontradas:
+        novo.remover(tree_id)
+    return novo
+
+
+def obter_inventario():
+    """Cópia colunar do inventário, atualizada quando a versão muda
+
+    Mudanças no inventário (TreeChange) só relêem as árvores alteradas;
+    mudanças na configuração, ou uma cópia com mais de
+    CENARIOS_RECARGA_SEGUNDOS, recarregam tudo.
+    """
+    global _inventario
+    versao = _versao()
+    with _trava:
+        if (
+            _inventario is None
+            or _inventario.versao[0] != versao[0]
+            or time.monotonic() - _inventario.carregado_em > getattr(settings, 'CENARIOS_RECARGA_SEGUNDOS', 3600)
+        ):
+            _inventario = _carregar(versao)
+        elif _inventario.versao != versao:
+            _inventario = _atualizar(_inventario, versao)
+        return _inventario
+
+
+def invalidar_inventario():
+    global _inventario
+    with _trava:
+        _inventario = None
+
+
+# ============ DEFINIÇÃO ============
+
+def _numero(valor, nome, minimo=0.0):
+    try:
+        valor = float(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f'{nome} deve ser um número')
+    if valor <= minimo:
+        raise ValueError(f'{nome} deve ser maior que {minimo:g}')
+    return valor
+
+
+def normalizar(definicao):
+    """Valida a definição e a devolve em forma canônica (levanta ValueError)"""
+    if not isinstance(definicao, dict):
+        raise ValueError('O cenário deve ser um objeto JSON')
+    desconhecidas = set(definicao) - {'nome', 'plantios', 'remocoes', 'coeficientes'}
+    if desconhecidas:
+        raise ValueError(f'Campos desconhecidos: {", ".join(sorted(desconhecidas))}')
+
+    bairros = {nome for nome, _, _ in poligonos()}
+    plantios = []
+    for plantio in definicao.get('plantios') or []:
+        if not isinstance(plantio, dict):
+            raise ValueError('Cada plantio deve ser um objeto')
+        especie = Species.objects.filter(id=plantio.get('especie')).first() \
+            if str(plantio.get('especie', '')).isdigit() else None
+        if especie is None:
+            raise ValueError(f'Espécie não encontrada: {plantio.get("especie")}')
+        if plantio.get('bairro', '') not in bairros:
+            raise ValueError(f'Bairro não encontrado: {plantio.get("bairro")}')
+        quantidade = int(_numero(plantio.get('quantidade'), 'quantidade'))
+        if quantidade > getattr(settings, 'CENARIOS_PLANTIO_MAX', 100000):
+            raise ValueError('quantidade acima do limite de plantio')
+        plantios.append({
+            'especie': especie.id,
+            'bairro': plantio['bairro'],
+            'quantidade': quantidade,
+            'dap': _numero(plantio.get('dap', getattr(settings, 'CENARIOS_MUDA_DAP', 3)), 'dap'),
+            'altura': _numero(plantio.get('altura', getattr(settings, 'CENARIOS_MUDA_ALTURA', 2)), 'altura'),
+        })
+
+    remocoes = []
+    for remocao in definicao.get('remocoes') or []:
+        if not isinstance(remocao, dict) or not filtros_arvores(remocao):
+            raise ValueError('Cada remoção precisa de ao menos um filtro do mapa')
+        remocoes.append({chave: str(valor) for chave, valor in sorted(remocao.items())})
+
+    servicos = obter_configuracao().servicos_por_codigo
+    coeficientes = {}
+    for codigo, valores in sorted((definicao.get('coeficientes') or {}).items()):
+        if codigo not in servicos:
+            raise ValueError(f'Serviço não encontrado: {codigo}')
+        if not isinstance(valores, dict):
+            raise ValueError('Os coeficientes devem ser um objeto JSON')
+        coeficientes[codigo] = {chave: _numero(valor, chave, float('-inf')) for chave, valor in valores.items()}
+
+    return {'plantios': plantios, 'remocoes': remocoes, 'coeficientes': coeficientes}
+
+
+def chave_cenario(definicao):
+    """Hash da definição normalizada"""
+    texto = json.dumps(definicao, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(texto.encode()).hexdigest()
+
+
+# ============ AVALIAÇÃO ============
+
+def simular(definicao):
+    """Totais atuais e do cenário, por serviço e por bairro
+
+    "definicao" já normalizada (ver normalizar).
+    """
+    inicio = time.monotonic()
+    inventario = obter_inventario()
+    servicos = obter_configuracao().servicos
+
+    contagem = Counter(inventario.contagem)
+    removidas = set()
+    for remocao in definicao['remocoes']:
+        removidas.update(Tree.objects.filter(**filtros_arvores(remocao)).values_list('id', flat=True))
+    for tree_id in removidas:
+        posicao = inventario.posicao_por_id.get(tree_id)
+        if posicao is not None and inventario.estado[posicao] != SEM_MEDIDAS:
+            contagem[(inventario.estado[posicao], inventario.bairro[posicao])] -= 1
+
+    # Mudas: estados novos, depois dos do inventário
+    novos = []
+    for plantio in definicao['plantios']:
+        estado = (
+            plantio['especie'], plantio['dap'], plantio['altura'],
+            inventario.resolver(None, plantio['especie']),
+        )
+        contagem[(len(inventario.estados) + len(novos), plantio['bairro'])] += plantio['quantidade']
+        novos.append(estado)
+
+    resultado_servicos = []
+    bairros = defaultdict(dict)
+    for servico in servicos:
+        atual = inventario.valores_servico(servico)
+        alterado = servico
+        if servico.codigo in definicao['coeficientes']:
+            alterado = copy.copy(servico)
+            alterado.coeficientes = {**(servico.coeficientes or {}), **definicao['coeficientes'][servico.codigo]}
+        cenario = inventario.valores_servico(alterado) + avaliar_estados(alterado, novos, inventario.variaveis)
+
+        total_atual = total_cenario = 0.0
+        por_bairro = defaultdict(lambda: [0.0, 0.0])
+        for (estado, bairro), quantidade in inventario.contagem.items():
+            por_bairro[bairro][0] += atual[estado] * quantidade
+            total_atual += atual[estado] * quantidade
+        for (estado, bairro), quantidade in contagem.items():
+            por_bairro[bairro][1] += cenario[estado] * quantidade
+            total_cenario += cenario[estado] * quantidade
+
+        unitario = servico.valor_monetario_unitario or 0
+        resultado_servicos.append({
+            'codigo': servico.codigo,
+            'nome': servico.nome,
+            'unidade': servico.unidade_medida,
+            'atual': round(total_atual, 4),
+            'cenario': round(total_cenario, 4),
+            'diferenca': round(total_cenario - total_atual, 4),
+            'valor_monetario_atual': round(total_atual * unitario, 2),
+            'valor_monetario_cenario': round(total_cenario * unitario, 2),
+        })
+        for bairro, (valor_atual, valor_cenario) in por_bairro.items():
+            if round(valor_atual - valor_cenario, 4):
+                bairros[bairro or ''][servico.codigo] = round(valor_cenario - valor_atual, 4)
+
+    return {
+        'servicos': resultado_servicos,
+        'diferenca_por_bairro': dict(sorted(bairros.items())),
+        'arvores_atual': sum(inventario.contagem.values()),
+        'arvores_cenario': sum(contagem.values()),
+        'removidas': len(removidas),
+        'plantadas': sum(plantio['quantidade'] for plantio in definicao['plantios']),
+        'tempo_ms': round((time.monotonic() - inicio) * 1000),
+    }
+
+
+def simular_em_cache(chave, definicao):
+    """simular() guardado no cache do Django pela chave e pelas versões"""
+    configuracao, inventario = _versao()
+    chave_cache = f'cenario:{chave}:{configuracao}:{inventario}'
+    resultado = cache.get(chave_cache)
+    metricas.cache('cenarios', resultado is not None)
+    if resultado is None:
+        resultado = simular(definicao)
+        cache.set(chave_cache, resultado, getattr(settings, 'CENARIOS_CACHE_SEGUNDOS', 3600))
+    return resultado
@@ -1,44 +1,102 @@
 from django_unicorn.components import UnicornView
 from ..models import Tree, Post
+from ..paginacao import codificar_cursor, decodificar_cursor, antes_do_cursor, ate_o_cursor
+
+# Comentários carregados por página ("Carregar mais")
+POSTS_POR_PAGINA = 10
 
 
 class PostsView(UnicornView):
     tree: Tree = None
-    posts: Post = None
+    posts = None
     content: str = ""
     error: str = ""
+    total: int = 0
+    tem_mais: bool = False
+    # Chave (created_on, id) do último comentário carregado, no formato "<iso>|<id>"
+    cursor: str = ""
+
+    class Meta:
+        # Os comentários ficam só no servidor (componente em cache) e no HTML;
+        # não são serializados nem reenviados pelo cliente a cada interação
+        javascript_exclude = ("posts",)
 
     def mount(self):
-        self.posts = Post.objects.filter(tree=self.tree)
+        self._carregar_inicio()
         return super().mount()
 
+    def hydrate(self):
+        # Componente fora do cache: recarrega apenas a janela já exibida
+        if self.posts is None:
+            chave = decodificar_cursor(self.cursor)
+            if self.tree and chave:
+                self.posts = list(
+                    Post.objects.filter(tree=self.tree)
+                    .filter(ate_o_cursor('created_on', *chave))
+                    .order_by('-created_on', '-id')
+                )
+            else:
+                self.posts = []
+
     def update(self, id):
         self.tree = Tree.objects.get(id=int(id))
-        self.posts = Post.objects.filter(tree=self.tree)
+        self._carregar_inicio()
+
+    def load_more(self):
+        chave = decodificar_cursor(self.cursor)
+        if not self.tree or not chave:
+            return
+        self._anexar_pagina(
+            Post.objects.filter(tree=self.tree).filter(antes_do_cursor('created_on', *chave))
+        )
 
     def submit(self):
         if not self.content:
             self.error = "Por favor, escreva um comentário"
             return
-        
+
         if not self.request.user.is_authenticated:
             self.error = "Você precisa estar logado para comentar"
             return
-        
+
         # Verifica se o usuário é técnico ou gestor automaticamente
         is_specialized = False
         if hasattr(self.request.user, 'is_tecnico') and hasattr(self.request.user, 'is_gestor'):
             is_specialized = self.request.user.is_tecnico() or self.request.user.is_gestor()
-        
-        Post.objects.create(
+
+        post = Post.objects.create(
             tree=self.tree,
             author=self.request.user.username,
             content=self.content,
             specialized=is_specialized
         )
-        
+
         # Reset
         self.content = ""
         self.error = ""
-        self.posts = Post.objects.filter(tree=self.tree)
+        # O novo comentário é o mais recente: entra no topo, sem reconsultar a lista
+        self.posts.insert(0, post)
+        self.total += 1
+        if not self.cursor:
+            self._mover_cursor(post)
+
+    def _carregar_inicio(self):
+        self.posts = []
+        self.cursor = ""
+        self.tem_mais = False
+        self.total = 0
+        if self.tree:
+            self.total = Post.objects.filter(tree=self.tree).count()
+            self._anexar_pagina(Post.objects.filter(tree=self.tree))
+
+    def _anexar_pagina(self, queryset):
+        # Busca um item a mais para saber se existe próxima página
+        pagina = list(queryset.order_by('-created_on', '-id')[:POSTS_POR_PAGINA + 1])
+        self.tem_mais = len(pagina) > POSTS_POR_PAGINA
+        pagina = pagina[:POSTS_POR_PAGINA]
+        self.posts.extend(pagina)
+        if pagina:
+            self._mover_cursor(pagina[-1])
 
+    def _mover_cursor(self, post):
+        self.cursor = codificar_cursor(post.created_on, post.id)
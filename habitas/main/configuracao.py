@@ -0,0 +1,97 @@
+"""
+Cópia em memória (por processo) da configuração ativa de serviços
+ecossistêmicos e variáveis customizadas.
+
+Os serviços vêm com a fórmula já compilada, e as variáveis ficam indexadas
+pelo código. Assim calcular() e get_all_ecosystem_services() não consultam
+o banco a cada árvore.
+
+A cópia é validada pelo contador VersaoConfiguracao, que os signals
+incrementam a cada alteração:
+- dentro de uma requisição, o contador é lido uma única vez (na primeira
+  chamada a obter_configuracao);
+- fora de requisições (comandos, shell, testes), é lido a cada chamada.
+Alterações feitas no próprio processo descartam a cópia imediatamente.
+"""
+
+import threading
+from dataclasses import dataclass, field
+
+from django.core.signals import request_finished, request_started
+
+from . import metricas
+
+_snapshot = None
+_trava = threading.Lock()
+_local = threading.local()
+
+
+@dataclass
+class Configuracao:
+    versao: int
+    # EcosystemServiceConfig ativos, na ordem de exibição
+    servicos: list = field(default_factory=list)
+    # TreeVariable ativas
+    variaveis: list = field(default_factory=list)
+
+    def __post_init__(self):
+        self.servicos_por_codigo = {servico.codigo: servico for servico in self.servicos}
+        self.variaveis_por_codigo = {variavel.codigo: variavel for variavel in self.variaveis}
+
+
+def _carregar(versao):
+    from .models import EcosystemServiceConfig, TreeVariable
+
+    servicos = list(EcosystemServiceConfig.objects.filter(ativo=True).order_by('ordem_exibicao'))
+    for servico in servicos:
+        try:
+            servico.formula_compilada()
+        except SyntaxError:
+            # O erro aparece (e é registrado) em calcular()
+            pass
+    return Configuracao(
+        versao=versao,
+        servicos=servicos,
+        variaveis=list(TreeVariable.objects.filter(ativo=True)),
+    )
+
+
+def obter_configuracao():
+    """Configuração ativa, recarregada só quando a versão no banco muda"""
+    global _snapshot
+    from .models import VersaoConfiguracao
+
+    snapshot = _snapshot
+    if snapshot is not None and getattr(_local, 'verificado', False):
+        return snapshot
+
+    versao = VersaoConfiguracao.atual()
+    metricas.cache('configuracao', snapshot is not None and snapshot.versao == versao)
+    if snapshot is None or snapshot.versao != versao:
+        with _trava:
+            if _snapshot is None or _snapshot.versao != versao:
+                _snapshot = _carregar(versao)
+            snapshot = _snapshot
+    _local.verificado = getattr(_local, 'em_requisicao', False)
+    return snapshot
+
+
+def invalidar_configuracao():
+    """Descarta a cópia deste processo (chamado pelos signals)"""
+    global _snapshot
+    _snapshot = None
+    _local.verificado = False
+
+
+def _inicio_requisicao(**kwargs):
+    _local.em_requisicao = True
+    _local.verificado = False
+
+
+def _fim_requisicao(**kwargs):
+    _local.em_requisicao = False
+    _local.verificado = False
+
+
+request_started.connect(_inicio_requisicao, dispatch_uid='configuracao_inicio_requisicao')
+request_finished.connect(_fim_requisicao, dispatch_uid='configuracao_fim_requisicao')
@@ -0,0 +1,75 @@
+"""
+Vínculo das árvores com o catálogo de espécies (Tree.species).
+
+Os nomes do inventário vêm da prefeitura com grafias variadas ("Ipê-roxo",
+"IPE ROXO", "Handroanthus impetiginosus (Mart. ex DC.) Mattos"). Os nomes
+são normalizados (sem acentos, minúsculas, sem autor nem "sp.") e buscados
+em um índice montado uma vez com:
+- Species.name (nome científico);
+- SinonimoEspecie (sinônimos científicos e nomes populares).
+
+Como o inventário tem poucas combinações distintas de nomes, cada
+combinação é resolvida uma vez e o resultado vale para todas as árvores.
+"""
+
+import re
+import unicodedata
+
+from .models import SinonimoEspecie, Species
+
+# Qualificadores que não identificam a espécie
+_IGNORAR = {'sp', 'spp', 'cf', 'aff', 'var', 'subsp', 'ssp', 'f'}
+
+
+def normalizar_nome(nome):
+    """Forma canônica de um nome: sem acentos, autor, pontuação e qualificadores"""
+    if not nome:
+        return ''
+    texto = unicodedata.normalize('NFKD', str(nome))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    texto = re.sub(r'\(.*?\)', ' ', texto)
+    palavras = [p for p in re.split(r'[^a-z0-9]+', texto) if p and p not in _IGNORAR]
+    return ' '.join(palavras)
+
+
+def _binomio(normalizado):
+    """Gênero + epíteto (descarta autor e variedades)"""
+    return ' '.join(normalizado.split()[:2])
+
+
+class IndiceEspecies:
+    """Nomes normalizados -> id da espécie
+
+    Nomes que apontam para mais de uma espécie são ambíguos e não resolvem.
+    """
+
+    def __init__(self):
+        self.cientificos = {}
+        self.populares = {}
+        for species_id, nome in Species.objects.values_list('id', 'name'):
+            normalizado = normalizar_nome(nome)
+            self._incluir(self.cientificos, normalizado, species_id)
+            if _binomio(normalizado) != normalizado:
+                self._incluir(self.cientificos, _binomio(normalizado), species_id)
+        for species_id, normalizado, tipo in SinonimoEspecie.objects.values_list(
+            'species_id', 'nome_normalizado', 'tipo'
+        ):
+            destino = self.populares if tipo == SinonimoEspecie.Tipo.POPULAR else self.cientificos
+            self._incluir(destino, normalizado, species_id)
+
+    @staticmethod
+    def _incluir(indice, nome, species_id):
+        if not nome:
+            return
+        if indice.get(nome, species_id) != species_id:
+            indice[nome] = None  # ambíguo
+        else:
+            indice[nome] = species_id
+
+    def resolver(self, nome_cientifico, nome_popular=''):
+        """Id da espécie (ou None) pelo nome científico e, na falta, pelo popular"""
+        cientifico = normalizar_nome(nome_cientifico)
+        for chave in (cientifico, _binomio(cientifico)):
+            if self.cientificos.get(chave):
+                return self.cientificos[chave]
+        return self.populares.get(normalizar_nome(nome_popular))
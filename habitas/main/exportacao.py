@@ -0,0 +1,182 @@
+"""
+Exportação de árvores em CSV, GeoJSON e Parquet, gerada em streaming.
+
+As linhas são lidas com .iterator(chunk_size=...) e convertidas lote a lote,
+de modo que nem o queryset nem o arquivo completo ficam em memória (ao
+contrário do caminho do django-import-export, que monta tudo com tablib).
+Os valores dos serviços ecossistêmicos vêm da tabela materializada
+(TreeServiceValue), buscados uma vez por lote.
+"""
+
+import csv
+import json
+
+from .configuracao import obter_configuracao
+from .models import Tree, TreeServiceValue
+
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'geojson': ('application/geo+json', 'geojson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+CAMPOS = [
+    'id', 'N_placa', 'nome_popular', 'nome_cientifico', 'dap', 'altura',
+    'latitude', 'longitude', 'origem', 'plantado_por', 'tem_laudo',
+]
+
+CHUNK_SIZE = 2000
+
+
+class FormatoIndisponivel(Exception):
+    """Formato desconhecido ou sem a dependência opcional instalada"""
+
+
+def _lotes(queryset, chunk_size):
+    lote = []
+    for linha in queryset.values(*CAMPOS).iterator(chunk_size=chunk_size):
+        lote.append(linha)
+        if len(lote) >= chunk_size:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _colunas_servicos(servicos):
+    colunas = []
+    for servico in servicos:
+        colunas += [servico.codigo, f"{servico.codigo}_valor_monetario"]
+    return colunas
+
+
+def _linhas(filters, incluir_servicos, chunk_size):
+    """Gera lotes de dicionários (campos da árvore + colunas de serviços)"""
+    servicos = obter_configuracao().servicos if incluir_servicos else []
+    queryset = Tree.objects.filter(**filters).order_by('id')
+    for lote in _lotes(queryset, chunk_size):
+        if servicos:
+            valores = {}
+            for tree_id, servico_id, fisico, monetario in TreeServiceValue.objects.filter(
+                tree_id__in=[linha['id'] for linha in lote], servico__in=servicos
+            ).values_list('tree_id', 'servico_id', 'valor_fisico', 'valor_monetario'):
+                valores[(tree_id, servico_id)] = (fisico, monetario)
+            for linha in lote:
+                for servico in servicos:
+                    fisico, monetario = valores.get((linha['id'], servico.id), (None, None))
+                    linha[servico.codigo] = fisico
+                    linha[f"{servico.codigo}_valor_monetario"] = monetario
+        yield servicos, lote
+
+
+class _Eco:
+    """Pseudo-arquivo que devolve o que for escrito (csv.writer em streaming)"""
+
+    def write(self, value):
+        return value
+
+
+def gerar_csv(filters, incluir_servicos=False, chunk_size=CHUNK_SIZE):
+    writer = csv.writer(_Eco(), delimiter=';')
+    cabecalho = None
+    for servicos, lote in _linhas(filters, incluir_servicos, chunk_size):
+        if cabecalho is None:
+            cabecalho = CAMPOS + _colunas_servicos(servicos)
+            yield writer.writerow(cabecalho)
+        yield ''.join(writer.writerow([linha.get(campo) for campo in cabecalho]) for linha in lote)
+    if cabecalho is None:
+        yield writer.writerow(CAMPOS)
+
+
+def gerar_geojson(filters, incluir_servicos=False, chunk_size=CHUNK_SIZE):
+    yield '{"type": "FeatureCollection", "features": ['
+    primeiro = True
+    for _, lote in _linhas(filters, incluir_servicos, chunk_size):
+        features = []
+        for linha in lote:
+            geometria = {'type': 'Point', 'coordinates': [linha['longitude'], linha['latitude']]}
+            features.append(json.dumps(
+                {'type': 'Feature', 'id': linha['id'], 'geometry': geometria, 'properties': linha},
+                ensure_ascii=False,
+            ))
+        if features:
+            yield ('' if primeiro else ',') + ','.join(features)
+            primeiro = False
+    yield ']}'
+
+
+class _BufferParquet:
+    """Destino do ParquetWriter que entrega os bytes escritos a cada lote"""
+
+    def __init__(self):
+        self.partes = []
+        self.posicao = 0
+        self.closed = False
+
+    def write(self, data):
+        self.partes.append(bytes(data))
+        self.posicao += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.posicao
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def esvaziar(self):
+        dados = b''.join(self.partes)
+        self.partes = []
+        return dados
+
+
+def _schema_parquet(pa, servicos):
+    tipos = {'id': pa.int64(), 'dap': pa.int64(), 'N_placa': pa.float64(),
+             'altura': pa.float64(), 'latitude': pa.float64(), 'longitude': pa.float64(),
+             'tem_laudo': pa.bool_()}
+    return pa.schema(
+        [(campo, tipos.get(campo, pa.string())) for campo in CAMPOS]
+        + [(coluna, pa.float64()) for coluna in _colunas_servicos(servicos)]
+    )
+
+
+def gerar_parquet(filters, incluir_servicos=False, chunk_size=CHUNK_SIZE):
+    """Verifica o pyarrow já na chamada, antes de a resposta começar"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise FormatoIndisponivel('A exportação em Parquet requer o pacote pyarrow.')
+    return _gerar_parquet(pa, pq, filters, incluir_servicos, chunk_size)
+
+
+def _gerar_parquet(pa, pq, filters, incluir_servicos, chunk_size):
+    buffer = _BufferParquet()
+    writer = None
+    for servicos, lote in _linhas(filters, incluir_servicos, chunk_size):
+        if writer is None:
+            writer = pq.ParquetWriter(buffer, _schema_parquet(pa, servicos), compression='snappy')
+        # Um row group por lote
+        writer.write_table(pa.Table.from_pylist(lote, schema=writer.schema))
+        yield buffer.esvaziar()
+    if writer is None:
+        writer = pq.ParquetWriter(buffer, _schema_parquet(pa, []))
+    writer.close()
+    yield buffer.esvaziar()
+
+
+GERADORES = {
+    'csv': gerar_csv,
+    'geojson': gerar_geojson,
+    'parquet': gerar_parquet,
+}
+
+
+def exportar(formato, filters, incluir_servicos=False, chunk_size=CHUNK_SIZE):
+    """Retorna o gerador de conteúdo do formato pedido"""
+    if formato not in GERADORES:
+        raise FormatoIndisponivel(f'Formato desconhecido: {formato}')
+    return GERADORES[formato](filters, incluir_servicos, chunk_size)
@@ -0,0 +1,26 @@
+def filtros_arvores(params):
+    """Converte os parâmetros de filtro do mapa (querystring) em filtros do ORM"""
+    filters = {}
+    if params.get("nome_popular"):
+        filters["nome_popular__icontains"] = params["nome_popular"]
+    if params.get("nome_cientifico"):
+        filters["nome_cientifico__icontains"] = params["nome_cientifico"]
+    if params.get("plantado_por"):
+        filters["plantado_por__icontains"] = params["plantado_por"]
+    if params.get("species"):
+        filters["nome_popular"] = params["species"]
+    if params.get("bairro"):
+        filters["bairro"] = params["bairro"]
+    if params.get("origem"):
+        filters["origem"] = params["origem"]
+    if params.get("laudo_only"):
+        filters["tem_laudo"] = True
+    if params.get("altura_min"):
+        filters["altura__gte"] = params["altura_min"]
+    if params.get("altura_max"):
+        filters["altura__lte"] = params["altura_max"]
+    if params.get("dap_min"):
+        filters["dap__gte"] = params["dap_min"]
+    if params.get("dap_max"):
+        filters["dap__lte"] = params["dap_max"]
+    return filters
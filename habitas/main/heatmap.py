@@ -0,0 +1,256 @@
+"""
+Mapa de calor dos serviços ecossistêmicos em tiles PNG.
+
+Os valores materializados (TreeServiceValue) são agregados em uma grade
+Web Mercator multirresolução (HeatmapCell). Cada tile 256x256 do zoom z é
+desenhado a partir do nível z + DESLOCAMENTO_NIVEL da grade, ou seja, com
+células de CELULA_PX pixels. Os PNGs gerados ficam em disco, por
+(versão da configuração, medida, z, x, y); reconstruir a grade limpa o cache.
+
+A grade só muda em construir_grade (comando materializar_servicos): árvores
+alteradas depois disso só aparecem nos tiles na próxima reconstrução. Por
+isso a chave do cache não inclui TreeChange.versao_atual(), que mudaria sem
+que o tile mudasse. O cache tem tamanho máximo (HEATMAP_CACHE_MAX_BYTES):
+ao ultrapassá-lo, os tiles de configurações antigas e depois os menos usados
+recentemente (mtime) são removidos. Como no acervo, o tamanho é mantido em
+memória e o diretório só é varrido quando passa do limite ou a cada
+HEATMAP_VERIFICACAO_SEGUNDOS.
+"""
+
+import io
+import math
+import os
+import shutil
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from PIL import Image, ImageDraw
+
+from . import metricas
+from .models import Tree, TreeServiceValue, HeatmapCell, HeatmapNivel, versao_configuracao
+
+TILE_SIZE = 256
+CELULA_PX = 8
+CELULAS_POR_TILE = TILE_SIZE // CELULA_PX
+DESLOCAMENTO_NIVEL = int(math.log2(CELULAS_POR_TILE))
+
+MEDIDA_ARVORES = 'arvores'
+
+# Escala de cores (amarelo -> vermelho) aplicada à intensidade normalizada
+GRADIENTE = [
+    (0.0, (255, 255, 178)),
+    (0.25, (254, 204, 92)),
+    (0.5, (253, 141, 60)),
+    (0.75, (240, 59, 32)),
+    (1.0, (189, 0, 38)),
+]
+
+
+def zoom_min():
+    return getattr(settings, 'HEATMAP_ZOOM_MIN', 11)
+
+
+def zoom_max():
+    return getattr(settings, 'HEATMAP_ZOOM_MAX', 17)
+
+
+# Tamanho conhecido do cache em disco (bytes), por processo
+_uso = {'bytes': None, 'medido_em': 0.0, 'diretorio': None}
+_trava_uso = threading.Lock()
+
+
+def diretorio_cache():
+    return Path(getattr(settings, 'HEATMAP_CACHE_DIR', settings.BASE_DIR / 'cache' / 'heatmap'))
+
+
+def tile_valido(z, x, y):
+    """x e y dentro da grade de tiles do zoom z"""
+    return 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _coordenadas_normalizadas(latitude, longitude):
+    """Projeção Web Mercator normalizada para [0, 1) (origem no canto superior esquerdo)"""
+    latitude = max(min(latitude, 85.0511), -85.0511)
+    sin = math.sin(math.radians(latitude))
+    x = (longitude + 180.0) / 360.0
+    y = 0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)
+    return x, y
+
+
+def construir_grade():
+    """Reconstrói a grade multirresolução a partir dos valores materializados"""
+    niveis = range(zoom_min() + DESLOCAMENTO_NIVEL, zoom_max() + DESLOCAMENTO_NIVEL + 1)
+
+    # Valores por árvore: {tree_id: {medida: valor}}
+    valores = defaultdict(dict)
+    for tree_id, codigo, valor in TreeServiceValue.objects.filter(
+        servico__ativo=True
+    ).values_list('tree_id', 'servico__codigo', 'valor_fisico').iterator(chunk_size=10000):
+        valores[tree_id][codigo] = valor
+
+    celulas = {nivel: defaultdict(lambda: defaultdict(float)) for nivel in niveis}
+    for tree_id, latitude, longitude in Tree.objects.values_list(
+        'id', 'latitude', 'longitude'
+    ).iterator(chunk_size=10000):
+        x, y = _coordenadas_normalizadas(latitude, longitude)
+        medidas = valores.get(tree_id, {})
+        for nivel in niveis:
+            escala = 1 << nivel
+            totais = celulas[nivel][(int(x * escala), int(y * escala))]
+            totais[MEDIDA_ARVORES] += 1
+            for codigo, valor in medidas.items():
+                totais[codigo] += valor
+
+    with transaction.atomic():
+        HeatmapCell.objects.all().delete()
+        HeatmapNivel.objects.all().delete()
+        for nivel, grade in celulas.items():
+            maximos = defaultdict(float)
+            registros = []
+            for (cx, cy), totais in grade.items():
+                for medida, valor in totais.items():
+                    maximos[medida] = max(maximos[medida], valor)
+                registros.append(HeatmapCell(nivel=nivel, cx=cx, cy=cy, totais=dict(totais)))
+            HeatmapCell.objects.bulk_create(registros, batch_size=2000)
+            HeatmapNivel.objects.create(nivel=nivel, maximos=dict(maximos))
+
+    limpar_cache()
+
+
+def limpar_cache():
+    shutil.rmtree(diretorio_cache(), ignore_errors=True)
+    with _trava_uso:
+        _uso.update(bytes=None, diretorio=None)
+
+
+def _registrar_gravacao(tamanho):
+    """Soma o tile gravado ao tamanho conhecido e limita o cache se preciso"""
+    with _trava_uso:
+        if _uso['diretorio'] != diretorio_cache():
+            _uso['bytes'] = None
+        if _uso['bytes'] is not None:
+            _uso['bytes'] += tamanho
+        precisa_medir = (
+            _uso['bytes'] is None
+            or _uso['bytes'] > getattr(settings, 'HEATMAP_CACHE_MAX_BYTES', 512 * 1024 ** 2)
+            or time.monotonic() - _uso['medido_em'] > getattr(settings, 'HEATMAP_VERIFICACAO_SEGUNDOS', 300)
+        )
+    if precisa_medir:
+        limitar_tamanho()
+
+
+def limitar_tamanho():
+    """Remove tiles até o cache caber em HEATMAP_CACHE_MAX_BYTES
+
+    Tiles de versões antigas da configuração nunca mais são lidos e saem
+    primeiro; depois, os menos usados recentemente, até ficar 10% abaixo
+    do limite.
+    """
+    maximo = getattr(settings, 'HEATMAP_CACHE_MAX_BYTES', 512 * 1024 ** 2)
+    versao = versao_configuracao()
+    tiles = []
+    for arquivo in diretorio_cache().glob('*/*/*/*/*.png'):
+        try:
+            info = arquivo.stat()
+        except FileNotFoundError:
+            continue
+        antigo = arquivo.relative_to(diretorio_cache()).parts[0] != versao
+        tiles.append((not antigo, info.st_mtime, info.st_size, arquivo))
+
+    total = sum(tamanho for _, _, tamanho, _ in tiles)
+    if total > maximo:
+        for _, _, tamanho, arquivo in sorted(tiles):
+            if total <= maximo * 0.9:
+                break
+            arquivo.unlink(missing_ok=True)
+            total -= tamanho
+    with _trava_uso:
+        _uso.update(bytes=total, medido_em=time.monotonic(), diretorio=diretorio_cache())
+
+
+def _cor(intensidade):
+    """Interpola o gradiente para uma intensidade em [0, 1] (RGBA)"""
+    for (t0, c0), (t1, c1) in zip(GRADIENTE, GRADIENTE[1:]):
+        if intensidade <= t1:
+            f = (intensidade - t0) / (t1 - t0)
+            rgb = tuple(int(a + (b - a) * f) for a, b in zip(c0, c1))
+            break
+    else:
+        rgb = GRADIENTE[-1][1]
+    return rgb + (int(90 + 130 * intensidade),)
+
+
+def _desenhar_tile(medida, z, x, y):
+    imagem = Image.new('RGBA', (TILE_SIZE, TILE_SIZE), (0, 0, 0, 0))
+    if not zoom_min() <= z <= zoom_max():
+        return imagem
+
+    nivel = z + DESLOCAMENTO_NIVEL
+    maximo = (
+        HeatmapNivel.objects.filter(nivel=nivel)
+        .values_list('maximos', flat=True)
+        .first() or {}
+    ).get(medida, 0)
+    if maximo <= 0:
+        return imagem
+
+    x0, y0 = x * CELULAS_POR_TILE, y * CELULAS_POR_TILE
+    celulas = HeatmapCell.objects.filter(
+        nivel=nivel,
+        cx__gte=x0, cx__lt=x0 + CELULAS_POR_TILE,
+        cy__gte=y0, cy__lt=y0 + CELULAS_POR_TILE,
+    ).values_list('cx', 'cy', 'totais')
+
+    desenho = ImageDraw.Draw(imagem)
+    # Escala logarítmica: poucas células muito densas não apagam o restante
+    escala = math.log1p(maximo)
+    for cx, cy, totais in celulas:
+        valor = totais.get(medida, 0)
+        if valor <= 0:
+            continue
+        intensidade = min(math.log1p(valor) / escala, 1.0)
+        px, py = (cx - x0) * CELULA_PX, (cy - y0) * CELULA_PX
+        desenho.rectangle([px, py, px + CELULA_PX - 1, py + CELULA_PX - 1], fill=_cor(intensidade))
+    return imagem
+
+
+def _png(imagem):
+    buffer = io.BytesIO()
+    imagem.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def renderizar_tile(medida, z, x, y):
+    """Retorna o PNG do tile, usando o cache em disco quando disponível
+
+    Fora de HEATMAP_ZOOM_MIN..HEATMAP_ZOOM_MAX o tile é vazio e não é gravado.
+    """
+    if not zoom_min() <= z <= zoom_max():
+        return _png(Image.new('RGBA', (TILE_SIZE, TILE_SIZE), (0, 0, 0, 0)))
+
+    caminho = diretorio_cache() / versao_configuracao() / medida / str(z) / str(x) / f"{y}.png"
+    try:
+        conteudo = caminho.read_bytes()
+    except FileNotFoundError:
+        conteudo = None
+    metricas.cache('heatmap', conteudo is not None)
+    if conteudo is not None:
+        # Marca o uso para a política LRU
+        try:
+            os.utime(caminho)
+        except FileNotFoundError:
+            pass
+        return conteudo
+
+    conteudo = _png(_desenhar_tile(medida, z, x, y))
+
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    temporario = caminho.with_name(f"{y}.{os.getpid()}.tmp")
+    temporario.write_bytes(conteudo)
+    temporario.replace(caminho)
+    _registrar_gravacao(len(conteudo))
+    return conteudo
@@ -0,0 +1,159 @@
+"""
+Variantes reduzidas das fotos das notificações.
+
+As fotos enviadas pelo celular costumam ter vários megabytes. Após o
+upload, cada foto gera uma miniatura e um tamanho de exibição, em WebP e
+JPEG, já com a orientação do EXIF aplicada e sem metadados (o EXIF pode
+conter a localização de quem enviou). O original também é regravado sem
+metadados; até lá, os templates não exibem nem linkam o arquivo enviado.
+O processamento roda em um pool de threads depois do commit, fora do
+ciclo da requisição; o comando processar_fotos_notificacoes refaz o que
+tiver ficado pendente.
+"""
+
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from .models import Notificacao
+
+logger = logging.getLogger(__name__)
+
+# Lado maior (px) de cada variante
+TAMANHOS = {
+    'miniatura': 256,
+    'exibicao': 1280,
+}
+
+FORMATOS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 6}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+DIRETORIO_VARIANTES = 'notificacoes/variantes'
+
+# Formato do original regravado sem metadados (outros formatos viram PNG)
+FORMATOS_ORIGINAL = {
+    'JPEG': {'quality': 92, 'optimize': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 90},
+}
+
+_executor = None
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'FOTOS_MAX_WORKERS', 2),
+            thread_name_prefix='fotos',
+        )
+    return _executor
+
+
+def original_sem_metadados(arquivo):
+    """(bytes, formato PIL) do original com a orientação aplicada e sem EXIF/XMP"""
+    with Image.open(arquivo) as original:
+        formato = original.format if original.format in FORMATOS_ORIGINAL else 'PNG'
+        icc = original.info.get('icc_profile')
+        imagem = ImageOps.exif_transpose(original)
+        if formato == 'JPEG' and imagem.mode not in ('RGB', 'L', 'CMYK'):
+            imagem = imagem.convert('RGB')
+        buffer = io.BytesIO()
+        opcoes = dict(FORMATOS_ORIGINAL[formato])
+        if icc:
+            opcoes['icc_profile'] = icc
+        imagem.save(buffer, format=formato, **opcoes)
+    return buffer.getvalue(), formato
+
+
+def gerar_variantes(arquivo):
+    """Gera {tamanho: {formato: bytes}} a partir de um arquivo de imagem"""
+    with Image.open(arquivo) as original:
+        imagem = ImageOps.exif_transpose(original)
+        imagem = imagem.convert('RGB')
+
+    variantes = {}
+    for tamanho, lado in TAMANHOS.items():
+        reduzida = imagem.copy()
+        reduzida.thumbnail((lado, lado), Image.LANCZOS)
+        variantes[tamanho] = {}
+        for formato, (formato_pil, opcoes) in FORMATOS.items():
+            buffer = io.BytesIO()
+            # Sem exif=...: os metadados do original não são copiados
+            reduzida.save(buffer, format=formato_pil, **opcoes)
+            variantes[tamanho][formato] = buffer.getvalue()
+    return variantes
+
+
+def processar_foto(notificacao_id):
+    """Gera e grava as variantes da foto de uma notificação"""
+    notificacao = Notificacao.objects.filter(id=notificacao_id).only('id', 'foto', 'foto_variantes').first()
+    if notificacao is None or not notificacao.foto:
+        return
+
+    storage = notificacao.foto.storage
+    with notificacao.foto.open('rb') as arquivo:
+        conteudo = arquivo.read()
+    variantes = gerar_variantes(io.BytesIO(conteudo))
+    limpo, formato = original_sem_metadados(io.BytesIO(conteudo))
+
+    # Grava a cópia sem metadados antes de apagar o original (PNG muda a
+    # extensão); o storage escolhe outro nome se o caminho já existir
+    nome_original = notificacao.foto.name
+    nome_foto = nome_original
+    if formato == 'PNG' and PurePosixPath(nome_foto).suffix.lower() != '.png':
+        nome_foto = str(PurePosixPath(nome_foto).with_suffix('.png'))
+    nome_foto = storage.save(nome_foto, ContentFile(limpo))
+
+    base = PurePosixPath(nome_original).stem
+    caminhos = {}
+    for tamanho, formatos in variantes.items():
+        caminhos[tamanho] = {}
+        for formato, conteudo in formatos.items():
+            nome = f"{DIRETORIO_VARIANTES}/{notificacao.id}_{base}_{tamanho}.{formato}"
+            caminhos[tamanho][formato] = storage.save(nome, ContentFile(conteudo))
+
+    # update() direto: não altera data_atualizacao nem dispara os signals.
+    # Só grava se a foto ainda for a mesma: se foi trocada (ou a notificação
+    # excluída) durante o processamento, o resultado é descartado
+    atualizadas = Notificacao.objects.filter(id=notificacao.id, foto=nome_original).update(
+        foto=nome_foto, foto_variantes=caminhos
+    )
+    if not atualizadas:
+        storage.delete(nome_foto)
+        remover_variantes(caminhos, storage)
+        return
+    storage.delete(nome_original)
+    remover_variantes(notificacao.foto_variantes, storage)
+
+
+def remover_variantes(variantes, storage):
+    for formatos in (variantes or {}).values():
+        for caminho in formatos.values():
+            storage.delete(caminho)
+
+
+def _processar_em_segundo_plano(notificacao_id):
+    try:
+        processar_foto(notificacao_id)
+    except Exception:
+        logger.exception('Erro ao processar a foto da notificação %s', notificacao_id)
+    finally:
+        # A thread do pool abre a própria conexão; não deixa conexões penduradas
+        connection.close()
+
+
+def agendar_processamento(notificacao_id):
+    """Processa a foto depois do commit, em segundo plano"""
+    if getattr(settings, 'FOTOS_PROCESSAMENTO_ASSINCRONO', True):
+        transaction.on_commit(lambda: _pool().submit(_processar_em_segundo_plano, notificacao_id))
+    else:
+        transaction.on_commit(lambda: processar_foto(notificacao_id))
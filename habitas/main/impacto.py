@@ -0,0 +1,196 @@
+"""
+Prévia do impacto de uma fórmula (ou coeficientes) de serviço antes de salvar.
+
+A fórmula candidata é avaliada no sandbox com o mesmo
+EcosystemServiceConfig.calcular_lote usado na materialização e comparada com os valores atuais
+(TreeServiceValue). As árvores são percorridas em ordem aleatória
+(semente fixa) até acabar o inventário ou o tempo (PREVIA_ORCAMENTO_SEGUNDOS);
+assim, se o tempo acabar, as árvores avaliadas formam uma amostra aleatória
+simples e os totais são extrapolados para o inventário inteiro.
+"""
+
+import ast
+import json
+import random
+import time
+
+from django.conf import settings
+
+from .configuracao import obter_configuracao
+from .models import EcosystemServiceConfig, Tree, TreeServiceValue
+from .sandbox import FormulaBloqueada
+
+TAMANHO_LOTE = 500
+FAIXAS_HISTOGRAMA = 10
+MAIORES_MUDANCAS = 10
+
+# Nomes sempre disponíveis no contexto de calcular()
+NOMES_CONTEXTO = {
+    'math', 'dap', 'altura', 'biomassa', 'area_copa', 'tree', 'coeficientes', 'hasattr', 'getattr',
+}
+
+
+class FormulaInvalida(ValueError):
+    """Fórmula que não compila ou usa nomes inexistentes"""
+
+
+def _candidato(formula, coeficientes, valor_monetario_unitario, servico=None):
+    candidato = EcosystemServiceConfig(
+        nome=servico.nome if servico else 'Prévia',
+        codigo=servico.codigo if servico else 'previa',
+        formula=formula,
+        coeficientes=coeficientes or {},
+        valor_monetario_unitario=valor_monetario_unitario,
+        ativo=True,
+    )
+    try:
+        dependencias = candidato.dependencias()
+    except SyntaxError as e:
+        raise FormulaInvalida(f'Erro de sintaxe: {e}')
+
+    # Variáveis criadas na própria fórmula (compreensões, lambdas) não contam
+    definidos = set()
+    for no in ast.walk(ast.parse(formula.strip(), mode='eval')):
+        if isinstance(no, ast.Name) and not isinstance(no.ctx, ast.Load):
+            definidos.add(no.id)
+        elif isinstance(no, ast.arg):
+            definidos.add(no.arg)
+    conhecidos = NOMES_CONTEXTO | set(candidato.coeficientes) | set(
+        obter_configuracao().variaveis_por_codigo
+    )
+    desconhecidos = sorted(dependencias - conhecidos - definidos)
+    if desconhecidos:
+        raise FormulaInvalida(f"Nome(s) desconhecido(s): {', '.join(desconhecidos)}")
+    return candidato
+
+
+def _quantis(valores, pontos=(0.1, 0.5, 0.9)):
+    if not valores:
+        return {}
+    ordenados = sorted(valores)
+    return {
+        f'p{int(ponto * 100)}': round(ordenados[min(int(ponto * len(ordenados)), len(ordenados) - 1)], 4)
+        for ponto in pontos
+    }
+
+
+def _histograma(atuais, novos):
+    todos = atuais + novos
+    if not todos:
+        return []
+    minimo, maximo = min(todos), max(todos)
+    largura = (maximo - minimo) / FAIXAS_HISTOGRAMA or 1
+    faixas = [
+        {'de': round(minimo + i * largura, 4), 'ate': round(minimo + (i + 1) * largura, 4), 'atual': 0, 'novo': 0}
+        for i in range(FAIXAS_HISTOGRAMA)
+    ]
+    for chave, valores in (('atual', atuais), ('novo', novos)):
+        for valor in valores:
+            faixas[min(int((valor - minimo) / largura), FAIXAS_HISTOGRAMA - 1)][chave] += 1
+    return faixas
+
+
+def previa_impacto(formula, coeficientes=None, valor_monetario_unitario=0.0, servico=None, orcamento=None):
+    """Compara os valores atuais do serviço com os da fórmula candidata
+
+    Retorna um dict pronto para JSON; levanta FormulaInvalida.
+    """
+    if orcamento is None:
+        orcamento = getattr(settings, 'PREVIA_ORCAMENTO_SEGUNDOS', 0.8)
+    inicio = time.monotonic()
+    candidato = _candidato(formula, coeficientes, valor_monetario_unitario, servico)
+
+    ids = list(Tree.objects.values_list('id', flat=True))
+    random.Random(0).shuffle(ids)
+
+    atuais, novos, mudancas = [], [], []
+    total_atual = {'fisico': 0.0, 'monetario': 0.0}
+    total_novo = {'fisico': 0.0, 'monetario': 0.0}
+    avaliadas = 0
+    for posicao in range(0, len(ids), TAMANHO_LOTE):
+        if avaliadas and time.monotonic() - inicio > orcamento:
+            break
+        lote = ids[posicao:posicao + TAMANHO_LOTE]
+        arvores = list(Tree.objects.filter(id__in=lote).select_related('species'))
+        # Avaliação no sandbox: uma fórmula patológica não trava o processo web
+        try:
+            valores_novos = candidato.calcular_lote(arvores)
+        except FormulaBloqueada as e:
+            raise FormulaInvalida(str(e))
+        valores_atuais = {}
+        if servico is not None:
+            valores_atuais = {
+                tree_id: (fisico, monetario)
+                for tree_id, fisico, monetario in TreeServiceValue.objects.filter(
+                    servico=servico, tree_id__in=lote
+                ).values_list('tree_id', 'valor_fisico', 'valor_monetario')
+            }
+        for tree, fisico_novo in zip(arvores, valores_novos):
+            fisico_atual, monetario_atual = valores_atuais.get(tree.id, (0.0, 0.0))
+            monetario_novo = candidato.calcular_valor_monetario(fisico_novo)
+
+            total_atual['fisico'] += fisico_atual
+            total_atual['monetario'] += monetario_atual
+            total_novo['fisico'] += fisico_novo
+            total_novo['monetario'] += monetario_novo
+            atuais.append(fisico_atual)
+            novos.append(fisico_novo)
+            mudancas.append((abs(fisico_novo - fisico_atual), tree, fisico_atual, fisico_novo))
+            avaliadas += 1
+
+    # Extrapolação quando o tempo acabou antes do inventário
+    fator = len(ids) / avaliadas if avaliadas else 0
+    for total in (total_atual, total_novo):
+        for chave in total:
+            total[chave] = round(total[chave] * fator, 2)
+
+    mudancas.sort(key=lambda mudanca: mudanca[0], reverse=True)
+    return {
+        'total_arvores': len(ids),
+        'avaliadas': avaliadas,
+        'estimado': avaliadas < len(ids),
+        'tempo_ms': round((time.monotonic() - inicio) * 1000),
+        'unidade': servico.unidade_medida if servico else '',
+        'atual': {**total_atual, **_quantis(atuais)},
+        'novo': {**total_novo, **_quantis(novos)},
+        'variacao_percentual': (
+            round((total_novo['fisico'] - total_atual['fisico']) / total_atual['fisico'] * 100, 2)
+            if total_atual['fisico'] else None
+        ),
+        'distribuicao': _histograma(atuais, novos),
+        'maiores_mudancas': [
+            {
+                'id': tree.id,
+                'N_placa': tree.N_placa,
+                'nome_popular': tree.nome_popular,
+                'atual': round(atual, 4),
+                'novo': round(novo, 4),
+            }
+            for _, tree, atual, novo in mudancas[:MAIORES_MUDANCAS]
+        ],
+    }
+
+
+def previa_do_formulario(dados):
+    """previa_impacto a partir dos campos enviados pelo formulário (POST)
+
+    Campos: formula, coeficientes (JSON), valor_monetario_unitario e
+    servico_id (opcional, ausente ao criar um serviço).
+    """
+    servico = None
+    if dados.get('servico_id'):
+        servico = EcosystemServiceConfig.objects.filter(id=dados['servico_id']).first()
+        if servico is None:
+            raise ValueError('Serviço não encontrado')
+    try:
+        coeficientes = json.loads(dados.get('coeficientes') or '{}')
+    except json.JSONDecodeError:
+        raise ValueError('Coeficientes inválidos (JSON)')
+    if not isinstance(coeficientes, dict):
+        raise ValueError('Os coeficientes devem ser um objeto JSON')
+    return previa_impacto(
+        dados.get('formula', ''),
+        coeficientes,
+        float(dados.get('valor_monetario_unitario') or 0),
+        servico,
+    )
@@ -0,0 +1,219 @@
+"""
+Instrumentação das requisições (opcional: INSTRUMENTACAO_ATIVA).
+
+Para cada requisição, o InstrumentacaoMiddleware mede:
+- número de consultas SQL e tempo total no banco, via
+  connection.execute_wrapper (não depende de DEBUG);
+- tempo gasto avaliando fórmulas dos serviços (medir_formulas, usado por
+  EcosystemServiceConfig.calcular e calcular_lote, que também alimenta as
+  métricas por serviço de main/metricas.py);
+- tamanho da resposta e tempo total.
+
+Respostas em streaming (exportações) consultam o banco enquanto são
+enviadas: a medição só termina em response.close(), chamado pelo servidor
+depois do último bloco, e o tamanho é contado bloco a bloco. Nelas não há
+Server-Timing (os cabeçalhos já foram enviados).
+
+Cada requisição gera uma linha DEBUG no logger 'habitas.instrumentacao'.
+As que passam dos limites (INSTRUMENTACAO_LIMITE_MS,
+INSTRUMENTACAO_LIMITE_CONSULTAS, INSTRUMENTACAO_LIMITE_REPETICOES) geram
+um WARNING com as consultas mais repetidas (SQL normalizado, sem os
+parâmetros), o que deixa padrões N+1 visíveis nos logs de produção.
+"""
+
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from . import metricas
+
+logger = logging.getLogger('habitas.instrumentacao')
+
+_local = threading.local()
+
+# Listas de parâmetros de tamanho variável (IN (%s, %s, ...)) e literais
+_LISTA_PARAMETROS = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_LITERAL_TEXTO = re.compile(r"'(?:[^']|'')*'")
+_LITERAL_NUMERO = re.compile(r'\b\d+(?:\.\d+)?\b')
+_ESPACOS = re.compile(r'\s+')
+
+SQL_MAX_CARACTERES = 300
+
+
+def normalizar_sql(sql):
+    """SQL sem literais, para agrupar consultas iguais com parâmetros diferentes"""
+    sql = _LISTA_PARAMETROS.sub('(%s, ...)', sql)
+    sql = _LITERAL_TEXTO.sub('?', sql)
+    sql = _LITERAL_NUMERO.sub('?', sql)
+    return _ESPACOS.sub(' ', sql).strip()
+
+
+class Medicao:
+    """Totais de uma requisição; também é o execute_wrapper das conexões"""
+
+    def __init__(self):
+        self.consultas = 0
+        self.tempo_banco = 0.0
+        self.tempo_formulas = 0.0
+        self.sql = Counter()
+        self._profundidade_formulas = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.tempo_banco += time.perf_counter() - inicio
+            self.consultas += 1
+            self.sql[normalizar_sql(sql)] += 1
+
+    def repetidas(self, quantidade=5):
+        """[(sql, vezes)] das consultas executadas mais de uma vez"""
+        return [(sql, vezes) for sql, vezes in self.sql.most_common(quantidade) if vezes > 1]
+
+
+def medicao_atual():
+    """Medicao da requisição em andamento nesta thread (ou None)"""
+    return getattr(_local, 'medicao', None)
+
+
+@contextmanager
+def medir_formulas(servico=None, avaliacoes=1):
+    """Soma o tempo do bloco ao tempo de fórmulas da requisição atual
+
+    Blocos aninhados contam uma vez só (o mais externo). Com servico (código),
+    também conta as avaliações e o tempo nas métricas do serviço.
+    """
+    medicao = medicao_atual()
+    if medicao is not None:
+        medicao._profundidade_formulas += 1
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracao = time.perf_counter() - inicio
+        if medicao is not None:
+            medicao._profundidade_formulas -= 1
+            if not medicao._profundidade_formulas:
+                medicao.tempo_formulas += duracao
+        if servico:
+            metricas.formula(servico, avaliacoes, duracao)
+
+
+def _tamanho_resposta(response):
+    if not response.streaming:
+        return len(response.content)
+    if response.has_header('Content-Length'):
+        return int(response['Content-Length'])
+    return getattr(response, '_bytes_enviados', None)
+
+
+def _contar_bytes(response, conteudo):
+    response._bytes_enviados = 0
+    for bloco in conteudo:
+        response._bytes_enviados += len(bloco)
+        yield bloco
+
+
+def _nome_view(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return request.path
+    return match.view_name
+
+
+class InstrumentacaoMiddleware:
+    """Mede consultas, tempo no banco e nas fórmulas de cada requisição
+
+    Desativado (MiddlewareNotUsed) se INSTRUMENTACAO_ATIVA for False.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'INSTRUMENTACAO_ATIVA', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        medicao = Medicao()
+        _local.medicao = medicao
+        inicio = time.perf_counter()
+        pilha = ExitStack()
+        try:
+            for conexao in connections.all():
+                pilha.enter_context(conexao.execute_wrapper(medicao))
+            response = self.get_response(request)
+        except BaseException:
+            self.encerrar(pilha)
+            raise
+
+        if response.streaming:
+            # As consultas continuam durante o envio: mede até o close()
+            response.streaming_content = _contar_bytes(response, response.streaming_content)
+            fechar = response.close
+
+            def close():
+                try:
+                    fechar()
+                finally:
+                    self.encerrar(pilha)
+                    self.registrar(request, response, medicao, time.perf_counter() - inicio)
+
+            response.close = close
+            return response
+
+        self.encerrar(pilha)
+        duracao = time.perf_counter() - inicio
+        if getattr(settings, 'INSTRUMENTACAO_SERVER_TIMING', True):
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={medicao.tempo_banco * 1000:.1f}',
+                f'formulas;dur={medicao.tempo_formulas * 1000:.1f}',
+                f'total;dur={duracao * 1000:.1f}',
+            ])
+        self.registrar(request, response, medicao, duracao)
+        return response
+
+    @staticmethod
+    def encerrar(pilha):
+        pilha.close()
+        _local.medicao = None
+
+    def registrar(self, request, response, medicao, duracao):
+        view = _nome_view(request)
+        tamanho = _tamanho_resposta(response)
+        resumo = (
+            f'{request.method} {view} {response.status_code}: {duracao * 1000:.0f} ms, '
+            f'{medicao.consultas} consulta(s) em {medicao.tempo_banco * 1000:.0f} ms, '
+            f'fórmulas {medicao.tempo_formulas * 1000:.0f} ms, '
+            f'{tamanho if tamanho is not None else "?"} bytes'
+        )
+        dados = {
+            'view': view,
+            'status': response.status_code,
+            'duracao_ms': round(duracao * 1000, 1),
+            'consultas': medicao.consultas,
+            'banco_ms': round(medicao.tempo_banco * 1000, 1),
+            'formulas_ms': round(medicao.tempo_formulas * 1000, 1),
+            'bytes': tamanho,
+        }
+
+        repetidas = medicao.repetidas()
+        lenta = (
+            duracao * 1000 >= getattr(settings, 'INSTRUMENTACAO_LIMITE_MS', 1000)
+            or medicao.consultas >= getattr(settings, 'INSTRUMENTACAO_LIMITE_CONSULTAS', 50)
+            or (repetidas and repetidas[0][1] >= getattr(settings, 'INSTRUMENTACAO_LIMITE_REPETICOES', 10))
+        )
+        if not lenta:
+            logger.debug(resumo, extra={'instrumentacao': dados})
+            return
+        linhas = [f'Requisição lenta: {resumo} ({request.get_full_path()})']
+        for sql, vezes in repetidas:
+            linhas.append(f'  {vezes}x {sql[:SQL_MAX_CARACTERES]}')
+        dados['repetidas'] = repetidas
+        logger.warning('\n'.join(linhas), extra={'instrumentacao': dados})
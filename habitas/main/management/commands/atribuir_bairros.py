@@ -0,0 +1,63 @@
+"""
+Comando Django para preencher o bairro das árvores a partir da posição.
+
+Novas árvores recebem o bairro ao serem salvas (signal) ou importadas;
+este comando cobre as já existentes e deve ser executado de novo se o
+arquivo de bairros (static/js/bairros.js) mudar.
+
+Uso:
+    python manage.py atribuir_bairros
+    python manage.py atribuir_bairros --todas
+"""
+
+from django.core.management.base import BaseCommand
+from main.bairros import localizar
+from main.models import ResumoInventario, Tree
+
+
+class Command(BaseCommand):
+    help = 'Atribui o bairro de cada árvore pelos polígonos de static/js/bairros.js'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--todas',
+            action='store_true',
+            help='Recalcula também as árvores que já têm bairro',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Tamanho do lote de atualização (padrão: 2000)',
+        )
+
+    def handle(self, *args, **options):
+        """Executa a atribuição"""
+
+        arvores = Tree.objects.only('id', 'latitude', 'longitude', 'bairro').order_by('id')
+        if not options['todas']:
+            arvores = arvores.filter(bairro='')
+        total = arvores.count()
+        self.stdout.write(f'🗺️  Localizando o bairro de {total} árvores...')
+
+        lote, alteradas, sem_bairro = [], 0, 0
+        for tree in arvores.iterator(chunk_size=options['chunk_size']):
+            bairro = localizar(tree.latitude, tree.longitude)
+            if not bairro:
+                sem_bairro += 1
+            if bairro != tree.bairro:
+                tree.bairro = bairro
+                lote.append(tree)
+            if len(lote) >= options['chunk_size']:
+                Tree.objects.bulk_update(lote, ['bairro'])
+                alteradas += len(lote)
+                lote = []
+        if lote:
+            Tree.objects.bulk_update(lote, ['bairro'])
+            alteradas += len(lote)
+
+        if alteradas:
+            ResumoInventario.recalcular()
+        self.stdout.write(self.style.SUCCESS(f'✅ {alteradas} árvore(s) atualizada(s)'))
+        if sem_bairro:
+            self.stdout.write(self.style.WARNING(f'   • {sem_bairro} fora dos polígonos de bairro'))
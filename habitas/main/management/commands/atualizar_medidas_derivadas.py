@@ -0,0 +1,56 @@
+"""
+Comando Django para preencher as medidas derivadas (biomassa e área da
+copa) gravadas em cada árvore.
+
+Árvores salvas ou importadas já recebem os valores; este comando cobre as
+já existentes e deve ser executado de novo se as constantes da equação
+alométrica (BETA0, BETA1, BETA2) ou DIAMETER_RATIO mudarem.
+
+Uso:
+    python manage.py atualizar_medidas_derivadas
+    python manage.py atualizar_medidas_derivadas --todas
+"""
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from main.models import Tree
+
+
+class Command(BaseCommand):
+    help = 'Grava biomassa e área da copa de cada árvore a partir do DAP e da altura'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--todas',
+            action='store_true',
+            help='Recalcula também as árvores que já têm os valores',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Tamanho do lote de atualização (padrão: 2000)',
+        )
+
+    def handle(self, *args, **options):
+        """Executa o preenchimento"""
+
+        arvores = Tree.objects.only('id', 'dap', 'altura', 'biomassa', 'area_copa').order_by('id')
+        if not options['todas']:
+            arvores = arvores.filter(Q(biomassa__isnull=True) | Q(area_copa__isnull=True))
+        total = arvores.count()
+        self.stdout.write(f'🌳 Calculando medidas derivadas de {total} árvores...')
+
+        lote, alteradas = [], 0
+        for tree in arvores.iterator(chunk_size=options['chunk_size']):
+            if tree.atualizar_medidas_derivadas():
+                lote.append(tree)
+            if len(lote) >= options['chunk_size']:
+                Tree.objects.bulk_update(lote, ['biomassa', 'area_copa'])
+                alteradas += len(lote)
+                lote = []
+        if lote:
+            Tree.objects.bulk_update(lote, ['biomassa', 'area_copa'])
+            alteradas += len(lote)
+
+        self.stdout.write(self.style.SUCCESS(f'✅ {alteradas} árvore(s) atualizada(s)'))
@@ -0,0 +1,68 @@
+"""
+Comando Django para remover arquivos sem referência do armazenamento deduplicado.
+
+Antes de apagar, recalcula o número de referências a partir dos campos
+de arquivo (corrigindo contagens perdidas em operações em lote). Só
+remove arquivos sem referência enviados há mais de --horas, para não
+apagar um upload cujo registro ainda não foi salvo.
+
+Uso:
+    python manage.py coletar_arquivos
+    python manage.py coletar_arquivos --horas 1 --dry-run
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from main.models import ArquivoConteudo
+from main.storage import armazenamento_deduplicado
+
+
+class Command(BaseCommand):
+    help = 'Recalcula as referências e apaga arquivos órfãos do armazenamento deduplicado'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--horas',
+            type=float,
+            default=24,
+            help='Idade mínima (em horas) de um arquivo órfão para ser removido (padrão: 24)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Apenas lista o que seria removido',
+        )
+
+    def handle(self, *args, **options):
+        """Executa a coleta"""
+
+        self.stdout.write('🔢 Recalculando referências...')
+        contagem = ArquivoConteudo.contar_referencias()
+        corrigidos = 0
+        for arquivo in ArquivoConteudo.objects.iterator():
+            referencias = contagem.get(arquivo.nome, 0)
+            if arquivo.referencias != referencias:
+                corrigidos += 1
+                if not options['dry_run']:
+                    ArquivoConteudo.objects.filter(id=arquivo.id).update(referencias=referencias)
+        self.stdout.write(f'   • {corrigidos} contagem(ns) corrigida(s)')
+
+        limite = timezone.now() - timedelta(hours=options['horas'])
+        removidos, liberados = 0, 0
+        for arquivo in ArquivoConteudo.objects.filter(enviado_em__lt=limite).iterator():
+            if contagem.get(arquivo.nome, 0) > 0:
+                continue
+            if options['dry_run']:
+                self.stdout.write(f'   • {arquivo.nome} ({arquivo.tamanho} bytes)')
+            else:
+                armazenamento_deduplicado.delete(arquivo.nome)
+                arquivo.delete()
+            removidos += 1
+            liberados += arquivo.tamanho
+
+        acao = 'seriam removidos' if options['dry_run'] else 'removidos'
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {removidos} arquivo(s) órfão(s) {acao} ({liberados / 1024 / 1024:.1f} MB)'
+        ))
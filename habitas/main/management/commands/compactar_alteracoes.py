@@ -0,0 +1,29 @@
+"""
+Comando Django para compactar o registro de alterações (TreeChange).
+
+Cada save de árvore ou comentário grava um TreeChange, então a tabela
+cresce sem limite. A compactação mantém apenas o registro mais recente de
+cada árvore (inclusão/alteração ou exclusão): clientes em qualquer versão
+continuam recebendo o estado final de todas as árvores alteradas. Pode ser
+agendado periodicamente (cron).
+
+Uso:
+    python manage.py compactar_alteracoes
+"""
+
+from django.core.management.base import BaseCommand
+from main.models import TreeChange
+
+
+class Command(BaseCommand):
+    help = 'Remove registros de alterações substituídos por outros mais novos da mesma árvore'
+
+    def handle(self, *args, **options):
+        """Executa a compactação"""
+
+        total = TreeChange.objects.count()
+        self.stdout.write(f'🗜️  Compactando {total} registro(s) de alterações...')
+        removidos = TreeChange.compactar()
+        self.stdout.write(
+            self.style.SUCCESS(f'✅ Compactação concluída! {removidos} registro(s) removido(s)')
+        )
@@ -0,0 +1,79 @@
+"""
+Comando Django para exportar as árvores em CSV, GeoJSON ou Parquet.
+
+Aceita os mesmos filtros do mapa (index) e grava o arquivo em lotes,
+sem carregar o inventário inteiro em memória.
+
+Uso:
+    python manage.py export_trees --saida arvores.csv
+    python manage.py export_trees --formato geojson --saida arvores.geojson --origem nativa
+    python manage.py export_trees --formato parquet --saida arvores.parquet --servicos
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from main.exportacao import CHUNK_SIZE, FormatoIndisponivel, GERADORES, exportar
+from main.filtros import filtros_arvores
+
+FILTROS = [
+    'nome_popular', 'nome_cientifico', 'plantado_por', 'species', 'origem',
+    'altura_min', 'altura_max', 'dap_min', 'dap_max',
+]
+
+
+class Command(BaseCommand):
+    help = 'Exporta as árvores (com filtros opcionais) em CSV, GeoJSON ou Parquet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--formato',
+            choices=sorted(GERADORES),
+            default='csv',
+            help='Formato do arquivo (padrão: csv)',
+        )
+        parser.add_argument(
+            '--saida',
+            required=True,
+            help='Caminho do arquivo de saída',
+        )
+        parser.add_argument(
+            '--servicos',
+            action='store_true',
+            help='Inclui as colunas dos serviços ecossistêmicos ativos',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help=f'Número de árvores lidas por lote (padrão: {CHUNK_SIZE})',
+        )
+        parser.add_argument(
+            '--laudo-only',
+            action='store_true',
+            help='Apenas árvores com laudo',
+        )
+        for filtro in FILTROS:
+            parser.add_argument(f"--{filtro.replace('_', '-')}", dest=filtro)
+
+    def handle(self, *args, **options):
+        """Executa a exportação"""
+
+        params = {filtro: options[filtro] for filtro in FILTROS if options[filtro]}
+        if options['laudo_only']:
+            params['laudo_only'] = '1'
+
+        try:
+            conteudo = exportar(
+                options['formato'],
+                filtros_arvores(params),
+                incluir_servicos=options['servicos'],
+                chunk_size=options['chunk_size'],
+            )
+        except FormatoIndisponivel as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"📤 Exportando árvores para {options['saida']}...")
+        with open(options['saida'], 'wb') as arquivo:
+            for parte in conteudo:
+                arquivo.write(parte if isinstance(parte, bytes) else parte.encode('utf-8'))
+
+        self.stdout.write(self.style.SUCCESS('✅ Exportação concluída!'))
@@ -8,10 +8,18 @@ Uso:
 
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from main.models import Tree
+from main.bairros import localizar
+from main.especies import IndiceEspecies
+from main import metricas
+from main.models import (
+    Tree, TreeChange, TreeMedia, TreeServiceValue, ContadorPainel, ResumoInventario,
+    area_copa_estimada, biomassa_estimada,
+)
+from main.sandbox import FormulaBloqueada
 from pathlib import Path
 import csv
 import re
+import time
 
 
 class Command(BaseCommand):
@@ -54,9 +62,16 @@ class Command(BaseCommand):
             existing_ids = set(Tree.objects.values_list('N_placa', flat=True))
             self.stdout.write(f'📊 Encontradas {len(existing_ids)} árvores já no banco')
         
+        # Índice de nomes para vincular as novas árvores às espécies
+        indice_especies = IndiceEspecies()
+
         trees_to_create = []
+        # Laudos e imagens de cada placa, gravados em TreeMedia após o bulk_create
+        midias_por_placa = {}
         errors = []
         skipped = 0
+        importadas = 0
+        inicio = time.monotonic()
         
         try:
             with open(csv_path, 'r', encoding='utf-8') as csv_file:
@@ -125,13 +140,17 @@ class Command(BaseCommand):
                             altura=altura,
                             latitude=latitude,
                             longitude=longitude,
-                            laudo=laudos,
-                            imagem=imagens,
+                            bairro=localizar(latitude, longitude),
+                            species_id=indice_especies.resolver(nome_cientifico, nome_popular),
+                            biomassa=biomassa_estimada(dap, altura),
+                            area_copa=area_copa_estimada(dap),
+                            tem_laudo=bool(TreeMedia.separar(laudos)),
                             plantado_por="Prefeitura de São José dos Campos",
                             origem='desconhecida'  # Valor padrão
                         )
                         
                         trees_to_create.append(tree)
+                        midias_por_placa[tree_id] = (laudos, imagens)
                         
                         # Log a cada 1000 registros processados
                         if len(trees_to_create) % 1000 == 0:
@@ -146,12 +165,39 @@ class Command(BaseCommand):
             if trees_to_create:
                 self.stdout.write(f'\n💾 Salvando {len(trees_to_create)} árvores no banco de dados...')
                 
+                # bulk_create não dispara signals nem devolve ids com ignore_conflicts,
+                # então as alterações para sincronização são registradas pelo intervalo de ids
+                ultimo_id = Tree.objects.order_by('-id').values_list('id', flat=True).first() or 0
+                
                 # Usa bulk_create com ignore_conflicts para evitar erros de duplicatas
-                created = Tree.objects.bulk_create(
-                    trees_to_create,
-                    ignore_conflicts=True,
-                    batch_size=1000
-                )
+                with transaction.atomic():
+                    created = Tree.objects.bulk_create(
+                        trees_to_create,
+                        ignore_conflicts=True,
+                        batch_size=1000
+                    )
+                    novas = list(Tree.objects.filter(id__gt=ultimo_id).values_list('id', 'N_placa'))
+                    importadas = len(novas)
+                    TreeChange.registrar(tree_id for tree_id, _ in novas)
+                    midias = []
+                    for novo_id, placa in novas:
+                        if placa in midias_por_placa:
+                            midias += TreeMedia.criar_para(novo_id, *midias_por_placa[placa])
+                    TreeMedia.objects.bulk_create(midias, batch_size=1000)
+                    ContadorPainel.recalcular(['arvores'])
+
+                # bulk_create não dispara o signal que materializa os serviços
+                self.stdout.write('🧮 Materializando os serviços das árvores importadas...')
+                ids_novos = [novo_id for novo_id, _ in novas]
+                for inicio_lote in range(0, len(ids_novos), 2000):
+                    lote = list(Tree.objects.filter(
+                        id__in=ids_novos[inicio_lote:inicio_lote + 2000]
+                    ).select_related('species'))
+                    try:
+                        TreeServiceValue.materializar(lote, resumos=False)
+                    except FormulaBloqueada as e:
+                        self.stdout.write(self.style.WARNING(f'⚠️  {e}'))
+                ResumoInventario.recalcular()
                 
                 self.stdout.write(
                     self.style.SUCCESS(
@@ -159,6 +205,9 @@ class Command(BaseCommand):
                     )
                 )
                 self.stdout.write(f'   • {len(created)} árvores importadas')
+                self.stdout.write(
+                    '   • Execute "python manage.py materializar_servicos --apenas-grade" para atualizar o mapa de calor'
+                )
                 if skipped > 0:
                     self.stdout.write(f'   • {skipped} árvores puladas (já existentes)')
                 if errors:
@@ -180,6 +229,15 @@ class Command(BaseCommand):
             traceback.print_exc()
             return
         
+        duracao = time.monotonic() - inicio
+        linhas = importadas + skipped + len(errors)
+        metricas.incrementar('habitas_importacao_linhas_total', 'importada', valor=importadas)
+        metricas.incrementar('habitas_importacao_linhas_total', 'pulada', valor=skipped)
+        metricas.incrementar('habitas_importacao_linhas_total', 'erro', valor=len(errors))
+        metricas.incrementar('habitas_importacao_segundos_total', valor=duracao)
+        if duracao > 0:
+            metricas.definir('habitas_importacao_linhas_por_segundo', valor=linhas / duracao)
+        
         # Mostra erros se houver
         if errors:
             self.stdout.write('\n📋 Primeiros 10 erros encontrados:')
@@ -0,0 +1,85 @@
+"""
+Comando Django para materializar os valores dos serviços ecossistêmicos
+de todas as árvores, reconstruir os resumos (ResumoInventario) e a grade
+do mapa de calor e registrar um snapshot do inventário.
+
+Uso:
+    python manage.py materializar_servicos
+    python manage.py materializar_servicos --chunk-size 5000
+    python manage.py materializar_servicos --apenas-grade
+"""
+
+from django.core.management.base import BaseCommand
+from main.configuracao import obter_configuracao
+from main.models import ResumoInventario, Tree, TreeServiceValue
+from main.heatmap import construir_grade
+from main.sandbox import FormulaBloqueada
+from main.snapshots import gravar_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Recalcula os valores materializados dos serviços e a grade do mapa de calor'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Número de árvores processadas por lote (padrão: 2000)',
+        )
+        parser.add_argument(
+            '--apenas-grade',
+            action='store_true',
+            help='Apenas reconstrói a grade do mapa de calor com os valores já materializados',
+        )
+
+    def materializar(self, lote, servicos, bloqueados):
+        """Materializa o lote; serviços bloqueados saem dos lotes seguintes"""
+        try:
+            TreeServiceValue.materializar(lote, servicos, resumos=False)
+        except FormulaBloqueada as e:
+            bloqueados.update(e.servicos)
+            servicos[:] = [servico for servico in servicos if servico.codigo not in bloqueados]
+            self.stdout.write(self.style.WARNING(f'⚠️  {e} (valores anteriores mantidos)'))
+
+    def handle(self, *args, **options):
+        """Executa a materialização"""
+        
+        if not options['apenas_grade']:
+            servicos = list(obter_configuracao().servicos)
+            bloqueados = set()
+            chunk_size = options['chunk_size']
+            total = Tree.objects.count()
+            self.stdout.write(f'🌳 Materializando {len(servicos)} serviço(s) para {total} árvores...')
+            
+            lote = []
+            processadas = 0
+            for tree in Tree.objects.select_related('species').order_by('id').iterator(chunk_size=chunk_size):
+                lote.append(tree)
+                if len(lote) >= chunk_size:
+                    self.materializar(lote, servicos, bloqueados)
+                    processadas += len(lote)
+                    lote = []
+                    self.stdout.write(f'  Processadas: {processadas}/{total} árvores...')
+            if lote:
+                self.materializar(lote, servicos, bloqueados)
+                processadas += len(lote)
+            
+            self.stdout.write(f'   • {processadas} árvores materializadas')
+            self.stdout.write('📊 Reconstruindo resumos por bairro, espécie e origem...')
+            ResumoInventario.recalcular()
+            if bloqueados:
+                # Os valores desses serviços não correspondem ao inventário atual
+                self.stdout.write(self.style.WARNING(
+                    f'⚠️  Snapshot não gravado: fórmula bloqueada em {", ".join(sorted(bloqueados))}'
+                ))
+                snapshot = None
+            else:
+                # Os valores mudaram mesmo sem mudança de versão do inventário
+                snapshot = gravar_snapshot('materializar_servicos', forcar=True)
+            if snapshot is not None:
+                self.stdout.write(f'   • Snapshot do inventário gravado ({snapshot.tamanho // 1024} KiB)')
+        
+        self.stdout.write('🗺️  Reconstruindo grade do mapa de calor...')
+        construir_grade()
+        self.stdout.write(self.style.SUCCESS('✅ Materialização concluída!'))
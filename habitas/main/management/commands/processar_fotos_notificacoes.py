@@ -0,0 +1,44 @@
+"""
+Comando Django para gerar as variantes reduzidas das fotos das notificações.
+
+Processa as fotos que ainda não têm variantes (fotos antigas ou envios
+cujo processamento em segundo plano foi interrompido).
+
+Uso:
+    python manage.py processar_fotos_notificacoes
+    python manage.py processar_fotos_notificacoes --todas
+"""
+
+from django.core.management.base import BaseCommand
+from main.models import Notificacao
+from main.imagens import processar_foto
+
+
+class Command(BaseCommand):
+    help = 'Gera miniaturas e tamanho de exibição (WebP/JPEG, sem EXIF) das fotos das notificações'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--todas',
+            action='store_true',
+            help='Reprocessa também as fotos que já têm variantes',
+        )
+
+    def handle(self, *args, **options):
+        """Executa o processamento"""
+
+        notificacoes = Notificacao.objects.exclude(foto='').exclude(foto__isnull=True)
+        if not options['todas']:
+            notificacoes = notificacoes.filter(foto_variantes={})
+        ids = list(notificacoes.order_by('id').values_list('id', flat=True))
+
+        self.stdout.write(f'🖼️  Processando {len(ids)} foto(s)...')
+        erros = 0
+        for notificacao_id in ids:
+            try:
+                processar_foto(notificacao_id)
+            except Exception as e:
+                erros += 1
+                self.stdout.write(self.style.WARNING(f'   ⚠️  Notificação {notificacao_id}: {e}'))
+
+        self.stdout.write(self.style.SUCCESS(f'✅ {len(ids) - erros} foto(s) processada(s)!'))
@@ -0,0 +1,27 @@
+"""
+Comando Django para reconstruir os resumos por bairro, espécie e origem
+(ResumoInventario) a partir das árvores, comentários e valores
+materializados.
+
+Os resumos são mantidos pelos signals; use este comando após alterações
+em lote feitas fora deles (update, bulk_update, SQL direto).
+
+Uso:
+    python manage.py recalcular_resumos
+"""
+
+from django.core.management.base import BaseCommand
+from main.models import ResumoInventario
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói os totais pré-agregados por bairro, espécie e origem'
+
+    def handle(self, *args, **options):
+        """Executa a reconstrução"""
+
+        self.stdout.write('📊 Reconstruindo resumos do inventário...')
+        ResumoInventario.recalcular()
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {ResumoInventario.objects.count()} linha(s) de resumo'
+        ))
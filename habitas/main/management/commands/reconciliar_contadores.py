@@ -0,0 +1,47 @@
+"""
+Comando Django para reconciliar os contadores dos dashboards.
+
+Os contadores são mantidos pelos signals, mas operações em lote
+(queryset.update, bulk_create, SET_NULL em cascata) não os disparam.
+Este comando recalcula todos com COUNT e informa as divergências.
+Pode ser agendado periodicamente (cron).
+
+Uso:
+    python manage.py reconciliar_contadores
+"""
+
+from django.core.management.base import BaseCommand
+from main.models import ContadorPainel, CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Recalcula os contadores dos dashboards e corrige divergências'
+
+    def handle(self, *args, **options):
+        """Executa a reconciliação"""
+
+        antes = dict(ContadorPainel.objects.values_list('chave', 'valor'))
+
+        # Remove contadores de usuários que não existem mais
+        usuarios = set(CustomUser.objects.values_list('id', flat=True))
+        orfaos = [
+            chave for chave in antes
+            if chave.startswith(('laudos_autor:', 'analises_tecnico:'))
+            and int(chave.partition(':')[2]) not in usuarios
+        ]
+        ContadorPainel.objects.filter(chave__in=orfaos).delete()
+
+        self.stdout.write(f'🔢 Recalculando {len(antes) - len(orfaos)} contador(es)...')
+        depois = ContadorPainel.recalcular()
+
+        divergentes = 0
+        for chave, valor in sorted(depois.items()):
+            if antes.get(chave) != valor:
+                divergentes += 1
+                self.stdout.write(f'   • {chave}: {antes.get(chave)} → {valor}')
+
+        if orfaos:
+            self.stdout.write(f'   • {len(orfaos)} contador(es) de usuários removidos')
+        self.stdout.write(
+            self.style.SUCCESS(f'✅ Reconciliação concluída! {divergentes} divergência(s) corrigida(s)')
+        )
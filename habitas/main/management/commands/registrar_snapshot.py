@@ -0,0 +1,42 @@
+"""
+Comando Django para registrar um snapshot do inventário (main/snapshots.py).
+
+Pensado para execução periódica (cron), após a coleta e a importação. Se o
+inventário e a configuração dos serviços não mudaram desde o último
+snapshot, nada é gravado (a menos que --forcar).
+
+Uso:
+    python manage.py registrar_snapshot
+    python manage.py registrar_snapshot --descricao "Coleta de março" --forcar
+"""
+
+from django.core.management.base import BaseCommand
+from main.snapshots import gravar_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Grava um snapshot colunar compactado do inventário e dos totais dos serviços'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--descricao',
+            default='',
+            help='Descrição exibida no catálogo de snapshots',
+        )
+        parser.add_argument(
+            '--forcar',
+            action='store_true',
+            help='Grava mesmo sem alterações desde o último snapshot',
+        )
+
+    def handle(self, *args, **options):
+        """Executa o registro"""
+
+        self.stdout.write('📸 Registrando snapshot do inventário...')
+        snapshot = gravar_snapshot(options['descricao'], forcar=options['forcar'])
+        if snapshot is None:
+            self.stdout.write(self.style.WARNING('⚠️  Nada mudou desde o último snapshot.'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Snapshot {snapshot.id}: {snapshot.arvores} árvores, {snapshot.tamanho // 1024} KiB'
+        ))
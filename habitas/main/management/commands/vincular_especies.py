@@ -0,0 +1,86 @@
+"""
+Comando Django para vincular as árvores ao catálogo de espécies (Tree.species).
+
+Sem o vínculo, a biodiversidade usa o índice padrão (1) e os valores
+padrão por espécie (SpeciesVariableDefault) não se aplicam. Por padrão só
+as árvores ainda sem espécie são processadas, então o comando pode ser
+executado após cada importação; a importação de CSV já vincula as novas.
+
+Uso:
+    python manage.py vincular_especies
+    python manage.py vincular_especies --todas
+"""
+
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from main.especies import IndiceEspecies
+from main.models import Tree, TreeChange
+
+
+class Command(BaseCommand):
+    help = 'Vincula as árvores às espécies pelos nomes científico e popular normalizados'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--todas',
+            action='store_true',
+            help='Revê também as árvores que já têm espécie',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Tamanho do lote de atualização (padrão: 2000)',
+        )
+
+    def handle(self, *args, **options):
+        """Executa o vínculo"""
+
+        indice = IndiceEspecies()
+        arvores = Tree.objects.only('id', 'nome_cientifico', 'nome_popular', 'species_id').order_by('id')
+        if not options['todas']:
+            arvores = arvores.filter(species__isnull=True)
+        total = arvores.count()
+        self.stdout.write(f'🌿 Vinculando {total} árvores ({len(indice.cientificos)} nomes científicos no índice)...')
+
+        # Cada combinação de nomes é resolvida uma vez
+        resolvidos = {}
+        sem_especie = Counter()
+        lote, alteradas = [], []
+        for tree in arvores.iterator(chunk_size=options['chunk_size']):
+            nomes = (tree.nome_cientifico, tree.nome_popular)
+            if nomes not in resolvidos:
+                resolvidos[nomes] = indice.resolver(*nomes)
+            species_id = resolvidos[nomes]
+            if species_id is None:
+                sem_especie[tree.nome_cientifico or tree.nome_popular] += 1
+                continue
+            if species_id != tree.species_id:
+                tree.species_id = species_id
+                lote.append(tree)
+            if len(lote) >= options['chunk_size']:
+                alteradas += self._gravar(lote)
+                lote = []
+        if lote:
+            alteradas += self._gravar(lote)
+
+        self.stdout.write(self.style.SUCCESS(f'✅ {len(alteradas)} árvore(s) vinculada(s)'))
+        if sem_especie:
+            self.stdout.write(self.style.WARNING(
+                f'   • {sum(sem_especie.values())} sem espécie correspondente; nomes mais frequentes:'
+            ))
+            for nome, quantidade in sem_especie.most_common(10):
+                self.stdout.write(f'     - {nome}: {quantidade}')
+            self.stdout.write('   • Cadastre sinônimos (SinonimoEspecie) no admin e execute de novo')
+        if alteradas:
+            self.stdout.write(
+                '   • Execute "python manage.py materializar_servicos" para atualizar os valores dos serviços'
+            )
+
+    def _gravar(self, lote):
+        with transaction.atomic():
+            Tree.objects.bulk_update(lote, ['species'])
+            TreeChange.registrar(tree.id for tree in lote)
+        return [tree.id for tree in lote]
@@ -0,0 +1,353 @@
+"""
+Métricas no formato de texto do Prometheus (GET /metrics), sem serviço externo.
+
+Cada processo (worker do gunicorn, comando de gerenciamento) acumula os
+contadores e histogramas em memória e grava, no máximo a cada
+METRICAS_INTERVALO segundos e ao terminar, um arquivo JSON próprio em
+METRICAS_DIR (troca atômica). A view soma os arquivos de todos os
+processos. Os arquivos de processos já encerrados são incorporados a
+ARQUIVO_ACUMULADO e removidos na coleta, então o diretório não cresce com
+os reinícios dos workers e os contadores continuam só crescendo. Limpe o
+diretório ao reiniciar o serviço (o Prometheus trata a queda dos
+contadores como reinício).
+
+Séries:
+- habitas_requisicao_segundos: latência por view (nome da URL) e método;
+- habitas_formula_avaliacoes_total / _segundos_total: fórmulas por serviço;
+- habitas_cache_acessos_total: acertos e faltas por cache;
+- habitas_scraper_*: árvores coletadas, erros e tempo do scraper da
+  prefeitura; habitas_acervo_downloads_total: downloads de imagens/laudos;
+- habitas_importacao_*: linhas importadas do CSV e tempo de importação.
+"""
+
+import atexit
+import json
+import math
+import os
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem incorporação dos arquivos encerrados
+    fcntl = None
+
+CONTADOR = 'counter'
+HISTOGRAMA = 'histogram'
+MEDIDOR = 'gauge'
+
+# nome: (tipo, descrição, rótulos)
+METRICAS = {
+    'habitas_requisicao_segundos': (
+        HISTOGRAMA, 'Duração das requisições por view', ('view', 'metodo'),
+    ),
+    'habitas_formula_avaliacoes_total': (
+        CONTADOR, 'Árvores avaliadas pela fórmula de cada serviço', ('servico',),
+    ),
+    'habitas_formula_segundos_total': (
+        CONTADOR, 'Tempo avaliando a fórmula de cada serviço', ('servico',),
+    ),
+    'habitas_cache_acessos_total': (
+        CONTADOR, 'Acessos aos caches (acerto ou falta)', ('cache', 'resultado'),
+    ),
+    'habitas_scraper_arvores_total': (
+        CONTADOR, 'IDs consultados pelo scraper da prefeitura', ('resultado',),
+    ),
+    'habitas_scraper_erros_total': (
+        CONTADOR, 'Execuções do scraper interrompidas por erro', (),
+    ),
+    'habitas_scraper_segundos_total': (
+        CONTADOR, 'Tempo de execução do scraper', (),
+    ),
+    'habitas_acervo_downloads_total': (
+        CONTADOR, 'Downloads de imagens e laudos da origem', ('resultado',),
+    ),
+    'habitas_importacao_linhas_total': (
+        CONTADOR, 'Linhas do CSV processadas na importação', ('resultado',),
+    ),
+    'habitas_importacao_segundos_total': (
+        CONTADOR, 'Tempo de importação do CSV', (),
+    ),
+    'habitas_importacao_linhas_por_segundo': (
+        MEDIDOR, 'Linhas por segundo da última importação', (),
+    ),
+}
+
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Soma dos processos encerrados; os arquivos por processo são "<pid>-<id>.json"
+ARQUIVO_ACUMULADO = 'acumulado.json'
+_ARQUIVO_PROCESSO = re.compile(r'^(\d+)-[0-9a-f]+\.json$')
+
+_trava = threading.Lock()
+_valores = defaultdict(dict)  # nome -> {rótulos: valor}
+_processo = {'pid': None, 'arquivo': None, 'gravado_em': 0.0, 'alterado': False}
+
+
+def ativas():
+    return getattr(settings, 'METRICAS_ATIVAS', True)
+
+
+def diretorio():
+    return Path(getattr(settings, 'METRICAS_DIR', settings.BASE_DIR / 'cache' / 'metricas'))
+
+
+def buckets():
+    return tuple(getattr(settings, 'METRICAS_BUCKETS', BUCKETS_PADRAO))
+
+
+def _verificar_processo():
+    """Depois de um fork (gunicorn --preload), recomeça com um arquivo novo"""
+    if _processo['pid'] != os.getpid():
+        _valores.clear()
+        _processo.update(
+            pid=os.getpid(),
+            arquivo=f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json',
+            gravado_em=time.monotonic(),
+            alterado=False,
+        )
+
+
+def _alterar(nome, rotulos, funcao):
+    if not ativas():
+        return
+    with _trava:
+        _verificar_processo()
+        serie = _valores[nome]
+        serie[rotulos] = funcao(serie.get(rotulos))
+        _processo['alterado'] = True
+        precisa_gravar = time.monotonic() - _processo['gravado_em'] >= getattr(settings, 'METRICAS_INTERVALO', 5)
+    if precisa_gravar:
+        gravar()
+
+
+def incrementar(nome, *rotulos, valor=1):
+    """Soma valor ao contador"""
+    _alterar(nome, rotulos, lambda atual: (atual or 0) + valor)
+
+
+def definir(nome, *rotulos, valor):
+    """Valor atual do medidor (entre processos vale o mais recente)"""
+    _alterar(nome, rotulos, lambda atual: [valor, time.time()])
+
+
+def observar(nome, *rotulos, valor):
+    """Registra uma observação no histograma"""
+    limites = buckets()
+
+    def somar(atual):
+        atual = atual or [0] * (len(limites) + 1) + [0.0]
+        posicao = next((i for i, limite in enumerate(limites) if valor <= limite), len(limites))
+        atual[posicao] += 1
+        atual[-1] += valor
+        return atual
+
+    _alterar(nome, rotulos, somar)
+
+
+def cache(nome, acerto):
+    """Conta um acesso ao cache nome"""
+    incrementar('habitas_cache_acessos_total', nome, 'acerto' if acerto else 'falta')
+
+
+def formula(servico, avaliacoes, segundos):
+    """Conta as avaliações da fórmula do serviço e o tempo gasto"""
+    incrementar('habitas_formula_avaliacoes_total', servico, valor=avaliacoes)
+    incrementar('habitas_formula_segundos_total', servico, valor=segundos)
+
+
+def gravar():
+    """Grava os valores deste processo no seu arquivo em METRICAS_DIR"""
+    with _trava:
+        _verificar_processo()
+        if not _processo['alterado']:
+            return
+        conteudo = json.dumps({
+            'buckets': buckets(),
+            'series': [
+                [nome, list(rotulos), valor]
+                for nome, serie in _valores.items()
+                for rotulos, valor in serie.items()
+            ],
+        })
+        pasta = diretorio()
+        pasta.mkdir(parents=True, exist_ok=True)
+        temporario = pasta / f"{_processo['arquivo']}.tmp"
+        temporario.write_text(conteudo)
+        temporario.replace(pasta / _processo['arquivo'])
+        _processo['gravado_em'] = time.monotonic()
+        _processo['alterado'] = False
+
+
+def _gravar_ao_sair():
+    try:
+        if ativas() and _processo['pid'] == os.getpid():
+            gravar()
+    except Exception:
+        pass
+
+
+atexit.register(_gravar_ao_sair)
+
+
+def _ler(arquivo):
+    """Séries do arquivo, ou None se ilegível ou com outros buckets"""
+    try:
+        dados = json.loads(arquivo.read_text())
+    except (OSError, ValueError):
+        return None  # removido ou sendo trocado
+    if list(dados.get('buckets', ())) != list(buckets()):
+        return None  # gravado com outra configuração de buckets
+    return dados['series']
+
+
+def _somar(totais, series):
+    for nome, rotulos, valor in series:
+        if nome not in METRICAS:
+            continue
+        rotulos = tuple(rotulos)
+        atual = totais[nome].get(rotulos)
+        tipo = METRICAS[nome][0]
+        if atual is None:
+            totais[nome][rotulos] = valor
+        elif tipo == HISTOGRAMA:
+            totais[nome][rotulos] = [a + b for a, b in zip(atual, valor)]
+        elif tipo == MEDIDOR:
+            totais[nome][rotulos] = max(atual, valor, key=lambda item: item[1])
+        else:
+            totais[nome][rotulos] = atual + valor
+    return totais
+
+
+def _processo_ativo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # existe, de outro usuário
+    return True
+
+
+def incorporar_encerrados():
+    """Soma os arquivos de processos encerrados a ARQUIVO_ACUMULADO e os remove
+
+    Protegido por uma trava de arquivo: com outra coleta em andamento, não
+    faz nada. Retorna o número de arquivos incorporados.
+    """
+    pasta = diretorio()
+    if fcntl is None or not pasta.is_dir():
+        return 0
+    with open(pasta / '.trava', 'a') as trava:
+        try:
+            fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return 0
+        encerrados = []
+        for arquivo in pasta.glob('*.json'):
+            correspondencia = _ARQUIVO_PROCESSO.match(arquivo.name)
+            if correspondencia and not _processo_ativo(int(correspondencia.group(1))):
+                encerrados.append(arquivo)
+        if not encerrados:
+            return 0
+        acumulado = pasta / ARQUIVO_ACUMULADO
+        totais = _somar(defaultdict(dict), _ler(acumulado) or [])
+        for arquivo in encerrados:
+            _somar(totais, _ler(arquivo) or [])
+        temporario = pasta / f'{ARQUIVO_ACUMULADO}.tmp'
+        temporario.write_text(json.dumps({
+            'buckets': buckets(),
+            'series': [
+                [nome, list(rotulos), valor]
+                for nome, serie in totais.items()
+                for rotulos, valor in serie.items()
+            ],
+        }))
+        temporario.replace(acumulado)
+        for arquivo in encerrados:
+            arquivo.unlink(missing_ok=True)
+        return len(encerrados)
+
+
+def coletar():
+    """Soma os arquivos de todos os processos: {nome: {rótulos: valor}}"""
+    if ativas():
+        gravar()
+    incorporar_encerrados()
+    totais = defaultdict(dict)
+    for arquivo in diretorio().glob('*.json'):
+        _somar(totais, _ler(arquivo) or [])
+    return totais
+
+
+def _rotulos(nomes, valores, extra=()):
+    pares = list(zip(nomes, valores)) + list(extra)
+    if not pares:
+        return ''
+    texto = ','.join(
+        '{}="{}"'.format(nome, str(valor).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for nome, valor in pares
+    )
+    return '{' + texto + '}'
+
+
+def _numero(valor):
+    if math.isinf(valor):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def exposicao():
+    """Texto no formato de exposição do Prometheus (versão 0.0.4)"""
+    totais = coletar()
+    limites = buckets()
+    linhas = []
+    for nome, (tipo, descricao, nomes_rotulos) in METRICAS.items():
+        linhas.append(f'# HELP {nome} {descricao}')
+        linhas.append(f'# TYPE {nome} {tipo}')
+        for rotulos, valor in sorted(totais.get(nome, {}).items()):
+            if tipo == HISTOGRAMA:
+                acumulado = 0
+                for limite, quantidade in zip(limites + (math.inf,), valor[:-1]):
+                    acumulado += quantidade
+                    le = _rotulos(nomes_rotulos, rotulos, [('le', _numero(limite))])
+                    linhas.append(f'{nome}_bucket{le} {acumulado}')
+                linhas.append(f'{nome}_sum{_rotulos(nomes_rotulos, rotulos)} {_numero(valor[-1])}')
+                linhas.append(f'{nome}_count{_rotulos(nomes_rotulos, rotulos)} {acumulado}')
+            else:
+                if tipo == MEDIDOR:
+                    valor = valor[0]
+                linhas.append(f'{nome}{_rotulos(nomes_rotulos, rotulos)} {_numero(valor)}')
+    return '\n'.join(linhas) + '\n'
+
+
+class MetricasMiddleware:
+    """Histograma de latência por view (nome da URL)
+
+    Requisições sem rota ficam como "<sem rota>", para que caminhos
+    arbitrários não criem séries novas.
+    """
+
+    def __init__(self, get_response):
+        if not ativas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        inicio = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        observar(
+            'habitas_requisicao_segundos',
+            match.view_name if match is not None else '<sem rota>',
+            request.method,
+            valor=time.perf_counter() - inicio,
+        )
+        return response
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.2 on 2026-10-19 15:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_treevariable_treevariablevalue_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TreeChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tree_id', models.BigIntegerField(db_index=True)),
+                ('operacao', models.CharField(choices=[('UPSERT', 'Inclusão/Atualização'), ('DELETE', 'Exclusão')], max_length=10)),
+                ('data', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Alteração de Árvore',
+                'verbose_name_plural': 'Alterações de Árvores',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.1.2 on 2026-10-19 15:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_treechange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeatmapNivel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nivel', models.PositiveSmallIntegerField(unique=True)),
+                ('maximos', models.JSONField(default=dict)),
+            ],
+            options={
+                'verbose_name': 'Nível do Mapa de Calor',
+                'verbose_name_plural': 'Níveis do Mapa de Calor',
+            },
+        ),
+        migrations.CreateModel(
+            name='HeatmapCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nivel', models.PositiveSmallIntegerField()),
+                ('cx', models.IntegerField()),
+                ('cy', models.IntegerField()),
+                ('totais', models.JSONField(default=dict)),
+            ],
+            options={
+                'verbose_name': 'Célula do Mapa de Calor',
+                'verbose_name_plural': 'Células do Mapa de Calor',
+                'unique_together': {('nivel', 'cx', 'cy')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TreeServiceValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('valor_fisico', models.FloatField(default=0.0)),
+                ('valor_monetario', models.FloatField(default=0.0)),
+                ('servico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='valores_arvores', to='main.ecosystemserviceconfig')),
+                ('tree', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='valores_servicos', to='main.tree')),
+            ],
+            options={
+                'verbose_name': 'Valor de Serviço por Árvore',
+                'verbose_name_plural': 'Valores de Serviços por Árvore',
+                'unique_together': {('tree', 'servico')},
+            },
+        ),
+    ]
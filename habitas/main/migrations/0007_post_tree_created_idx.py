@@ -0,0 +1,17 @@
+# Generated by Django 4.1.2 on 2026-10-19 15:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_heatmap'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['tree', '-created_on', '-id'], name='post_tree_created_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.2 on 2026-10-19 15:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_post_tree_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notificacao',
+            index=models.Index(fields=['status', '-data_criacao', '-id'], name='notif_status_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificacao',
+            index=models.Index(fields=['tecnico_responsavel', '-data_criacao', '-id'], name='notif_tecnico_data_idx'),
+        ),
+    ]
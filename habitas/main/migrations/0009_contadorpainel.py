@@ -0,0 +1,25 @@
+# Generated by Django 4.1.2 on 2026-10-19 16:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_notificacao_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorPainel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chave', models.CharField(max_length=100, unique=True)),
+                ('valor', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Contador do Painel',
+                'verbose_name_plural': 'Contadores do Painel',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.2 on 2026-10-19 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_contadorpainel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificacao',
+            name='foto_variantes',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
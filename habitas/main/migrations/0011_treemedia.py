@@ -0,0 +1,91 @@
+# Generated by Django 4.1.2 on 2026-10-19 16:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+LOTE = 2000
+
+
+def _separar(valor):
+    return [caminho.strip() for caminho in (valor or '').split(',') if caminho.strip()]
+
+
+def preencher_midias(apps, schema_editor):
+    """Copia Tree.laudo/Tree.imagem para TreeMedia, em lotes de árvores"""
+    Tree = apps.get_model('main', 'Tree')
+    TreeMedia = apps.get_model('main', 'TreeMedia')
+    arvores = (
+        Tree.objects.exclude(laudo='', imagem='')
+        .order_by('id')
+        .values_list('id', 'laudo', 'imagem')
+    )
+    ultimo_id = 0
+    while True:
+        lote = list(arvores.filter(id__gt=ultimo_id)[:LOTE])
+        if not lote:
+            break
+        midias, com_laudo = [], []
+        for tree_id, laudos, imagens in lote:
+            for tipo, valor in (('laudo', laudos), ('imagem', imagens)):
+                for ordem, url in enumerate(_separar(valor)):
+                    midias.append(TreeMedia(tree_id=tree_id, tipo=tipo, url=url, ordem=ordem))
+            if _separar(laudos):
+                com_laudo.append(tree_id)
+        TreeMedia.objects.bulk_create(midias, batch_size=LOTE)
+        Tree.objects.filter(id__in=com_laudo).update(tem_laudo=True)
+        ultimo_id = lote[-1][0]
+
+
+def restaurar_campos(apps, schema_editor):
+    """Reverte: remonta os textos separados por vírgula a partir de TreeMedia"""
+    Tree = apps.get_model('main', 'Tree')
+    TreeMedia = apps.get_model('main', 'TreeMedia')
+    valores = {}
+    for tree_id, tipo, url in TreeMedia.objects.order_by('tree_id', 'tipo', 'ordem').values_list(
+        'tree_id', 'tipo', 'url'
+    ).iterator(chunk_size=LOTE):
+        valores.setdefault(tree_id, {'laudo': [], 'imagem': []})[tipo].append(url)
+    for tree_id, campos in valores.items():
+        Tree.objects.filter(id=tree_id).update(
+            laudo=', '.join(campos['laudo']), imagem=', '.join(campos['imagem'])
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_notificacao_foto_variantes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tree',
+            name='tem_laudo',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.CreateModel(
+            name='TreeMedia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('imagem', 'Imagem'), ('laudo', 'Laudo')], max_length=10)),
+                ('url', models.CharField(max_length=500)),
+                ('ordem', models.PositiveSmallIntegerField(default=0)),
+                ('arquivo_local', models.CharField(blank=True, max_length=64)),
+                ('tree', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='midias', to='main.tree')),
+            ],
+            options={
+                'verbose_name': 'Mídia da Árvore',
+                'verbose_name_plural': 'Mídias das Árvores',
+                'ordering': ['tipo', 'ordem'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='treemedia',
+            index=models.Index(fields=['tipo', 'tree'], name='treemedia_tipo_tree_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='treemedia',
+            unique_together={('tree', 'tipo', 'ordem')},
+        ),
+        migrations.RunPython(preencher_midias, restaurar_campos),
+    ]
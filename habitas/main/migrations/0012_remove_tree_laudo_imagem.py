@@ -0,0 +1,21 @@
+# Generated by Django 4.1.2 on 2026-10-19 16:06
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_treemedia'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='tree',
+            name='imagem',
+        ),
+        migrations.RemoveField(
+            model_name='tree',
+            name='laudo',
+        ),
+    ]
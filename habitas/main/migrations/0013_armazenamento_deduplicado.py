@@ -0,0 +1,41 @@
+# Generated by Django 4.1.2 on 2026-10-19 16:09
+
+import django.core.validators
+from django.db import migrations, models
+import django.utils.timezone
+import main.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_remove_tree_laudo_imagem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArquivoConteudo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=255, unique=True)),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+                ('tamanho', models.BigIntegerField()),
+                ('referencias', models.IntegerField(default=0)),
+                ('enviado_em', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Arquivo Armazenado',
+                'verbose_name_plural': 'Arquivos Armazenados',
+            },
+        ),
+        migrations.AlterField(
+            model_name='customuser',
+            name='documento_comprobatorio',
+            field=models.FileField(blank=True, null=True, storage=main.storage.ConteudoEnderecadoStorage(), upload_to='credenciais/', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf', 'jpg', 'jpeg', 'png'])], verbose_name='Documento Comprobatório'),
+        ),
+        migrations.AlterField(
+            model_name='laudo',
+            name='arquivo',
+            field=models.FileField(storage=main.storage.ConteudoEnderecadoStorage(), upload_to='laudos/', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf'])], verbose_name='Arquivo PDF do Laudo'),
+        ),
+    ]
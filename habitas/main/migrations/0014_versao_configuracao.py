@@ -0,0 +1,29 @@
+# Generated by Django 4.1.2 on 2026-10-19 16:14
+
+from django.db import migrations, models
+
+
+def criar_versao(apps, schema_editor):
+    apps.get_model('main', 'VersaoConfiguracao').objects.create(id=1, versao=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_armazenamento_deduplicado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersaoConfiguracao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('versao', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Versão da Configuração',
+                'verbose_name_plural': 'Versão da Configuração',
+            },
+        ),
+        migrations.RunPython(criar_versao, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.1.2 on 2026-10-19 16:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_versao_configuracao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tree',
+            name='bairro',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+        migrations.CreateModel(
+            name='CrescimentoEspecie',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('incremento_dap', models.FloatField(verbose_name='Incremento anual do DAP (cm/ano)')),
+                ('dap_maximo', models.FloatField(verbose_name='DAP máximo (cm)')),
+                ('altura_maxima', models.FloatField(verbose_name='Altura máxima (m)')),
+                ('taxa_altura', models.FloatField(verbose_name='Taxa de crescimento da altura (1/ano)')),
+                ('species', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='crescimento', to='main.species')),
+            ],
+            options={
+                'verbose_name': 'Crescimento da Espécie',
+                'verbose_name_plural': 'Crescimento das Espécies',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.1.2 on 2026-10-19 16:32
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_bairro_crescimento_especie'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CenarioSimulacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chave', models.CharField(max_length=40, unique=True)),
+                ('nome', models.CharField(blank=True, max_length=200)),
+                ('definicao', models.JSONField()),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('criado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Cenário de Simulação',
+                'verbose_name_plural': 'Cenários de Simulação',
+                'ordering': ['-criado_em'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.2 on 2026-10-19 16:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_cenario_simulacao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tree',
+            name='area_copa',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Área da copa (m²)'),
+        ),
+        migrations.AddField(
+            model_name='tree',
+            name='biomassa',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Biomassa (t)'),
+        ),
+    ]
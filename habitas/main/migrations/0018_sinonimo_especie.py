@@ -0,0 +1,32 @@
+# Generated by Django 4.1.2 on 2026-10-19 16:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_medidas_derivadas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SinonimoEspecie',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=255)),
+                ('tipo', models.CharField(choices=[('cientifico', 'Sinônimo científico'), ('popular', 'Nome popular')], default='popular', max_length=20)),
+                ('nome_normalizado', models.CharField(db_index=True, editable=False, max_length=255)),
+                ('species', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sinonimos', to='main.species')),
+            ],
+            options={
+                'verbose_name': 'Sinônimo de Espécie',
+                'verbose_name_plural': 'Sinônimos de Espécies',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='sinonimoespecie',
+            constraint=models.UniqueConstraint(fields=('nome_normalizado', 'tipo'), name='sinonimo_unico_por_tipo'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.2 on 2026-10-19 16:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_sinonimo_especie'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoInventario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bairro', models.CharField(blank=True, max_length=100)),
+                ('nome_cientifico', models.CharField(max_length=255)),
+                ('origem', models.CharField(max_length=20)),
+                ('arvores', models.IntegerField(default=0)),
+                ('comentarios', models.IntegerField(default=0)),
+                ('totais', models.JSONField(default=dict)),
+            ],
+            options={
+                'verbose_name': 'Resumo do Inventário',
+                'verbose_name_plural': 'Resumos do Inventário',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='resumoinventario',
+            constraint=models.UniqueConstraint(fields=('bairro', 'nome_cientifico', 'origem'), name='resumo_unico'),
+        ),
+    ]
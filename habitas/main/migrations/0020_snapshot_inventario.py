@@ -0,0 +1,33 @@
+# Generated by Django 4.1.2 on 2026-10-19 16:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0019_resumo_inventario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotInventario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('criado_em', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('descricao', models.CharField(blank=True, max_length=200)),
+                ('arquivo', models.FileField(upload_to='snapshots/')),
+                ('arvores', models.IntegerField()),
+                ('versao_inventario', models.BigIntegerField()),
+                ('versao_configuracao', models.BigIntegerField()),
+                ('tamanho', models.BigIntegerField(help_text='Tamanho do arquivo em bytes')),
+                ('totais', models.JSONField(default=dict)),
+                ('servicos', models.JSONField(default=list)),
+            ],
+            options={
+                'verbose_name': 'Snapshot do Inventário',
+                'verbose_name_plural': 'Snapshots do Inventário',
+                'ordering': ['-criado_em'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.2 on 2026-10-19 17:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0020_snapshot_inventario'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='treechange',
+            name='data',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+from main.bairros import localizar
+
+LOTE = 2000
+
+
+def preencher_bairros(apps, schema_editor):
+    """Preenche Tree.bairro (0015) das árvores existentes, em lotes
+
+    Os resumos são apagados e reconstruídos (com o número de árvores
+    materializadas por serviço) na primeira leitura dos painéis.
+    """
+    Tree = apps.get_model('main', 'Tree')
+    ResumoInventario = apps.get_model('main', 'ResumoInventario')
+    arvores = Tree.objects.filter(bairro='').order_by('id').values_list('id', 'latitude', 'longitude')
+    ultimo_id = 0
+    while True:
+        lote = list(arvores.filter(id__gt=ultimo_id)[:LOTE])
+        if not lote:
+            break
+        por_bairro = {}
+        for tree_id, latitude, longitude in lote:
+            bairro = localizar(latitude, longitude)
+            if bairro:
+                por_bairro.setdefault(bairro, []).append(tree_id)
+        for bairro, ids in por_bairro.items():
+            Tree.objects.filter(id__in=ids).update(bairro=bairro)
+        ultimo_id = lote[-1][0]
+    ResumoInventario.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0021_treechange_data_indice'),
+    ]
+
+    operations = [
+        migrations.RunPython(preencher_bairros, migrations.RunPython.noop),
+    ]
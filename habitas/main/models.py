@@ -1,8 +1,17 @@
+import ast
 import math
 import json
-from django.db import models
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
 from django.core.validators import FileExtensionValidator
+from django.utils import timezone
+from .instrumentacao import medir_formulas
+from .sandbox import FormulaBloqueada, arvore_portavel, avaliar_lote, normalizar_resultado
+from .storage import armazenamento_deduplicado
 
 # Create your models here.
 BETA0 = -0.906586
@@ -16,6 +25,20 @@ RADIATION = 1661 # Radiação solar anual em São José dos Campos (kWh / m^2)
 ENERGY_RATIO = 0.25 # Taxa de aproveitamento da energia das sombras
 
 
+def biomassa_estimada(dap, altura):
+    """Biomassa da árvore (t) pela equação alométrica (BETA0, BETA1, BETA2)"""
+    if not dap or not altura or dap <= 0 or altura <= 0:
+        return 0.0
+    return math.exp(BETA0 + BETA1 * math.log(dap) + BETA2 * math.log(altura)) / 1000
+
+
+def area_copa_estimada(dap):
+    """Área da copa (m²), com diâmetro da copa = DIAMETER_RATIO * DAP"""
+    if not dap or dap <= 0:
+        return 0.0
+    return math.pi * ((dap * DIAMETER_RATIO) / (2 * 100)) ** 2
+
+
 class CustomUser(AbstractUser):
     """Modelo de usuário customizado com 3 níveis de acesso"""
     
@@ -36,6 +59,7 @@ class CustomUser(AbstractUser):
     registro_profissional = models.CharField(max_length=100, blank=True, verbose_name="Registro Profissional")
     documento_comprobatorio = models.FileField(
         upload_to='credenciais/',
+        storage=armazenamento_deduplicado,
         blank=True,
         null=True,
         validators=[FileExtensionValidator(allowed_extensions=['pdf', 'jpg', 'jpeg', 'png'])],
@@ -96,39 +120,53 @@ class Tree(models.Model):
     # data_da_coleta = models.DateField(blank=True)
     latitude = models.FloatField()
     longitude = models.FloatField()
-    laudo = models.URLField(max_length=255, blank=True)
-    imagem = models.URLField(max_length=255, blank=True)
+    # Desnormalizado de TreeMedia (filtro "apenas árvores com laudo")
+    tem_laudo = models.BooleanField(default=False, db_index=True)
     plantado_por = models.CharField(max_length=100, default="DCTA")
     species = models.ForeignKey('Species', null=True, on_delete=models.SET_NULL)
+    # Preenchido a partir de lat/long (main/bairros.py) ao salvar
+    bairro = models.CharField(max_length=100, blank=True, db_index=True)
+    # Derivados de dap/altura, atualizados ao salvar (atualizar_medidas_derivadas)
+    biomassa = models.FloatField(null=True, blank=True, editable=False, verbose_name='Biomassa (t)')
+    area_copa = models.FloatField(null=True, blank=True, editable=False, verbose_name='Área da copa (m²)')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # dap/altura a que biomassa e area_copa gravadas correspondem
+        instance._medidas_de = (instance.__dict__.get('dap'), instance.__dict__.get('altura'))
+        return instance
+
+    def atualizar_medidas_derivadas(self):
+        """Recalcula biomassa e area_copa; retorna True se algum valor mudou"""
+        biomassa = biomassa_estimada(self.dap, self.altura)
+        area_copa = area_copa_estimada(self.dap)
+        mudou = (biomassa, area_copa) != (self.biomassa, self.area_copa)
+        self.biomassa, self.area_copa = biomassa, area_copa
+        self._medidas_de = (self.dap, self.altura)
+        return mudou
+
+    def medidas_derivadas(self):
+        """(biomassa, area_copa): das colunas se estiverem em dia com dap/altura"""
+        if (
+            getattr(self, '_medidas_de', None) == (self.dap, self.altura)
+            and self.__dict__.get('biomassa') is not None
+            and self.__dict__.get('area_copa') is not None
+        ):
+            return self.biomassa, self.area_copa
+        return biomassa_estimada(self.dap, self.altura), area_copa_estimada(self.dap)
 
     @property
     def stored_co2(self) -> float:
-        if self.dap <= 0 or self.altura <= 0:
-            return 0
-
-        return round(
-            (
-                math.exp(
-                    BETA0 + BETA1 * math.log(self.dap) + BETA2 * math.log(self.altura)
-                )
-                / 1000
-            ),
-            4,
-        )
+        return round(self.medidas_derivadas()[0], 4)
 
     @property
     def stormwater_intercepted(self) -> float:
-        if self.dap <= 0:
-            return 0
-
-        return math.pi * ((self.dap * DIAMETER_RATIO) / (2 * 100)) ** 2 * PRECIPITATION
+        return self.medidas_derivadas()[1] * PRECIPITATION
 
     @property
     def conserved_energy(self) -> float:
-        if self.dap <= 0:
-            return 0
-
-        return math.pi * ((self.dap * DIAMETER_RATIO) / (2 * 100)) ** 2 * RADIATION * ENERGY_RATIO
+        return self.medidas_derivadas()[1] * RADIATION * ENERGY_RATIO
 
     @property
     def biodiversity(self) -> float:
@@ -138,10 +176,13 @@ class Tree(models.Model):
     
     def get_ecosystem_service_value(self, codigo_servico):
         """Obtém o valor de um serviço ecossistêmico específico via configuração dinâmica"""
-        try:
-            config = EcosystemServiceConfig.objects.get(codigo=codigo_servico, ativo=True)
-            return config.calcular(self)
-        except EcosystemServiceConfig.DoesNotExist:
+        from .configuracao import obter_configuracao
+
+        configuracao = obter_configuracao()
+        config = configuracao.servicos_por_codigo.get(codigo_servico)
+        if config is not None:
+            return config.calcular(self, configuracao)
+        else:
             # Fallback para métodos antigos (compatibilidade)
             if codigo_servico == 'co2_armazenado':
                 return self.stored_co2
@@ -155,10 +196,12 @@ class Tree(models.Model):
     
     def get_all_ecosystem_services(self):
         """Retorna dict com todos os serviços ecossistêmicos ativos"""
-        servicos = EcosystemServiceConfig.objects.filter(ativo=True).order_by('ordem_exibicao')
+        from .configuracao import obter_configuracao
+
+        configuracao = obter_configuracao()
         resultado = {}
-        for servico in servicos:
-            valor_fisico = servico.calcular(self)
+        for servico in configuracao.servicos:
+            valor_fisico = servico.calcular(self, configuracao)
             resultado[servico.codigo] = {
                 'nome': servico.nome,
                 'valor_fisico': valor_fisico,
@@ -175,7 +218,7 @@ class Tree(models.Model):
     
     # ============ MÉTODOS PARA VARIÁVEIS CUSTOMIZADAS ============
     
-    def get_variable_value(self, codigo_variavel):
+    def get_variable_value(self, codigo_variavel, variable=None):
         """Obtém o valor de uma variável customizada para esta árvore
         
         Busca na seguinte ordem:
@@ -183,43 +226,170 @@ class Tree(models.Model):
         2. Valor padrão da espécie (SpeciesVariableDefault)
         3. Valor padrão geral (TreeVariable.valor_padrao_geral)
         
-        Retorna None se não encontrar valor em nenhum nível.
+        Retorna None se não encontrar valor em nenhum nível. variable (a
+        TreeVariable já obtida da configuração) evita consultá-la de novo.
         """
+        # Valores já resolvidos em lote (ex.: projeção de crescimento)
+        valores = getattr(self, '_valores_variaveis', None)
+        if valores is not None:
+            return valores.get(codigo_variavel)
+
         # Importação local para evitar import circular
         from django.apps import apps
-        TreeVariable = apps.get_model('main', 'TreeVariable')
+        from .configuracao import obter_configuracao
         TreeVariableValue = apps.get_model('main', 'TreeVariableValue')
         SpeciesVariableDefault = apps.get_model('main', 'SpeciesVariableDefault')
         
+        if variable is None:
+            variable = obter_configuracao().variaveis_por_codigo.get(codigo_variavel)
+        if variable is None:
+            return None
+
+        # 1. Busca valor específico da árvore
         try:
-            variable = TreeVariable.objects.get(codigo=codigo_variavel, ativo=True)
-            
-            # 1. Busca valor específico da árvore
+            tree_value = TreeVariableValue.objects.get(tree=self, variable=variable)
+            return tree_value.valor
+        except TreeVariableValue.DoesNotExist:
+            pass
+        
+        # 2. Busca valor padrão da espécie
+        if self.species:
             try:
-                tree_value = TreeVariableValue.objects.get(tree=self, variable=variable)
-                return tree_value.valor
-            except TreeVariableValue.DoesNotExist:
+                species_default = SpeciesVariableDefault.objects.get(
+                    species=self.species, 
+                    variable=variable
+                )
+                return species_default.valor_padrao
+            except SpeciesVariableDefault.DoesNotExist:
                 pass
-            
-            # 2. Busca valor padrão da espécie
-            if self.species:
-                try:
-                    species_default = SpeciesVariableDefault.objects.get(
-                        species=self.species, 
-                        variable=variable
-                    )
-                    return species_default.valor_padrao
-                except SpeciesVariableDefault.DoesNotExist:
-                    pass
-            
-            # 3. Retorna valor padrão geral
-            if variable.valor_padrao_geral:
-                return variable.valor_padrao_geral
-            
-            return None
-            
-        except TreeVariable.DoesNotExist:
-            return None
+        
+        # 3. Retorna valor padrão geral
+        if variable.valor_padrao_geral:
+            return variable.valor_padrao_geral
+        
+        return None
+
+
+class TreeMedia(models.Model):
+    """Imagem ou laudo de uma árvore hospedado no site da prefeitura"""
+
+    class Tipo(models.TextChoices):
+        IMAGEM = 'imagem', 'Imagem'
+        LAUDO = 'laudo', 'Laudo'
+
+    tree = models.ForeignKey(Tree, on_delete=models.CASCADE, related_name='midias')
+    tipo = models.CharField(max_length=10, choices=Tipo.choices)
+    # Caminho relativo à origem (ACERVO_ORIGEM), como vem do site
+    url = models.CharField(max_length=500)
+    ordem = models.PositiveSmallIntegerField(default=0)
+    # Chave do arquivo no cache local, preenchida no primeiro acesso
+    arquivo_local = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        ordering = ['tipo', 'ordem']
+        unique_together = [['tree', 'tipo', 'ordem']]
+        indexes = [
+            models.Index(fields=['tipo', 'tree'], name='treemedia_tipo_tree_idx'),
+        ]
+        verbose_name = 'Mídia da Árvore'
+        verbose_name_plural = 'Mídias das Árvores'
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.ordem + 1} - árvore {self.tree_id}"
+
+    @staticmethod
+    def separar(valor):
+        """Lista de caminhos de um texto separado por vírgulas (formato do scraper)"""
+        return [caminho.strip() for caminho in (valor or '').split(',') if caminho.strip()]
+
+    @classmethod
+    def criar_para(cls, tree_id, laudos='', imagens=''):
+        """Objetos (não salvos) a partir dos textos de laudos e imagens"""
+        midias = []
+        for tipo, valor in ((cls.Tipo.LAUDO, laudos), (cls.Tipo.IMAGEM, imagens)):
+            for ordem, url in enumerate(cls.separar(valor)):
+                midias.append(cls(tree_id=tree_id, tipo=tipo, url=url, ordem=ordem))
+        return midias
+
+    @classmethod
+    def atualizar_tem_laudo(cls, tree_ids):
+        """Recalcula Tree.tem_laudo para as árvores informadas"""
+        tree_ids = list(tree_ids)
+        com_laudo = cls.objects.filter(tipo=cls.Tipo.LAUDO, tree_id__in=tree_ids).values('tree_id')
+        Tree.objects.filter(id__in=tree_ids).exclude(tem_laudo=True).filter(id__in=com_laudo).update(tem_laudo=True)
+        Tree.objects.filter(id__in=tree_ids, tem_laudo=True).exclude(id__in=com_laudo).update(tem_laudo=False)
+
+
+class TreeChange(models.Model):
+    """Registro de alterações em árvores para sincronização incremental
+
+    O id (autoincremento) funciona como versão monotônica do conjunto de
+    posições: clientes guardam a última versão vista e pedem apenas as
+    alterações posteriores. Exclusões ficam registradas como tombstones.
+
+    Ids são alocados na inserção, não no commit: uma transação mais lenta
+    pode tornar visível um id menor que outro já lido. Por isso a versão
+    entregue aos clientes é versao_segura() (com SYNC_ATRASO_SEGUNDOS de
+    folga) e as alterações mais recentes são reenviadas na sincronização
+    seguinte. Registros substituídos por outro mais novo da mesma árvore
+    são removidos por compactar() (comando compactar_alteracoes).
+    """
+
+    class Operacao(models.TextChoices):
+        UPSERT = 'UPSERT', 'Inclusão/Atualização'
+        DELETE = 'DELETE', 'Exclusão'
+
+    tree_id = models.BigIntegerField(db_index=True)
+    operacao = models.CharField(max_length=10, choices=Operacao.choices)
+    data = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = 'Alteração de Árvore'
+        verbose_name_plural = 'Alterações de Árvores'
+
+    def __str__(self):
+        return f"#{self.id} {self.get_operacao_display()} árvore {self.tree_id}"
+
+    @classmethod
+    def versao_atual(cls):
+        """Retorna a versão mais recente do conjunto de posições (0 se vazio)"""
+        ultima = cls.objects.order_by('-id').values_list('id', flat=True).first()
+        return ultima or 0
+
+    @classmethod
+    def versao_segura(cls):
+        """Versão até a qual nenhuma transação em andamento ainda pode gravar
+
+        Alterações dos últimos SYNC_ATRASO_SEGUNDOS podem ter ids menores
+        ainda não visíveis; a versão para antes da primeira delas.
+        """
+        limite = timezone.now() - timedelta(seconds=getattr(settings, 'SYNC_ATRASO_SEGUNDOS', 300))
+        recente = cls.objects.filter(data__gt=limite).order_by('id').values_list('id', flat=True).first()
+        if recente is None:
+            return cls.versao_atual()
+        return recente - 1
+
+    @classmethod
+    def compactar(cls):
+        """Remove os registros substituídos por um mais novo da mesma árvore
+
+        Um cliente em qualquer versão continua recebendo o estado final de
+        cada árvore (o último registro dela é mantido). Só considera
+        registros até versao_segura(). Retorna o número de removidos.
+        """
+        limite = cls.versao_segura()
+        ultimas = cls.objects.order_by().values('tree_id').annotate(ultima=models.Max('id')).values('ultima')
+        removidos, _ = cls.objects.filter(id__lte=limite).exclude(id__in=ultimas).delete()
+        return removidos
+
+    @classmethod
+    def registrar(cls, tree_ids, operacao=Operacao.UPSERT):
+        """Registra alterações em lote (usado por bulk_create, que não dispara signals)"""
+        cls.objects.bulk_create(
+            [cls(tree_id=tree_id, operacao=operacao) for tree_id in tree_ids],
+            batch_size=1000,
+        )
 
 
 class Post(models.Model):
@@ -231,12 +401,76 @@ class Post(models.Model):
 
     class Meta:
         ordering = ("-created_on",)
+        indexes = [
+            # Paginação por chave (created_on, id) dos comentários de cada árvore
+            models.Index(fields=["tree", "-created_on", "-id"], name="post_tree_created_idx"),
+        ]
 
 
 class Species(models.Model):
     name = models.TextField()
     bio_index = models.FloatField()
 
+    def __str__(self):
+        return self.name
+
+
+class SinonimoEspecie(models.Model):
+    """Outro nome (sinônimo científico ou nome popular) de uma espécie
+
+    Usado por main/especies.py para vincular as árvores a Species.
+    """
+
+    class Tipo(models.TextChoices):
+        CIENTIFICO = 'cientifico', 'Sinônimo científico'
+        POPULAR = 'popular', 'Nome popular'
+
+    species = models.ForeignKey(Species, on_delete=models.CASCADE, related_name='sinonimos')
+    nome = models.CharField(max_length=255)
+    tipo = models.CharField(max_length=20, choices=Tipo.choices, default=Tipo.POPULAR)
+    # Preenchido ao salvar (main.especies.normalizar_nome)
+    nome_normalizado = models.CharField(max_length=255, editable=False, db_index=True)
+
+    class Meta:
+        verbose_name = 'Sinônimo de Espécie'
+        verbose_name_plural = 'Sinônimos de Espécies'
+        constraints = [
+            models.UniqueConstraint(fields=['nome_normalizado', 'tipo'], name='sinonimo_unico_por_tipo'),
+        ]
+
+    def __str__(self):
+        return f"{self.nome} → {self.species.name}"
+
+    def save(self, *args, **kwargs):
+        from .especies import normalizar_nome
+
+        self.nome_normalizado = normalizar_nome(self.nome)
+        super().save(*args, **kwargs)
+
+
+class CrescimentoEspecie(models.Model):
+    """Parâmetros de crescimento usados na projeção (main/projecao.py)
+
+    DAP cresce linearmente até dap_maximo; a altura se aproxima de
+    altura_maxima exponencialmente:
+        dap(t) = min(dap + incremento_dap * t, dap_maximo)
+        altura(t) = altura_maxima - (altura_maxima - altura) * exp(-taxa_altura * t)
+    Espécies sem parâmetros usam PROJECAO_CRESCIMENTO_PADRAO.
+    """
+
+    species = models.OneToOneField(Species, on_delete=models.CASCADE, related_name='crescimento')
+    incremento_dap = models.FloatField(verbose_name="Incremento anual do DAP (cm/ano)")
+    dap_maximo = models.FloatField(verbose_name="DAP máximo (cm)")
+    altura_maxima = models.FloatField(verbose_name="Altura máxima (m)")
+    taxa_altura = models.FloatField(verbose_name="Taxa de crescimento da altura (1/ano)")
+
+    class Meta:
+        verbose_name = 'Crescimento da Espécie'
+        verbose_name_plural = 'Crescimento das Espécies'
+
+    def __str__(self):
+        return f"{self.species.name}: +{self.incremento_dap} cm/ano"
+
 
 class Laudo(models.Model):
     """Modelo para laudos técnicos"""
@@ -253,6 +487,7 @@ class Laudo(models.Model):
     descricao = models.TextField()
     arquivo = models.FileField(
         upload_to='laudos/',
+        storage=armazenamento_deduplicado,
         validators=[FileExtensionValidator(allowed_extensions=['pdf'])],
         verbose_name="Arquivo PDF do Laudo"
     )
@@ -300,6 +535,8 @@ class Notificacao(models.Model):
     titulo = models.CharField(max_length=255)
     descricao = models.TextField()
     foto = models.ImageField(upload_to='notificacoes/', blank=True, null=True)
+    # Caminhos das variantes reduzidas: {'miniatura': {'webp': ..., 'jpeg': ...}, 'exibicao': {...}}
+    foto_variantes = models.JSONField(default=dict, blank=True, editable=False)
     status = models.CharField(
         max_length=15,
         choices=StatusNotificacao.choices,
@@ -321,10 +558,31 @@ class Notificacao(models.Model):
         ordering = ['-data_criacao']
         verbose_name = 'Notificação'
         verbose_name_plural = 'Notificações'
+        indexes = [
+            # Fila de notificações paginada por (data_criacao, id)
+            models.Index(fields=['status', '-data_criacao', '-id'], name='notif_status_data_idx'),
+            models.Index(fields=['tecnico_responsavel', '-data_criacao', '-id'], name='notif_tecnico_data_idx'),
+        ]
     
     def __str__(self):
         return f"{self.get_tipo_display()} - {self.titulo}"
 
+    def _urls_variante(self, tamanho):
+        caminhos = (self.foto_variantes or {}).get(tamanho)
+        if not caminhos:
+            return None
+        return {formato: self.foto.storage.url(caminho) for formato, caminho in caminhos.items()}
+
+    @property
+    def foto_miniatura(self):
+        """URLs da miniatura ({'webp': ..., 'jpeg': ...}) ou None se ainda não processada"""
+        return self._urls_variante('miniatura')
+
+    @property
+    def foto_exibicao(self):
+        """URLs do tamanho de exibição ou None se ainda não processada"""
+        return self._urls_variante('exibicao')
+
 
 class HistoricoNotificacao(models.Model):
     """Histórico de mudanças em notificações"""
@@ -348,7 +606,7 @@ class EcosystemServiceConfig(models.Model):
     descricao = models.TextField(blank=True, verbose_name="Descrição")
     
     # Fórmula matemática (string Python que será avaliada)
-    # Variáveis disponíveis: dap, altura, biomassa, tree
+    # Variáveis disponíveis: dap, altura, biomassa, area_copa, tree
     # Exemplo: "math.exp(coeficientes['BETA0'] + coeficientes['BETA1'] * math.log(dap) + coeficientes['BETA2'] * math.log(altura)) / 1000"
     formula = models.TextField(verbose_name="Fórmula Python")
     
@@ -398,97 +656,244 @@ class EcosystemServiceConfig(models.Model):
         status = "✓" if self.ativo else "✗"
         return f"{status} {self.nome}"
     
-    def calcular(self, tree):
-        """Calcula o valor do serviço para uma árvore"""
-        if not self.ativo:
-            return 0.0
+    def contexto_formula(self, tree, configuracao=None):
+        """Variáveis da fórmula para a árvore (None se dap/altura inválidos)
+
+        Não inclui math, hasattr, getattr nem a própria árvore ("tree"),
+        acrescentados por quem avalia (aqui ou no sandbox). Em lotes, quem
+        chama passa a configuração (obter_configuracao()) já obtida: fora
+        de requisições, cada chamada a obter_configuracao consulta o banco.
+        """
+        dap = float(tree.dap) if tree.dap else 0
+        altura = float(tree.altura) if tree.altura else 0
         
-        try:
-            import math
-            
-            dap = float(tree.dap) if tree.dap else 0
-            altura = float(tree.altura) if tree.altura else 0
-            
-            # Validação: DAP e altura devem ser > 0 para cálculos com log
-            # Retorna 0 imediatamente se dados inválidos
-            if dap <= 0 or altura <= 0:
-                return 0.0
-            
-            # Calcula biomassa se necessário (para novos serviços)
-            if dap > 0 and altura > 0:
-                biomassa = math.exp(
-                    -0.906586 + 1.60421 * math.log(dap) + 0.37162 * math.log(altura)
-                ) / 1000  # em toneladas
-            else:
-                biomassa = 0.0
-            
-            # Prepara contexto - IMPORTANTE: manter compatibilidade com código atual
-            coeficientes = self.coeficientes if self.coeficientes else {}
-            context = {
-                'math': math,
-                'dap': dap,
-                'altura': altura,
-                'biomassa': biomassa,
-                'tree': tree,  # Para acessar species, etc.
-                'coeficientes': coeficientes,  # Para fórmulas que usam coeficientes["KEY"]
-                'hasattr': hasattr,  # Para uso em fórmulas que verificam atributos
-                'getattr': getattr,  # Para uso em fórmulas que acessam atributos
-            }
-            
-            # Expande coeficientes individualmente também (para compatibilidade)
-            for key, value in coeficientes.items():
-                context[key] = value
-            
-            # Adiciona variáveis customizadas ao contexto
+        # Validação: DAP e altura devem ser > 0 para cálculos com log
+        # Retorna None imediatamente se dados inválidos
+        if dap <= 0 or altura <= 0:
+            return None
+        
+        # Só resolve o que a fórmula usa
+        dependencias = self.dependencias()
+
+        # Biomassa (t) e área da copa (m²): gravadas na árvore, se em dia
+        if 'biomassa' in dependencias or 'area_copa' in dependencias:
+            biomassa, area_copa = tree.medidas_derivadas()
+        else:
+            biomassa = area_copa = 0.0
+        
+        # Adiciona variáveis customizadas ao contexto
+        if configuracao is None:
             # Importação local para evitar import circular
-            from django.apps import apps
-            TreeVariable = apps.get_model('main', 'TreeVariable')
-            
-            variaveis_customizadas = TreeVariable.objects.filter(ativo=True)
-            for var in variaveis_customizadas:
-                valor = tree.get_variable_value(var.codigo)
-                if valor is not None:
-                    # Converte para float se for numérico
-                    if var.tipo_dado in ['FLOAT', 'INTEGER']:
-                        try:
-                            context[var.codigo] = float(valor) if isinstance(valor, (int, float, str)) else 0.0
-                        except (ValueError, TypeError):
-                            context[var.codigo] = 0.0
-                    else:
-                        context[var.codigo] = valor
+            from .configuracao import obter_configuracao
+            configuracao = obter_configuracao()
+        
+        valores = {
+            var.codigo: tree.get_variable_value(var.codigo, var)
+            for var in configuracao.variaveis if var.codigo in dependencias
+        }
+        return self.contexto_medidas(dap, altura, biomassa, area_copa, valores, configuracao.variaveis)
+
+    def contexto_medidas(self, dap, altura, biomassa, area_copa, valores, variaveis):
+        """Variáveis da fórmula a partir de valores simples, sem instância de Tree
+
+        valores: {código da variável: valor bruto (ou None)}; variaveis: as
+        TreeVariable da configuração. dap e altura já validados (> 0).
+        """
+        dependencias = self.dependencias()
+
+        # Prepara contexto - IMPORTANTE: manter compatibilidade com código atual
+        coeficientes = self.coeficientes if self.coeficientes else {}
+        context = {
+            'dap': dap,
+            'altura': altura,
+            'biomassa': biomassa,
+            'area_copa': area_copa,
+            'coeficientes': coeficientes,  # Para fórmulas que usam coeficientes["KEY"]
+        }
+        
+        # Expande coeficientes individualmente também (para compatibilidade)
+        for key, value in coeficientes.items():
+            context[key] = value
+        
+        for var in variaveis:
+            if var.codigo not in dependencias:
+                continue
+            valor = valores.get(var.codigo)
+            if valor is not None:
+                # Converte para float se for numérico
+                if var.tipo_dado in ['FLOAT', 'INTEGER']:
+                    try:
+                        context[var.codigo] = float(valor) if isinstance(valor, (int, float, str)) else 0.0
+                    except (ValueError, TypeError):
+                        context[var.codigo] = 0.0
                 else:
-                    # Define como 0 para variáveis numéricas, None para strings
-                    context[var.codigo] = 0.0 if var.tipo_dado in ['FLOAT', 'INTEGER'] else None
-            
-            # Avalia a fórmula com tratamento de erros matemáticos
-            try:
-                resultado = eval(self.formula, {"__builtins__": {}}, context)
-                # Validação do resultado
-                if not isinstance(resultado, (int, float)) or math.isnan(resultado) or math.isinf(resultado):
-                    return 0.0
-                # Arredondamento igual ao código original
-                return round(float(resultado), 4)
-            except (ValueError, ZeroDivisionError, OverflowError) as math_error:
-                # Erro matemático (log de número <= 0, divisão por zero, overflow)
-                # Retorna 0 silenciosamente - não loga para não poluir console
-                return 0.0
-            
-        except (ValueError, ZeroDivisionError, OverflowError) as math_error:
-            # Erro matemático capturado no nível externo também
-            # Silenciosamente retorna 0
+                    context[var.codigo] = valor
+            else:
+                # Define como 0 para variáveis numéricas, None para strings
+                context[var.codigo] = 0.0 if var.tipo_dado in ['FLOAT', 'INTEGER'] else None
+        return context
+
+    def calcular(self, tree, configuracao=None):
+        """Calcula o valor do serviço para uma árvore (avaliado no sandbox)
+
+        calcular_lote para uma única árvore. Uma fórmula bloqueada no
+        sandbox (ou com erro) resulta em 0, como os erros matemáticos.
+        """
+        if not self.ativo:
             return 0.0
+
+        try:
+            return self.calcular_lote([tree], ignorar_bloqueio=True, configuracao=configuracao)[0]
         except Exception as e:
-            # Apenas loga erros não-matemáticos para debug
+            # Ex.: erro de sintaxe na fórmula
             print(f"Erro ao calcular {self.nome} para árvore {tree.id}: {e}")
-            import traceback
-            traceback.print_exc()
             return 0.0
+
+    def validar_no_sandbox(self, variaveis=None):
+        """Avalia a fórmula no sandbox com medidas de exemplo antes de salvar
+
+        Levanta ValidationError se a fórmula tiver erro de sintaxe ou exceder
+        os limites de tempo ou memória do sandbox. Erros de avaliação (ex.:
+        log de número negativo) não impedem o salvamento.
+        """
+        if variaveis is None:
+            from .configuracao import obter_configuracao
+            variaveis = obter_configuracao().variaveis
+        dap, altura = 30.0, 10.0
+        valores = {
+            var.codigo: 1.0 for var in variaveis if var.tipo_dado in ['FLOAT', 'INTEGER']
+        }
+        try:
+            contexto = self.contexto_medidas(
+                dap, altura, biomassa_estimada(dap, altura), area_copa_estimada(dap),
+                valores, variaveis,
+            )
+        except SyntaxError as e:
+            raise ValidationError({'formula': f"Erro de sintaxe: {e.msg}"})
+        try:
+            avaliar_lote(self.formula, [contexto])
+        except FormulaBloqueada as e:
+            raise ValidationError({'formula': str(e)})
+
+    def clean(self):
+        super().clean()
+        if self.formula:
+            self.validar_no_sandbox()
+
+    def calcular_lote(self, trees, ignorar_bloqueio=False, configuracao=None):
+        """Valores do serviço para várias árvores, avaliados no sandbox
+
+        Mesmo resultado de calcular() para cada árvore. Se a fórmula
+        exceder os limites do sandbox, FormulaBloqueada é propagada (com
+        ignorar_bloqueio=True, todas ficam com 0). A configuração é obtida
+        uma vez para o lote todo.
+        """
+        if not self.ativo:
+            return [0.0] * len(trees)
+        if configuracao is None:
+            from .configuracao import obter_configuracao
+            configuracao = obter_configuracao()
+        contextos = []
+        usa_arvore = 'tree' in self.dependencias()
+        for tree in trees:
+            try:
+                context = self.contexto_formula(tree, configuracao)
+            except (ValueError, ZeroDivisionError, OverflowError):
+                context = None
+            if context is not None and usa_arvore:
+                context['tree'] = arvore_portavel(tree)
+            contextos.append(context)
+        return self.calcular_contextos(contextos, ignorar_bloqueio)
+
+    def calcular_contextos(self, contextos, ignorar_bloqueio=False):
+        """calcular_lote para contextos já montados (None: valor 0)
+
+        Para quem resolve as variáveis em lote, sem instâncias de Tree (ex.:
+        projeção e cenários). "tree", se a fórmula usar, deve ser portável
+        (ver sandbox.arvore_portavel).
+        """
+        if not self.ativo:
+            return [0.0] * len(contextos)
+        valores = [0.0] * len(contextos)
+        posicoes = [posicao for posicao, contexto in enumerate(contextos) if contexto is not None]
+        contextos = [contextos[posicao] for posicao in posicoes]
+
+        try:
+            with medir_formulas(self.codigo, len(contextos)):
+                resultados = avaliar_lote(self.formula, contextos)
+        except FormulaBloqueada as e:
+            if not ignorar_bloqueio:
+                raise FormulaBloqueada(str(e), servicos=[self.codigo]) from e
+            print(f"Erro ao calcular {self.nome}: {e}")
+            return valores
+        erros = set()
+        for posicao, (resultado, tipo_erro, mensagem) in zip(posicoes, resultados):
+            if tipo_erro is None:
+                valores[posicao] = normalizar_resultado(resultado)
+            elif tipo_erro not in ('matematico', 'ResultadoInvalido'):
+                erros.add(f"{tipo_erro}: {mensagem}")
+        for erro in erros:
+            print(f"Erro ao calcular {self.nome}: {erro}")
+        return valores
     
+    def _analisar_formula(self):
+        """(texto, code object, nomes usados), calculado uma vez por instância e texto"""
+        analise = getattr(self, '_formula_compilada', None)
+        if analise is None or analise[0] != self.formula:
+            arvore = ast.parse(self.formula.strip(), mode='eval')
+            nomes = frozenset(
+                no.id for no in ast.walk(arvore) if isinstance(no, ast.Name)
+            )
+            analise = (self.formula, compile(arvore, f"<servico {self.codigo}>", 'eval'), nomes)
+            self._formula_compilada = analise
+        return analise
+
+    def formula_compilada(self):
+        """Code object da fórmula"""
+        return self._analisar_formula()[1]
+
+    def dependencias(self):
+        """Nomes referenciados pela fórmula (dap, biomassa, coeficientes, variáveis...)"""
+        return self._analisar_formula()[2]
+
     def calcular_valor_monetario(self, valor_fisico):
         """Calcula o valor monetário do serviço"""
         return round(valor_fisico * self.valor_monetario_unitario, 2)
 
 
+def versao_configuracao():
+    """Versão da configuração de serviços/variáveis
+
+    Muda sempre que um serviço ou variável é criado, alterado ou excluído.
+    Usada para invalidar valores de serviços calculados e guardados em cache.
+    """
+    from .configuracao import obter_configuracao
+    return str(obter_configuracao().versao)
+
+
+class VersaoConfiguracao(models.Model):
+    """Contador (linha única) incrementado a cada mudança de serviço ou variável
+
+    Cada processo compara este número com o da sua cópia em memória da
+    configuração (main.configuracao) para saber se precisa recarregá-la.
+    """
+
+    versao = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Versão da Configuração'
+        verbose_name_plural = 'Versão da Configuração'
+
+    @classmethod
+    def atual(cls):
+        return cls.objects.filter(id=1).values_list('versao', flat=True).first() or 0
+
+    @classmethod
+    def incrementar(cls):
+        if not cls.objects.filter(id=1).update(versao=models.F('versao') + 1):
+            cls.objects.get_or_create(id=1, defaults={'versao': 1})
+
+
 class EcosystemServiceHistory(models.Model):
     """Histórico de mudanças em configurações de serviços"""
     servico = models.ForeignKey(
@@ -574,4 +979,475 @@ class SpeciesVariableDefault(models.Model):
         verbose_name_plural = 'Valores Padrão por Espécie'
     
     def __str__(self):
-        return f"{self.species.name} - {self.variable.nome}: {self.valor_padrao}"
\ No newline at end of file
+        return f"{self.species.name} - {self.variable.nome}: {self.valor_padrao}"
+
+class TreeServiceValue(models.Model):
+    """Valores de serviços ecossistêmicos materializados por árvore
+
+    Evita recalcular as fórmulas em agregações (mapa de calor, totais).
+    Atualizados pelo comando materializar_servicos e ao salvar a árvore.
+    """
+
+    tree = models.ForeignKey('Tree', on_delete=models.CASCADE, related_name='valores_servicos')
+    servico = models.ForeignKey(EcosystemServiceConfig, on_delete=models.CASCADE, related_name='valores_arvores')
+    valor_fisico = models.FloatField(default=0.0)
+    valor_monetario = models.FloatField(default=0.0)
+
+    class Meta:
+        unique_together = [['tree', 'servico']]
+        verbose_name = 'Valor de Serviço por Árvore'
+        verbose_name_plural = 'Valores de Serviços por Árvore'
+
+    def __str__(self):
+        return f"{self.tree_id} - {self.servico.codigo}: {self.valor_fisico}"
+
+    @classmethod
+    def materializar(cls, trees, servicos=None, resumos=True):
+        """Recalcula e grava os valores dos serviços ativos para as árvores informadas
+
+        Com resumos=False, os totais de ResumoInventario ficam para quem chama
+        (ex.: materializar_servicos, que os reconstrói uma vez no final).
+        Serviços cuja fórmula é bloqueada no sandbox mantêm os valores já
+        gravados; os demais são gravados e FormulaBloqueada é levantada no
+        final, com os códigos dos bloqueados.
+        """
+        from .configuracao import obter_configuracao
+
+        configuracao = obter_configuracao()
+        if servicos is None:
+            servicos = configuracao.servicos
+        registros = []
+        bloqueados = []
+        for servico in servicos:
+            # Avaliação em lote no sandbox (uma tarefa por serviço)
+            try:
+                valores = servico.calcular_lote(trees, configuracao=configuracao)
+            except FormulaBloqueada:
+                bloqueados.append(servico.codigo)
+                continue
+            for tree, valor_fisico in zip(trees, valores):
+                registros.append(cls(
+                    tree=tree,
+                    servico=servico,
+                    valor_fisico=valor_fisico,
+                    valor_monetario=servico.calcular_valor_monetario(valor_fisico),
+                ))
+        with transaction.atomic():
+            antigos = cls.objects.filter(tree__in=[tree.id for tree in trees])
+            if bloqueados:
+                # Valores antigos dos bloqueados ficam; os de serviços inativos saem
+                antigos = antigos.exclude(servico__codigo__in=bloqueados)
+            antigos.delete()
+            cls.objects.bulk_create(registros, batch_size=1000)
+        if resumos:
+            ResumoInventario.recalcular({ResumoInventario.chave(tree) for tree in trees})
+        if bloqueados:
+            raise FormulaBloqueada(
+                f"Fórmula bloqueada no sandbox: {', '.join(bloqueados)}", servicos=bloqueados
+            )
+
+
+class ResumoInventario(models.Model):
+    """Totais pré-agregados por bairro x espécie (nome científico) x origem
+
+    Número de árvores, de comentários e a soma dos valores materializados
+    de cada serviço ("totais": {codigo: [valor_fisico, valor_monetario,
+    árvores materializadas]}). Os painéis de estatísticas somam estas
+    linhas em vez de percorrer as árvores. Cada alteração recalcula só as
+    linhas afetadas (signals e TreeServiceValue.materializar); o comando
+    recalcular_resumos reconstrói tudo após operações em lote. A tabela
+    vazia é construída na primeira leitura. Linhas com árvores ainda sem
+    valor materializado (ex.: inventário anterior à materialização) têm a
+    diferença calculada árvore a árvore na leitura.
+    """
+
+    # Dimensões (na ordem da chave) e filtros aceitos em somar()
+    DIMENSOES = ('bairro', 'nome_cientifico', 'origem')
+
+    bairro = models.CharField(max_length=100, blank=True)
+    nome_cientifico = models.CharField(max_length=255)
+    origem = models.CharField(max_length=20)
+    arvores = models.IntegerField(default=0)
+    comentarios = models.IntegerField(default=0)
+    totais = models.JSONField(default=dict)
+
+    class Meta:
+        verbose_name = 'Resumo do Inventário'
+        verbose_name_plural = 'Resumos do Inventário'
+        constraints = [
+            models.UniqueConstraint(fields=['bairro', 'nome_cientifico', 'origem'], name='resumo_unico'),
+        ]
+
+    def __str__(self):
+        return f"{self.bairro or '?'} / {self.nome_cientifico} / {self.origem}: {self.arvores}"
+
+    @staticmethod
+    def chave(tree):
+        return (tree.bairro, tree.nome_cientifico, tree.origem)
+
+    @classmethod
+    def _filtro(cls, chaves, prefixo=''):
+        filtro = models.Q(pk__in=[])
+        for chave in chaves:
+            filtro |= models.Q(**{prefixo + campo: valor for campo, valor in zip(cls.DIMENSOES, chave)})
+        return filtro
+
+    @classmethod
+    def _agregar(cls, chaves=None):
+        """{chave: ResumoInventario} calculados de Tree, Post e TreeServiceValue"""
+        arvores, comentarios, valores = Tree.objects.all(), Post.objects.all(), TreeServiceValue.objects.all()
+        if chaves is not None:
+            arvores = arvores.filter(cls._filtro(chaves))
+            comentarios = comentarios.filter(cls._filtro(chaves, 'tree__'))
+            valores = valores.filter(cls._filtro(chaves, 'tree__'))
+        dimensoes_arvore = [f'tree__{campo}' for campo in cls.DIMENSOES]
+
+        resumos = {}
+        # order_by() vazio: a ordenação padrão entraria no GROUP BY
+        for *chave, quantidade in arvores.order_by().values_list(*cls.DIMENSOES).annotate(models.Count('id')):
+            resumos[tuple(chave)] = cls(**dict(zip(cls.DIMENSOES, chave)), arvores=quantidade, totais={})
+        for *chave, quantidade in comentarios.order_by().values_list(*dimensoes_arvore).annotate(
+            models.Count('id')
+        ):
+            resumos[tuple(chave)].comentarios = quantidade
+        for *chave, codigo, fisico, monetario, quantidade in valores.values_list(
+            *dimensoes_arvore, 'servico__codigo'
+        ).order_by().annotate(models.Sum('valor_fisico'), models.Sum('valor_monetario'), models.Count('id')):
+            resumos[tuple(chave)].totais[codigo] = [fisico or 0.0, monetario or 0.0, quantidade]
+        return resumos
+
+    @classmethod
+    def _nao_materializados(cls, incompletas, configuracao):
+        """{chave: {codigo: [fisico, monetario]}} das árvores sem valor materializado
+
+        Calculados árvore a árvore (calcular_lote) só para os serviços
+        incompletos de cada linha; serviços bloqueados no sandbox ficam de fora.
+        """
+        faltando = defaultdict(lambda: defaultdict(lambda: [0.0, 0.0]))
+        for codigo, chaves in incompletas.items():
+            servico = configuracao.servicos_por_codigo[codigo]
+            arvores = []
+            for inicio in range(0, len(chaves), 100):
+                arvores += Tree.objects.filter(cls._filtro(chaves[inicio:inicio + 100])).exclude(
+                    valores_servicos__servico=servico
+                ).select_related('species')
+            try:
+                valores = servico.calcular_lote(arvores, configuracao=configuracao)
+            except FormulaBloqueada as e:
+                print(f"Erro ao calcular {servico.nome}: {e}")
+                continue
+            for tree, valor_fisico in zip(arvores, valores):
+                soma = faltando[cls.chave(tree)][codigo]
+                soma[0] += valor_fisico
+                soma[1] += servico.calcular_valor_monetario(valor_fisico)
+        return faltando
+
+    @classmethod
+    def recalcular(cls, chaves=None):
+        """Recalcula as linhas das chaves informadas (ou reconstrói a tabela)"""
+        if chaves is None:
+            resumos = cls._agregar()
+            with transaction.atomic():
+                cls.objects.all().delete()
+                cls.objects.bulk_create(resumos.values(), batch_size=1000)
+            return
+        chaves = list(chaves)
+        for inicio in range(0, len(chaves), 100):
+            parte = chaves[inicio:inicio + 100]
+            resumos = cls._agregar(parte)
+            with transaction.atomic():
+                ausentes = [chave for chave in parte if chave not in resumos]
+                if ausentes:
+                    cls.objects.filter(cls._filtro(ausentes)).delete()
+                cls.objects.bulk_create(
+                    resumos.values(),
+                    update_conflicts=True,
+                    unique_fields=list(cls.DIMENSOES),
+                    update_fields=['arvores', 'comentarios', 'totais'],
+                )
+
+    @classmethod
+    def somar(cls, filtros=None, agrupar=None):
+        """Totais das linhas filtradas (dimensão: valor) e, opcionalmente, por grupo
+
+        Retorna {arvores, especies, comentarios, servicos: {codigo:
+        {valor_fisico, valor_monetario}}}, com "grupos" se agrupar for uma
+        das DIMENSOES. Só entram os serviços ativos.
+        """
+        from .configuracao import obter_configuracao
+
+        configuracao = obter_configuracao()
+        codigos = [servico.codigo for servico in configuracao.servicos]
+        # Tabela ainda vazia (recém-criada): construída na primeira leitura
+        if not cls.objects.exists() and Tree.objects.exists():
+            cls.recalcular()
+
+        def novo():
+            return {'arvores': 0, 'especies': set(), 'comentarios': 0,
+                    'servicos': {codigo: [0.0, 0.0] for codigo in codigos}}
+
+        linhas = list(cls.objects.filter(**(filtros or {})).values(*cls.DIMENSOES, 'arvores', 'comentarios', 'totais'))
+        # Serviço -> linhas com árvores ainda sem valor materializado
+        incompletas = defaultdict(list)
+        for linha in linhas:
+            for codigo in codigos:
+                totais = linha['totais'].get(codigo) or []
+                materializadas = totais[2] if len(totais) > 2 else 0
+                if materializadas < linha['arvores']:
+                    incompletas[codigo].append(tuple(linha[campo] for campo in cls.DIMENSOES))
+        faltando = cls._nao_materializados(incompletas, configuracao) if incompletas else {}
+
+        geral, grupos = novo(), {}
+        for linha in linhas:
+            chave = tuple(linha[campo] for campo in cls.DIMENSOES)
+            for codigo, (fisico, monetario) in faltando.get(chave, {}).items():
+                total = linha['totais'].get(codigo) or [0.0, 0.0]
+                linha['totais'][codigo] = [total[0] + fisico, total[1] + monetario]
+            destinos = [geral]
+            if agrupar:
+                destinos.append(grupos.setdefault(linha[agrupar], novo()))
+            for destino in destinos:
+                destino['arvores'] += linha['arvores']
+                destino['comentarios'] += linha['comentarios']
+                if linha['nome_cientifico'] and linha['arvores']:
+                    destino['especies'].add(linha['nome_cientifico'])
+                for codigo, (fisico, monetario, *_) in linha['totais'].items():
+                    if codigo in destino['servicos']:
+                        destino['servicos'][codigo][0] += fisico
+                        destino['servicos'][codigo][1] += monetario
+
+        def formatar(total):
+            return {
+                'arvores': total['arvores'],
+                'especies': len(total['especies']),
+                'comentarios': total['comentarios'],
+                'servicos': {
+                    codigo: {'valor_fisico': round(fisico, 4), 'valor_monetario': round(monetario, 2)}
+                    for codigo, (fisico, monetario) in total['servicos'].items()
+                },
+            }
+
+        resultado = formatar(geral)
+        if agrupar:
+            resultado['grupos'] = {grupo: formatar(total) for grupo, total in sorted(grupos.items())}
+        return resultado
+
+
+class HeatmapCell(models.Model):
+    """Célula da grade multirresolução do mapa de calor
+
+    Cada nível corresponde a uma grade Web Mercator de 2^nivel x 2^nivel
+    células. "totais" guarda, por medida ('arvores' ou código do serviço),
+    a soma dos valores das árvores dentro da célula.
+    """
+
+    nivel = models.PositiveSmallIntegerField()
+    cx = models.IntegerField()
+    cy = models.IntegerField()
+    totais = models.JSONField(default=dict)
+
+    class Meta:
+        unique_together = [['nivel', 'cx', 'cy']]
+        verbose_name = 'Célula do Mapa de Calor'
+        verbose_name_plural = 'Células do Mapa de Calor'
+
+
+class HeatmapNivel(models.Model):
+    """Valor máximo de cada medida por nível (normalização das cores)"""
+
+    nivel = models.PositiveSmallIntegerField(unique=True)
+    maximos = models.JSONField(default=dict)
+
+    class Meta:
+        verbose_name = 'Nível do Mapa de Calor'
+        verbose_name_plural = 'Níveis do Mapa de Calor'
+
+
+class ContadorPainel(models.Model):
+    """Contadores exibidos nos dashboards, mantidos pelos signals
+
+    A chave tem o formato "<nome>" ou "<nome>:<argumento>", por exemplo
+    "notificacoes:PENDENTE" ou "laudos_autor:12". Um contador ausente é
+    calculado (COUNT) na primeira leitura; divergências causadas por
+    operações em lote são corrigidas pelo comando reconciliar_contadores.
+    """
+
+    chave = models.CharField(max_length=100, unique=True)
+    valor = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Contador do Painel'
+        verbose_name_plural = 'Contadores do Painel'
+
+    def __str__(self):
+        return f"{self.chave} = {self.valor}"
+
+    @staticmethod
+    def consulta(chave):
+        """Queryset cuja contagem é o valor correto do contador"""
+        nome, _, argumento = chave.partition(':')
+        if nome == 'arvores':
+            return Tree.objects.all()
+        if nome == 'tecnicos_pendentes':
+            return CustomUser.objects.filter(
+                user_type=CustomUser.UserType.TECNICO,
+                aprovacao_status=CustomUser.ApprovalStatus.PENDENTE,
+            )
+        if nome == 'laudos':
+            return Laudo.objects.filter(status=argumento)
+        if nome == 'laudos_autor':
+            return Laudo.objects.filter(autor_id=argumento)
+        if nome == 'notificacoes':
+            return Notificacao.objects.filter(status=argumento)
+        if nome == 'analises_tecnico':
+            return Notificacao.objects.filter(tecnico_responsavel_id=argumento)
+        raise ValueError(f'Contador desconhecido: {chave}')
+
+    @classmethod
+    def ler(cls, chaves):
+        """Lê vários contadores com uma única consulta: {chave: valor}"""
+        valores = dict(cls.objects.filter(chave__in=chaves).values_list('chave', 'valor'))
+        faltando = [chave for chave in chaves if chave not in valores]
+        if faltando:
+            valores.update(cls.recalcular(faltando))
+        return valores
+
+    @classmethod
+    def ajustar(cls, deltas):
+        """Soma os deltas ({chave: +n/-n}) aos contadores existentes"""
+        with transaction.atomic():
+            for chave, delta in deltas.items():
+                if delta and not cls.objects.filter(chave=chave).update(valor=models.F('valor') + delta):
+                    # Ainda não existe: a contagem já inclui a alteração atual
+                    cls.recalcular([chave])
+
+    @classmethod
+    def recalcular(cls, chaves=None):
+        """Recalcula os contadores pedidos (ou todos os existentes) com COUNT
+
+        Duas requisições podem criar o mesmo contador ao mesmo tempo: quem
+        perde a corrida (IntegrityError na chave única) grava por update.
+        """
+        if chaves is None:
+            chaves = list(cls.objects.values_list('chave', flat=True))
+        valores = {}
+        with transaction.atomic():
+            for chave in chaves:
+                valores[chave] = cls.consulta(chave).count()
+                if cls.objects.filter(chave=chave).update(valor=valores[chave]):
+                    continue
+                try:
+                    # Savepoint: o erro não invalida a transação externa
+                    with transaction.atomic():
+                        cls.objects.create(chave=chave, valor=valores[chave])
+                except IntegrityError:
+                    cls.objects.filter(chave=chave).update(valor=valores[chave])
+        return valores
+
+
+class ArquivoConteudo(models.Model):
+    """Arquivo do armazenamento endereçado por conteúdo (main.storage)
+
+    "referencias" conta quantos campos (Laudo.arquivo,
+    CustomUser.documento_comprobatorio) apontam para o arquivo.
+    """
+
+    # Campos de arquivo que usam o armazenamento deduplicado
+    CAMPOS = [
+        ('main.Laudo', 'arquivo'),
+        ('main.CustomUser', 'documento_comprobatorio'),
+    ]
+
+    nome = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    tamanho = models.BigIntegerField()
+    referencias = models.IntegerField(default=0)
+    # Último upload com este conteúdo (protege reenvios recentes da coleta)
+    enviado_em = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Arquivo Armazenado'
+        verbose_name_plural = 'Arquivos Armazenados'
+
+    def __str__(self):
+        return f"{self.nome} ({self.referencias} referência(s))"
+
+    @classmethod
+    def ajustar(cls, nome, delta):
+        if nome:
+            cls.objects.filter(nome=nome).update(referencias=models.F('referencias') + delta)
+
+    @classmethod
+    def contar_referencias(cls):
+        """Número real de referências de cada nome de arquivo: {nome: n}"""
+        from django.apps import apps
+
+        contagem = {}
+        for modelo, campo in cls.CAMPOS:
+            for nome in apps.get_model(modelo).objects.exclude(
+                **{campo: ''}
+            ).exclude(**{f'{campo}__isnull': True}).values_list(campo, flat=True).iterator():
+                contagem[nome] = contagem.get(nome, 0) + 1
+        return contagem
+
+
+class CenarioSimulacao(models.Model):
+    """Cenário "e se" de plantio, remoção ou coeficientes (main/cenarios.py)
+
+    "chave" é o hash da definição normalizada: cenários iguais têm a mesma
+    chave, e o resultado fica no cache enquanto inventário e configuração
+    não mudarem.
+    """
+
+    chave = models.CharField(max_length=40, unique=True)
+    nome = models.CharField(max_length=200, blank=True)
+    definicao = models.JSONField()
+    criado_por = models.ForeignKey(CustomUser, null=True, blank=True, on_delete=models.SET_NULL)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-criado_em']
+        verbose_name = 'Cenário de Simulação'
+        verbose_name_plural = 'Cenários de Simulação'
+
+    def __str__(self):
+        return self.nome or self.chave[:12]
+
+
+class SnapshotInventario(models.Model):
+    """Catálogo dos snapshots do inventário (arquivos colunares, main/snapshots.py)
+
+    "totais" guarda a soma de cada serviço no momento do snapshot
+    ({codigo: [valor_fisico, valor_monetario]}) e "servicos", o nome e a
+    unidade de cada código.
+    """
+
+    criado_em = models.DateTimeField(auto_now_add=True, db_index=True)
+    descricao = models.CharField(max_length=200, blank=True)
+    arquivo = models.FileField(upload_to='snapshots/')
+    arvores = models.IntegerField()
+    versao_inventario = models.BigIntegerField()
+    versao_configuracao = models.BigIntegerField()
+    tamanho = models.BigIntegerField(help_text='Tamanho do arquivo em bytes')
+    totais = models.JSONField(default=dict)
+    servicos = models.JSONField(default=list)
+
+    class Meta:
+        ordering = ['-criado_em']
+        verbose_name = 'Snapshot do Inventário'
+        verbose_name_plural = 'Snapshots do Inventário'
+
+    def __str__(self):
+        return f"{self.criado_em:%d/%m/%Y %H:%M} - {self.arvores} árvores"
+
+    def resumo(self):
+        """Dados do catálogo (JSON)"""
+        return {
+            'id': self.id,
+            'criado_em': self.criado_em.isoformat(),
+            'descricao': self.descricao,
+            'arvores': self.arvores,
+            'tamanho': self.tamanho,
+            'totais': self.totais,
+            'servicos': self.servicos,
+        }
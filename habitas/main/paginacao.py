@@ -0,0 +1,36 @@
+"""
+Paginação por chave (keyset) em ordem decrescente de (data, id).
+
+O cursor é a chave do último item exibido, no formato "<data iso>|<id>".
+A próxima página é buscada com "(data, id) < cursor", que o banco resolve
+direto por um índice (…, data, id), sem OFFSET.
+"""
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def codificar_cursor(data, pk):
+    return f"{data.isoformat()}|{pk}"
+
+
+def decodificar_cursor(cursor):
+    """Retorna (data, id) ou None se o cursor for inválido"""
+    try:
+        data, pk = cursor.rsplit("|", 1)
+        data, pk = parse_datetime(data), int(pk)
+    except (AttributeError, ValueError):
+        return None
+    if data is None:
+        return None
+    return data, pk
+
+
+def antes_do_cursor(campo, data, pk):
+    """Itens posteriores ao cursor na ordem decrescente (data, id)"""
+    return Q(**{f"{campo}__lt": data}) | Q(**{campo: data, "id__lt": pk})
+
+
+def ate_o_cursor(campo, data, pk):
+    """Itens do início da lista até o cursor (inclusive)"""
+    return Q(**{f"{campo}__gt": data}) | Q(**{campo: data, "id__gte": pk})
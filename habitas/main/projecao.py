@@ -0,0 +1,299 @@
+"""
+Projeção dos serviços ecossistêmicos ao longo dos anos.
+
+DAP e altura de cada árvore avançam ano a ano pelos parâmetros da espécie
+(CrescimentoEspecie, ou PROJECAO_CRESCIMENTO_PADRAO), e todos os serviços
+ativos são recalculados para cada ano projetado.
+
+Para caber em poucos segundos na cidade inteira, as árvores são agrupadas
+em coortes com os mesmos dados de entrada (espécie, faixas de DAP e de
+altura, PROJECAO_FAIXA_DAP e PROJECAO_FAIXA_ALTURA, e valores das
+variáveis usadas nas fórmulas), cada uma com o número de árvores de cada
+grupo. Cada ano avalia, por serviço, um único lote no sandbox com os
+estados distintos das coortes, com os contextos das fórmulas montados
+direto das colunas (sem instâncias de Tree), e multiplica o resultado
+pelo número de árvores de cada grupo.
+
+Pela API, uma projeção fora do cache é calculada em segundo plano
+(PROJECAO_ASSINCRONA): a requisição não espera o cálculo.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from . import metricas
+from .configuracao import obter_configuracao
+from .models import (
+    CrescimentoEspecie, Species, SpeciesVariableDefault, Tree, TreeChange, TreeVariableValue,
+    area_copa_estimada, biomassa_estimada, versao_configuracao,
+)
+from .sandbox import FormulaBloqueada, arvore_portavel
+
+logger = logging.getLogger(__name__)
+
+AGRUPAMENTOS = ('bairro', 'especie')
+
+# Campo do grupo: espécie pelo nome científico, como em ResumoInventario
+CAMPOS_GRUPO = {'bairro': 'bairro', 'especie': 'nome_cientifico'}
+
+_executor = None
+
+CRESCIMENTO_PADRAO = {
+    'incremento_dap': 0.8,
+    'dap_maximo': 100.0,
+    'altura_maxima': 18.0,
+    'taxa_altura': 0.05,
+}
+
+
+def _parametros():
+    padrao = SimpleNamespace(**{
+        **CRESCIMENTO_PADRAO, **getattr(settings, 'PROJECAO_CRESCIMENTO_PADRAO', {})
+    })
+    return padrao, {crescimento.species_id: crescimento for crescimento in CrescimentoEspecie.objects.all()}
+
+
+def crescer(dap, altura, parametros, anos):
+    """(dap, altura) após "anos" anos de crescimento"""
+    dap_projetado = min(dap + parametros.incremento_dap * anos, max(parametros.dap_maximo, dap))
+    if altura < parametros.altura_maxima:
+        altura = parametros.altura_maxima - (parametros.altura_maxima - altura) * math.exp(
+            -parametros.taxa_altura * anos
+        )
+    return dap_projetado, altura
+
+
+def resolvedor_variaveis(variaveis, tree_ids=None):
+    """Função (tree_id, species_id) -> tupla JSON dos valores resolvidos
+
+    Mesma ordem de busca de Tree.get_variable_value, com duas consultas.
+    Com tree_ids, só lê os valores próprios dessas árvores.
+    """
+    if not variaveis:
+        return lambda tree_id, species_id: ()
+    valores = TreeVariableValue.objects.filter(variable__in=variaveis)
+    if tree_ids is not None:
+        valores = valores.filter(tree_id__in=tree_ids)
+    por_arvore = {
+        (tree_id, variable_id): valor
+        for tree_id, variable_id, valor in valores.values_list('tree_id', 'variable_id', 'valor')
+    }
+    por_especie = {
+        (species_id, variable_id): valor
+        for species_id, variable_id, valor in SpeciesVariableDefault.objects.filter(
+            variable__in=variaveis
+        ).values_list('species_id', 'variable_id', 'valor_padrao')
+    }
+
+    def resolver(tree_id, species_id):
+        valores = []
+        for variavel in variaveis:
+            valor = por_arvore.get((tree_id, variavel.id))
+            if valor is None and species_id is not None:
+                valor = por_especie.get((species_id, variavel.id))
+            if valor is None:
+                valor = variavel.valor_padrao_geral or None
+            valores.append(json.dumps(valor, sort_keys=True))
+        return tuple(valores)
+
+    return resolver
+
+
+def _faixa(valor, largura):
+    """Centro da faixa de "largura" que contém o valor"""
+    if not largura:
+        return valor
+    return round(round(valor / largura) * largura, 4)
+
+
+def avaliar_estados(servico, estados, variaveis):
+    """Valores do serviço para estados (species_id, dap, altura, valores das variáveis)
+
+    Os contextos são montados direto dos valores (sem instâncias de Tree) e
+    avaliados em um único lote no sandbox. "valores" na ordem de variaveis,
+    em JSON (ver resolvedor_variaveis).
+    """
+    dependencias = servico.dependencias()
+    usa_arvore = 'tree' in dependencias
+    usa_medidas = 'biomassa' in dependencias or 'area_copa' in dependencias
+    if usa_arvore:
+        # "tree" portável: campos de uma Tree nova, com dap, altura e espécie do estado
+        base = vars(arvore_portavel(Tree()))
+        especies = {
+            species_id: arvore_portavel(Tree(species=especie)).species
+            for species_id, especie in Species.objects.in_bulk(
+                {estado[0] for estado in estados if estado[0] is not None}
+            ).items()
+        }
+    decodificados = {}
+    contextos = []
+    for species_id, dap, altura, valores in estados:
+        if dap <= 0 or altura <= 0:
+            contextos.append(None)
+            continue
+        if valores not in decodificados:
+            decodificados[valores] = {
+                variavel.codigo: json.loads(valor) for variavel, valor in zip(variaveis, valores)
+            }
+        try:
+            biomassa = biomassa_estimada(dap, altura) if usa_medidas else 0.0
+            area_copa = area_copa_estimada(dap) if usa_medidas else 0.0
+        except (ValueError, ZeroDivisionError, OverflowError):
+            contextos.append(None)
+            continue
+        contexto = servico.contexto_medidas(dap, altura, biomassa, area_copa, decodificados[valores], variaveis)
+        if usa_arvore:
+            contexto['tree'] = SimpleNamespace(**{
+                **base, 'dap': dap, 'altura': altura,
+                'species_id': species_id, 'species': especies.get(species_id),
+            })
+        contextos.append(contexto)
+    return servico.calcular_contextos(contextos)
+
+
+def projetar(anos, agrupar='bairro', filtros=None, passo=1):
+    """Séries anuais dos totais de cada serviço, por grupo e para o conjunto"""
+    inicio = time.monotonic()
+    configuracao = obter_configuracao()
+    servicos = configuracao.servicos
+    dependencias = set().union(*(servico.dependencias() for servico in servicos)) if servicos else set()
+    variaveis = [variavel for variavel in configuracao.variaveis if variavel.codigo in dependencias]
+    resolver = resolvedor_variaveis(variaveis)
+    padrao, parametros = _parametros()
+    faixa_dap = getattr(settings, 'PROJECAO_FAIXA_DAP', 1.0)
+    faixa_altura = getattr(settings, 'PROJECAO_FAIXA_ALTURA', 0.5)
+
+    # Coorte (espécie, DAP, altura, variáveis) -> árvores por grupo
+    coortes = defaultdict(Counter)
+    arvores = sem_medidas = 0
+    for tree_id, dap, altura, species_id, grupo in Tree.objects.filter(**(filtros or {})).values_list(
+        'id', 'dap', 'altura', 'species_id', CAMPOS_GRUPO[agrupar]
+    ).iterator(chunk_size=5000):
+        if not dap or not altura or dap <= 0 or altura <= 0:
+            sem_medidas += 1
+            continue
+        chave = (
+            species_id, _faixa(float(dap), faixa_dap), _faixa(float(altura), faixa_altura),
+            resolver(tree_id, species_id),
+        )
+        coortes[chave][grupo or ''] += 1
+        arvores += 1
+
+    anos_projetados = list(range(0, anos + 1, passo))
+    if anos_projetados[-1] != anos:
+        anos_projetados.append(anos)
+
+    grupos = defaultdict(lambda: {servico.codigo: [0.0] * len(anos_projetados) for servico in servicos})
+    total = {servico.codigo: [0.0] * len(anos_projetados) for servico in servicos}
+    estados_avaliados = 0
+    for indice, ano in enumerate(anos_projetados):
+        # Estados distintos neste ano -> [árvores por grupo de cada coorte]
+        estados = defaultdict(list)
+        for (species_id, dap, altura, valores), por_grupo in coortes.items():
+            dap_ano, altura_ano = crescer(dap, altura, parametros.get(species_id, padrao), ano)
+            estados[(species_id, round(dap_ano, 1), round(altura_ano, 2), valores)].append(por_grupo)
+        estados_avaliados += len(estados)
+
+        for servico in servicos:
+            for destinos, valor in zip(estados.values(), avaliar_estados(servico, list(estados), variaveis)):
+                if not valor:
+                    continue
+                for por_grupo in destinos:
+                    for grupo, quantidade in por_grupo.items():
+                        grupos[grupo][servico.codigo][indice] += valor * quantidade
+                        total[servico.codigo][indice] += valor * quantidade
+
+    def arredondar(series):
+        return {codigo: [round(valor, 4) for valor in valores] for codigo, valores in series.items()}
+
+    return {
+        'anos': anos_projetados,
+        'agrupamento': agrupar,
+        'servicos': [
+            {
+                'codigo': servico.codigo,
+                'nome': servico.nome,
+                'unidade': servico.unidade_medida,
+                'valor_monetario_unitario': servico.valor_monetario_unitario,
+            }
+            for servico in servicos
+        ],
+        'total': arredondar(total),
+        'grupos': {grupo: arredondar(series) for grupo, series in sorted(grupos.items())},
+        'arvores': arvores,
+        'sem_medidas': sem_medidas,
+        'coortes': len(coortes),
+        'estados_avaliados': estados_avaliados,
+        'tempo_ms': round((time.monotonic() - inicio) * 1000),
+    }
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='projecao')
+    return _executor
+
+
+def _projetar_em_segundo_plano(chave, segundos, anos, agrupar, filtros, passo):
+    try:
+        cache.set(chave, projetar(anos, agrupar, filtros, passo), segundos)
+    except FormulaBloqueada as e:
+        # Quem consultar em seguida recebe o bloqueio (nada de zeros no cache)
+        cache.set(f'{chave}:bloqueio', (str(e), e.servicos), 60)
+    except Exception:
+        logger.exception('Erro ao calcular a projeção %s', chave)
+    finally:
+        cache.delete(f'{chave}:calculando')
+        # A thread do pool abre a própria conexão; não deixa conexões penduradas
+        connection.close()
+
+
+def projetar_em_cache(anos, agrupar='bairro', filtros=None, passo=1):
+    """projetar() guardado no cache do Django
+
+    A chave inclui as versões da configuração e do inventário; mudanças só
+    nos parâmetros de crescimento ou nos valores das variáveis aparecem
+    após PROJECAO_CACHE_SEGUNDOS. Com PROJECAO_ASSINCRONA, uma projeção
+    fora do cache é calculada em segundo plano e a função devolve None
+    (a API responde 202 e o cliente repete a consulta). Levanta
+    FormulaBloqueada se o último cálculo foi bloqueado no sandbox.
+    """
+    segundos = getattr(settings, 'PROJECAO_CACHE_SEGUNDOS', 300)
+    if not segundos:
+        return projetar(anos, agrupar, filtros, passo)
+    parametros = json.dumps(
+        [anos, agrupar, sorted((filtros or {}).items()), passo], default=str
+    )
+    chave = 'projecao:{}:{}:{}'.format(
+        versao_configuracao(),
+        TreeChange.versao_atual(),
+        hashlib.sha1(parametros.encode()).hexdigest(),
+    )
+    resultado = cache.get(chave)
+    metricas.cache('projecao', resultado is not None)
+    if resultado is not None:
+        return resultado
+    if not getattr(settings, 'PROJECAO_ASSINCRONA', True):
+        resultado = projetar(anos, agrupar, filtros, passo)
+        cache.set(chave, resultado, segundos)
+        return resultado
+
+    bloqueio = cache.get(f'{chave}:bloqueio')
+    if bloqueio is not None:
+        cache.delete(f'{chave}:bloqueio')
+        raise FormulaBloqueada(bloqueio[0], servicos=bloqueio[1])
+    # Um cálculo por chave; o marcador expira se o processo cair no meio
+    if cache.add(f'{chave}:calculando', True, getattr(settings, 'PROJECAO_TEMPO_MAXIMO', 600)):
+        _pool().submit(_projetar_em_segundo_plano, chave, segundos, anos, agrupar, filtros, passo)
+    return None
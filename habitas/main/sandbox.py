@@ -0,0 +1,251 @@
+"""
+Avaliação isolada das fórmulas dos serviços ecossistêmicos.
+
+As fórmulas são escritas por gestores e avaliadas com eval. Uma expressão
+como 10**10**8 ou [0] * 10**10 travaria (ou derrubaria) o processo web.
+Por isso a validação e o recálculo em lote rodam em um pool de processos
+(iniciados a partir de um forkserver, sem o estado do Django) com limites:
+
+- tempo de CPU por tarefa (RLIMIT_CPU): o kernel encerra o worker que
+  passar do limite, mesmo no meio de uma operação em C;
+- memória (RLIMIT_AS): alocações acima do limite viram MemoryError;
+- tempo de espera no processo web, contado a partir do momento em que um
+  worker pega a tarefa (não inclui a fila): se o resultado não chegar, só
+  o worker daquela tarefa é encerrado (o pool o substitui) e as tarefas de
+  outras requisições seguem normalmente.
+
+Este módulo não importa o Django no nível do módulo, pois é carregado
+pelos workers.
+"""
+
+import atexit
+import enum
+import itertools
+import math
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from types import SimpleNamespace
+
+try:
+    import resource
+except ImportError:  # Windows: sem limites por processo
+    resource = None
+
+_pool = None
+_trava = threading.Lock()
+
+# Avisos de início de tarefa (worker -> processo web): (tarefa, pid)
+_fila_inicio = None
+# tarefa -> SimpleNamespace(evento, pid) das chamadas aguardando o início
+_aguardando = {}
+_trava_aguardando = threading.Lock()
+_contador = itertools.count()
+
+# Erros "matemáticos": o valor vira 0 sem registrar erro (como em calcular)
+ERROS_MATEMATICOS = (ValueError, ZeroDivisionError, OverflowError)
+
+
+class FormulaBloqueada(Exception):
+    """A fórmula excedeu o tempo ou a memória permitidos
+
+    "servicos": códigos dos serviços bloqueados, quando conhecidos.
+    """
+
+    def __init__(self, mensagem='', servicos=()):
+        super().__init__(mensagem)
+        self.servicos = list(servicos)
+
+
+def normalizar_resultado(resultado):
+    """Valor final de uma fórmula: float arredondado, 0 se não for número finito"""
+    if not isinstance(resultado, (int, float)) or math.isnan(resultado) or math.isinf(resultado):
+        return 0.0
+    return round(float(resultado), 4)
+
+
+def _campos_portaveis(objeto):
+    dados = {}
+    for campo in objeto._meta.concrete_fields:
+        valor = getattr(objeto, campo.attname)
+        # Choices do Django viram o valor simples (o worker não importa os models)
+        dados[campo.attname] = valor.value if isinstance(valor, enum.Enum) else valor
+    return dados
+
+
+def arvore_portavel(tree):
+    """Cópia "picklable" dos dados da árvore acessíveis como `tree` na fórmula"""
+    especie = tree.species if tree.species_id else None
+    return SimpleNamespace(
+        **_campos_portaveis(tree),
+        species=SimpleNamespace(**_campos_portaveis(especie)) if especie is not None else None,
+    )
+
+
+# ============ WORKER ============
+
+def _inicializar_worker(memoria_bytes, fila_inicio=None):
+    global _fila_inicio
+    _fila_inicio = fila_inicio
+    if resource is not None and memoria_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (memoria_bytes, memoria_bytes))
+
+
+def _avaliar_lote(formula, contextos, tempo_cpu, tarefa=None):
+    """Executado no worker: [(valor, tipo_erro, mensagem)] para cada contexto"""
+    if tarefa is not None and _fila_inicio is not None:
+        # O processo web começa a contar o tempo daqui e sabe qual worker encerrar
+        # (SimpleQueue: escrita síncrona, antes de a fórmula segurar o GIL)
+        _fila_inicio.put((tarefa, os.getpid()))
+    if resource is not None and tempo_cpu:
+        # RLIMIT_CPU é acumulado: o limite é o uso atual + o tempo da tarefa
+        uso = resource.getrusage(resource.RUSAGE_SELF)
+        limite = int(uso.ru_utime + uso.ru_stime + tempo_cpu) + 1
+        _, maximo = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (limite, maximo))
+
+    try:
+        codigo = compile(formula.strip(), '<formula>', 'eval')
+    except SyntaxError as e:
+        return [(None, 'SyntaxError', str(e))] * len(contextos)
+
+    resultados = []
+    for contexto in contextos:
+        contexto.update(math=math, hasattr=hasattr, getattr=getattr)
+        try:
+            resultado = eval(codigo, {'__builtins__': {}}, contexto)
+            # Só números voltam ao processo web (nada de listas enormes no pickle)
+            if not isinstance(resultado, (int, float)):
+                resultados.append((None, 'ResultadoInvalido', 'A fórmula não retornou um número'))
+            else:
+                resultados.append((float(resultado), None, ''))
+        except ERROS_MATEMATICOS as e:
+            resultados.append((None, 'matematico', str(e)))
+        except MemoryError:
+            resultados.append((None, 'MemoryError', 'A fórmula excedeu o limite de memória'))
+        except Exception as e:
+            resultados.append((None, type(e).__name__, str(e)))
+    return resultados
+
+
+def _aquecer(_indice):
+    return os.getpid()
+
+
+# ============ PROCESSO WEB ============
+
+def _configuracao():
+    from django.conf import settings
+
+    return (
+        getattr(settings, 'FORMULAS_SANDBOX_WORKERS', 2),
+        getattr(settings, 'FORMULAS_SANDBOX_TEMPO_CPU', 2),
+        getattr(settings, 'FORMULAS_SANDBOX_MEMORIA_MB', 512) * 1024 * 1024,
+    )
+
+
+def _receber_inicios(fila):
+    """Thread do processo web: repassa os avisos de início às chamadas em espera"""
+    while True:
+        try:
+            tarefa, pid = fila.get()
+        except (EOFError, OSError):
+            return
+        if tarefa is None:
+            return
+        with _trava_aguardando:
+            espera = _aguardando.get(tarefa)
+        if espera is not None:
+            espera.pid = pid
+            espera.evento.set()
+
+
+def _obter_pool():
+    global _pool, _fila_inicio
+    with _trava:
+        if _pool is None:
+            workers, _, memoria = _configuracao()
+            contexto = multiprocessing.get_context(
+                'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            )
+            _fila_inicio = contexto.SimpleQueue()
+            threading.Thread(
+                target=_receber_inicios, args=(_fila_inicio,), name='sandbox-inicios', daemon=True
+            ).start()
+            _pool = contexto.Pool(
+                workers, initializer=_inicializar_worker, initargs=(memoria, _fila_inicio)
+            )
+            # Sobe os workers já na criação (a primeira fórmula não espera o forkserver)
+            _pool.map(_aquecer, range(workers))
+        return _pool
+
+
+def descartar_pool():
+    """Encerra os workers (fim do processo)"""
+    global _pool, _fila_inicio
+    with _trava:
+        if _pool is not None:
+            _pool.terminate()
+            _pool = None
+        if _fila_inicio is not None:
+            _fila_inicio.put((None, None))
+            _fila_inicio = None
+
+
+def _encerrar_worker(pid):
+    """Mata um worker travado; o pool sobe outro no lugar"""
+    try:
+        os.kill(pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+    except (ProcessLookupError, PermissionError):
+        # Já encerrado (ex.: pelo RLIMIT_CPU)
+        pass
+
+
+atexit.register(descartar_pool)
+
+
+def avaliar_lote(formula, contextos):
+    """Avalia a fórmula para cada contexto (dict de variáveis) em um worker
+
+    Retorna [(valor, tipo_erro, mensagem)]; levanta FormulaBloqueada se o
+    worker não responder dentro do tempo (CPU esgotada ou travamento) ou se
+    nenhum worker pegar a tarefa em FORMULAS_SANDBOX_ESPERA_FILA segundos.
+    """
+    from django.conf import settings
+
+    if not contextos:
+        return []
+    if not getattr(settings, 'FORMULAS_SANDBOX', True):
+        # Sem isolamento (ambientes sem multiprocessing)
+        return _avaliar_lote(formula, contextos, None)
+    _, tempo_cpu, _ = _configuracao()
+    pool = _obter_pool()
+    numero = next(_contador)
+    espera = SimpleNamespace(evento=threading.Event(), pid=None)
+    with _trava_aguardando:
+        _aguardando[numero] = espera
+    try:
+        tarefa = pool.apply_async(_avaliar_lote, (formula, contextos, tempo_cpu, numero))
+        # O tempo limite só começa quando um worker pega a tarefa
+        limite_fila = time.monotonic() + getattr(settings, 'FORMULAS_SANDBOX_ESPERA_FILA', 30)
+        while not espera.evento.wait(0.05):
+            if tarefa.ready():
+                return tarefa.get()
+            if time.monotonic() > limite_fila:
+                raise FormulaBloqueada('O sandbox de fórmulas está ocupado; tente novamente')
+        try:
+            # Margem para a troca de mensagens com o worker
+            return tarefa.get(timeout=tempo_cpu + 2)
+        except multiprocessing.TimeoutError:
+            _encerrar_worker(espera.pid)
+            raise FormulaBloqueada(f'A fórmula excedeu o tempo limite ({tempo_cpu} s de CPU)')
+    finally:
+        with _trava_aguardando:
+            _aguardando.pop(numero, None)
+
+
+def avaliar(formula, contexto):
+    """avaliar_lote para um único contexto"""
+    return avaliar_lote(formula, [contexto])[0]
@@ -0,0 +1,276 @@
+from collections import Counter
+
+from django.db.models.signals import post_init, pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import (
+    Tree, Post, TreeChange, TreeServiceValue, ResumoInventario,
+    CustomUser, Laudo, Notificacao, ContadorPainel, TreeMedia, ArquivoConteudo,
+    EcosystemServiceConfig, TreeVariable, VersaoConfiguracao, SnapshotInventario,
+)
+from .bairros import localizar
+from .configuracao import invalidar_configuracao
+from .imagens import agendar_processamento, remover_variantes
+from .sandbox import FormulaBloqueada
+
+
+# ============ BAIRRO ============
+
+@receiver(pre_save, sender=Tree)
+def atribuir_bairro(sender, instance, raw=False, **kwargs):
+    """Mantém Tree.bairro de acordo com a posição"""
+    if not raw:
+        instance.bairro = localizar(instance.latitude, instance.longitude)
+
+
+# ============ MEDIDAS DERIVADAS ============
+
+@receiver(pre_save, sender=Tree)
+def atualizar_medidas_derivadas(sender, instance, raw=False, **kwargs):
+    """Mantém biomassa e area_copa de acordo com dap/altura"""
+    if not raw:
+        instance.atualizar_medidas_derivadas()
+
+
+# ============ SINCRONIZAÇÃO INCREMENTAL DE POSIÇÕES ============
+
+@receiver(post_save, sender=Tree)
+def registrar_alteracao_arvore(sender, instance, **kwargs):
+    """Toda inclusão/atualização de árvore gera uma nova versão"""
+    TreeChange.objects.create(tree_id=instance.id, operacao=TreeChange.Operacao.UPSERT)
+
+
+@receiver(post_delete, sender=Tree)
+def registrar_exclusao_arvore(sender, instance, **kwargs):
+    """Exclusões ficam registradas como tombstone"""
+    TreeChange.objects.create(tree_id=instance.id, operacao=TreeChange.Operacao.DELETE)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def registrar_alteracao_comentarios(sender, instance, **kwargs):
+    """O número de comentários faz parte do conjunto de posições (cor do marcador)"""
+    if kwargs.get('created', True):
+        TreeChange.objects.create(tree_id=instance.tree_id, operacao=TreeChange.Operacao.UPSERT)
+
+
+@receiver(post_save, sender=TreeMedia)
+@receiver(post_delete, sender=TreeMedia)
+def atualizar_midias_arvore(sender, instance, raw=False, **kwargs):
+    """Mantém Tree.tem_laudo e invalida os detalhes da árvore em cache"""
+    if raw:
+        return
+    if instance.tipo == TreeMedia.Tipo.LAUDO:
+        TreeMedia.atualizar_tem_laudo([instance.tree_id])
+    TreeChange.objects.create(tree_id=instance.tree_id, operacao=TreeChange.Operacao.UPSERT)
+
+
+# ============ VALORES MATERIALIZADOS DE SERVIÇOS ============
+
+@receiver(post_save, sender=Tree)
+def materializar_servicos_arvore(sender, instance, raw=False, **kwargs):
+    """Mantém os valores materializados da árvore em dia com dap/altura/espécie"""
+    if not raw:
+        try:
+            TreeServiceValue.materializar([instance])
+        except FormulaBloqueada as e:
+            # A árvore é salva; os serviços bloqueados mantêm o valor anterior
+            print(f"Erro ao materializar serviços da árvore {instance.pk}: {e}")
+
+
+# ============ RESUMOS POR BAIRRO / ESPÉCIE / ORIGEM ============
+# A linha atual da árvore é recalculada por TreeServiceValue.materializar
+# (receiver acima); aqui ficam a linha antiga, exclusões e comentários.
+
+@receiver(post_init, sender=Tree)
+def guardar_chave_resumo(sender, instance, **kwargs):
+    # Com campos adiados a chave original não é conhecida (recalcular_resumos corrige)
+    if all(campo in instance.__dict__ for campo in ResumoInventario.DIMENSOES):
+        instance._chave_resumo = ResumoInventario.chave(instance)
+
+
+@receiver(post_save, sender=Tree)
+def atualizar_resumo_arvore(sender, instance, raw=False, **kwargs):
+    antiga = getattr(instance, '_chave_resumo', None)
+    nova = ResumoInventario.chave(instance)
+    if not raw and antiga is not None and antiga != nova:
+        ResumoInventario.recalcular([antiga])
+    instance._chave_resumo = nova
+
+
+@receiver(post_delete, sender=Tree)
+def descontar_resumo_arvore(sender, instance, **kwargs):
+    ResumoInventario.recalcular([getattr(instance, '_chave_resumo', None) or ResumoInventario.chave(instance)])
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def atualizar_resumo_comentarios(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    tree = Tree.objects.filter(id=instance.tree_id).only(*ResumoInventario.DIMENSOES).first()
+    if tree is not None:
+        ResumoInventario.recalcular([ResumoInventario.chave(tree)])
+
+
+# ============ VERSÃO DA CONFIGURAÇÃO ============
+
+@receiver(post_save, sender=EcosystemServiceConfig)
+@receiver(post_delete, sender=EcosystemServiceConfig)
+@receiver(post_save, sender=TreeVariable)
+@receiver(post_delete, sender=TreeVariable)
+def nova_versao_configuracao(sender, **kwargs):
+    """Avisa os outros processos (contador no banco) e descarta a cópia local"""
+    VersaoConfiguracao.incrementar()
+    invalidar_configuracao()
+
+
+# ============ CONTADORES DOS DASHBOARDS ============
+
+# Campos que determinam em quais contadores um objeto entra
+CAMPOS_CONTADORES = {
+    CustomUser: ('user_type', 'aprovacao_status'),
+    Laudo: ('status', 'autor_id'),
+    Notificacao: ('status', 'tecnico_responsavel_id'),
+}
+
+
+def _chaves_contadores(instance):
+    if isinstance(instance, CustomUser):
+        if (instance.user_type == CustomUser.UserType.TECNICO
+                and instance.aprovacao_status == CustomUser.ApprovalStatus.PENDENTE):
+            return {'tecnicos_pendentes'}
+        return set()
+    if isinstance(instance, Laudo):
+        return {f'laudos:{instance.status}', f'laudos_autor:{instance.autor_id}'}
+    chaves = {f'notificacoes:{instance.status}'}
+    if instance.tecnico_responsavel_id:
+        chaves.add(f'analises_tecnico:{instance.tecnico_responsavel_id}')
+    return chaves
+
+
+def _guardar_chaves(instance):
+    # Com campos adiados (.only/.defer) não dá para saber o estado original
+    # sem consultar o banco; nesse caso os contadores são recalculados no save
+    adiados = instance.get_deferred_fields()
+    if instance.pk is None:
+        instance._chaves_contadores = set()
+    elif adiados.intersection(CAMPOS_CONTADORES[type(instance)]):
+        instance._chaves_contadores = None
+    else:
+        instance._chaves_contadores = _chaves_contadores(instance)
+
+
+@receiver(post_init, sender=CustomUser)
+@receiver(post_init, sender=Laudo)
+@receiver(post_init, sender=Notificacao)
+def guardar_chaves_contadores(sender, instance, **kwargs):
+    _guardar_chaves(instance)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_save, sender=Laudo)
+@receiver(post_save, sender=Notificacao)
+def atualizar_contadores(sender, instance, raw=False, **kwargs):
+    """Aplica a diferença entre os contadores antigos e os novos do objeto"""
+    if raw:
+        return
+    antigas = getattr(instance, '_chaves_contadores', None)
+    novas = _chaves_contadores(instance)
+    if antigas is None:
+        ContadorPainel.recalcular(novas)
+    else:
+        deltas = Counter({chave: 1 for chave in novas - antigas})
+        deltas.subtract({chave: 1 for chave in antigas - novas})
+        ContadorPainel.ajustar(deltas)
+    instance._chaves_contadores = novas
+
+
+@receiver(post_delete, sender=CustomUser)
+@receiver(post_delete, sender=Laudo)
+@receiver(post_delete, sender=Notificacao)
+def descontar_contadores(sender, instance, **kwargs):
+    antigas = getattr(instance, '_chaves_contadores', None)
+    if antigas is None:
+        ContadorPainel.recalcular(_chaves_contadores(instance))
+    else:
+        ContadorPainel.ajustar({chave: -1 for chave in antigas})
+
+
+@receiver(post_save, sender=Tree)
+@receiver(post_delete, sender=Tree)
+def atualizar_contador_arvores(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if 'created' not in kwargs:
+        ContadorPainel.ajustar({'arvores': -1})
+    elif kwargs['created']:
+        ContadorPainel.ajustar({'arvores': 1})
+
+
+# ============ VARIANTES DAS FOTOS DAS NOTIFICAÇÕES ============
+
+@receiver(post_init, sender=Notificacao)
+def guardar_foto_original(sender, instance, **kwargs):
+    if 'foto' not in instance.get_deferred_fields():
+        instance._foto_original = instance.foto.name or ''
+
+
+@receiver(post_save, sender=Notificacao)
+def processar_foto_notificacao(sender, instance, raw=False, **kwargs):
+    """Gera as variantes reduzidas quando a foto é enviada ou trocada"""
+    original = getattr(instance, '_foto_original', None)
+    atual = instance.foto.name or ''
+    instance._foto_original = atual
+    if raw or original is None or original == atual:
+        return
+    if atual:
+        agendar_processamento(instance.id)
+    elif instance.foto_variantes:
+        remover_variantes(instance.foto_variantes, instance.foto.storage)
+        Notificacao.objects.filter(id=instance.id).update(foto_variantes={})
+        instance.foto_variantes = {}
+
+
+# ============ REFERÊNCIAS DO ARMAZENAMENTO DEDUPLICADO ============
+
+CAMPOS_ARQUIVO = {
+    Laudo: 'arquivo',
+    CustomUser: 'documento_comprobatorio',
+}
+
+
+@receiver(post_init, sender=Laudo)
+@receiver(post_init, sender=CustomUser)
+def guardar_arquivo_original(sender, instance, **kwargs):
+    campo = CAMPOS_ARQUIVO[sender]
+    if campo not in instance.get_deferred_fields():
+        instance._arquivo_original = getattr(instance, campo).name or ''
+
+
+@receiver(post_save, sender=Laudo)
+@receiver(post_save, sender=CustomUser)
+def atualizar_referencias_arquivo(sender, instance, raw=False, **kwargs):
+    """Troca de arquivo: +1 referência no novo, -1 no anterior"""
+    original = getattr(instance, '_arquivo_original', None)
+    atual = getattr(instance, CAMPOS_ARQUIVO[sender]).name or ''
+    instance._arquivo_original = atual
+    if raw or original is None or original == atual:
+        return
+    ArquivoConteudo.ajustar(atual, 1)
+    ArquivoConteudo.ajustar(original, -1)
+
+
+@receiver(post_delete, sender=Laudo)
+@receiver(post_delete, sender=CustomUser)
+def descontar_referencia_arquivo(sender, instance, **kwargs):
+    ArquivoConteudo.ajustar(getattr(instance, CAMPOS_ARQUIVO[sender]).name, -1)
+
+
+# ============ SNAPSHOTS DO INVENTÁRIO ============
+
+@receiver(post_delete, sender=SnapshotInventario)
+def remover_arquivo_snapshot(sender, instance, **kwargs):
+    """O arquivo só é referenciado pelo catálogo"""
+    if instance.arquivo:
+        instance.arquivo.delete(save=False)
@@ -0,0 +1,281 @@
+"""
+Histórico do inventário em snapshots colunares compactados.
+
+Cada snapshot é um arquivo .zip (deflate) com uma entrada por coluna,
+independente das tabelas vivas:
+- numéricas: bytes de um array (id, N_placa, dap, altura e, por serviço,
+  "fisico:<codigo>" e "monetario:<codigo>", de TreeServiceValue);
+- texto (bairro, nome_cientifico, origem): codificadas por dicionário,
+  com os índices em array e os valores distintos em JSON;
+- meta.json: tipos das colunas, número de árvores e serviços.
+
+Os tipos têm tamanho e ordem dos bytes fixos, na notação do NumPy ('<i8',
+'<f8', '<i4': little-endian), para o arquivo ser lido igual em qualquer
+plataforma. Arquivos do formato 1 (tipos nativos do array) continuam legíveis.
+
+O catálogo (SnapshotInventario) guarda os totais e as versões de inventário
+e configuração; comparar() lê apenas os arquivos. O formato usa só a
+biblioteca padrão (sem NumPy/Parquet), com o mesmo arranjo de um .npz.
+"""
+
+import io
+import json
+import sys
+import zipfile
+from array import array
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from . import metricas
+from .configuracao import obter_configuracao
+from .models import SnapshotInventario, Tree, TreeChange, TreeServiceValue
+
+FORMATO = 2
+CHUNK_SIZE = 5000
+
+NUMERICAS = {'id': '<i8', 'N_placa': '<f8', 'dap': '<f8', 'altura': '<f8'}
+TEXTO = ('bairro', 'nome_cientifico', 'origem')
+TIPO_SERVICO = '<f8'
+TIPO_INDICE = '<i4'
+
+
+def _array(tipo):
+    """array vazio cujos itens têm o tamanho do tipo ('<i8', '<f8', ...)"""
+    tamanho = int(tipo[2:])
+    for typecode in ('fd' if tipo[1] == 'f' else 'bhilq'):
+        if array(typecode).itemsize == tamanho:
+            return array(typecode)
+    raise ValueError(f'Tipo sem correspondente em array: {tipo}')
+
+
+def _inverter(tipo):
+    """Se a ordem dos bytes do tipo difere da desta plataforma"""
+    return (tipo[0] == '<') != (sys.byteorder == 'little')
+
+
+def _para_bytes(valores, tipo):
+    if _inverter(tipo):
+        valores = array(valores.typecode, valores)
+        valores.byteswap()
+    return valores.tobytes()
+
+
+def _de_bytes(dados, tipo, formato=FORMATO):
+    if formato == 1:
+        # Formato 1: typecode nativo do array, na ordem da plataforma que gravou
+        valores = array(tipo)
+        valores.frombytes(dados)
+        return valores
+    valores = _array(tipo)
+    valores.frombytes(dados)
+    if _inverter(tipo):
+        valores.byteswap()
+    return valores
+
+
+def _coletar(servicos):
+    colunas = {nome: _array(tipo) for nome, tipo in NUMERICAS.items()}
+    for servico in servicos:
+        colunas[f'fisico:{servico.codigo}'] = _array(TIPO_SERVICO)
+        colunas[f'monetario:{servico.codigo}'] = _array(TIPO_SERVICO)
+    dicionarios = {nome: {} for nome in TEXTO}
+    indices = {nome: _array(TIPO_INDICE) for nome in TEXTO}
+
+    def valores_do_lote(ids):
+        valores = defaultdict(dict)
+        for tree_id, codigo, fisico, monetario in TreeServiceValue.objects.filter(
+            tree_id__in=ids
+        ).values_list('tree_id', 'servico__codigo', 'valor_fisico', 'valor_monetario'):
+            valores[tree_id][codigo] = (fisico, monetario)
+        return valores
+
+    campos = list(NUMERICAS) + list(TEXTO)
+    lote = []
+
+    def gravar_lote():
+        valores = valores_do_lote([linha[0] for linha in lote])
+        for linha in lote:
+            for nome, valor in zip(campos, linha):
+                if nome in NUMERICAS:
+                    colunas[nome].append(valor or 0)
+                else:
+                    indices[nome].append(dicionarios[nome].setdefault(valor or '', len(dicionarios[nome])))
+            for servico in servicos:
+                fisico, monetario = valores[linha[0]].get(servico.codigo, (0.0, 0.0))
+                colunas[f'fisico:{servico.codigo}'].append(fisico)
+                colunas[f'monetario:{servico.codigo}'].append(monetario)
+
+    for linha in Tree.objects.order_by('id').values_list(*campos).iterator(chunk_size=CHUNK_SIZE):
+        lote.append(linha)
+        if len(lote) >= CHUNK_SIZE:
+            gravar_lote()
+            lote = []
+    if lote:
+        gravar_lote()
+    return colunas, {nome: (list(dicionarios[nome]), indices[nome]) for nome in TEXTO}
+
+
+def _empacotar(colunas, textos, servicos):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as arquivo:
+        tipos = {}
+        for nome, valores in colunas.items():
+            tipos[nome] = NUMERICAS.get(nome, TIPO_SERVICO)
+            arquivo.writestr(f'{nome}.bin', _para_bytes(valores, tipos[nome]))
+        for nome, (distintos, indices) in textos.items():
+            arquivo.writestr(f'{nome}.bin', _para_bytes(indices, TIPO_INDICE))
+            arquivo.writestr(f'{nome}.json', json.dumps(distintos, ensure_ascii=False))
+            tipos[nome] = 'texto:' + TIPO_INDICE
+        arquivo.writestr('meta.json', json.dumps({
+            'formato': FORMATO,
+            'arvores': len(colunas['id']),
+            'colunas': tipos,
+            'servicos': servicos,
+        }, ensure_ascii=False))
+    return buffer.getvalue()
+
+
+def gravar_snapshot(descricao='', forcar=False):
+    """Grava um snapshot do inventário atual
+
+    Retorna None (sem gravar) se inventário e configuração não mudaram
+    desde o último snapshot, a menos que forcar=True. A verificação não
+    enxerga uma nova materialização dos valores (materializar_servicos),
+    por isso quem materializa passa forcar=True.
+    """
+    configuracao = obter_configuracao()
+    versao_inventario = TreeChange.versao_atual()
+    ultimo = SnapshotInventario.objects.order_by('-criado_em').first()
+    if not forcar and ultimo is not None and (
+        ultimo.versao_inventario, ultimo.versao_configuracao
+    ) == (versao_inventario, configuracao.versao):
+        return None
+
+    servicos = [
+        {'codigo': servico.codigo, 'nome': servico.nome, 'unidade': servico.unidade_medida}
+        for servico in configuracao.servicos
+    ]
+    colunas, textos = _coletar(configuracao.servicos)
+    conteudo = _empacotar(colunas, textos, servicos)
+    totais = {
+        servico['codigo']: [
+            round(sum(colunas[f'fisico:{servico["codigo"]}']), 4),
+            round(sum(colunas[f'monetario:{servico["codigo"]}']), 2),
+        ]
+        for servico in servicos
+    }
+    snapshot = SnapshotInventario(
+        descricao=descricao[:200],
+        arvores=len(colunas['id']),
+        versao_inventario=versao_inventario,
+        versao_configuracao=configuracao.versao,
+        tamanho=len(conteudo),
+        totais=totais,
+        servicos=servicos,
+    )
+    snapshot.arquivo.save(f'{timezone.now():%Y%m%d-%H%M%S}.zip', ContentFile(conteudo), save=False)
+    snapshot.save()
+    return snapshot
+
+
+def ler_colunas(snapshot, nomes=None):
+    """{coluna: valores} lidos do arquivo (todas, ou só as pedidas)"""
+    with snapshot.arquivo.open('rb') as bruto, zipfile.ZipFile(bruto) as arquivo:
+        meta = json.loads(arquivo.read('meta.json'))
+        resultado = {}
+        for nome, tipo in meta['colunas'].items():
+            if nomes is not None and nome not in nomes:
+                continue
+            valores = _de_bytes(arquivo.read(f'{nome}.bin'), tipo.rpartition(':')[2], meta.get('formato', 1))
+            if tipo.startswith('texto:'):
+                distintos = json.loads(arquivo.read(f'{nome}.json'))
+                valores = [distintos[indice] for indice in valores]
+            resultado[nome] = valores
+    return meta, resultado
+
+
+def _por_bairro(meta, colunas):
+    """Totais físicos {bairro: {codigo: valor}}"""
+    totais = defaultdict(lambda: defaultdict(float))
+    codigos = [servico['codigo'] for servico in meta['servicos']]
+    for posicao, bairro in enumerate(colunas['bairro']):
+        for codigo in codigos:
+            totais[bairro][codigo] += colunas[f'fisico:{codigo}'][posicao]
+    return totais
+
+
+def comparar(antigo, novo):
+    """Árvores incluídas/removidas e diferenças dos serviços (geral e por bairro)
+
+    Os arquivos não mudam depois de gravados, então o resultado fica no cache.
+    """
+    chave = 'snapshot-comparacao:{}:{}'.format(
+        *(f'{snapshot.id}-{snapshot.criado_em.timestamp()}' for snapshot in (antigo, novo))
+    )
+    resultado = cache.get(chave)
+    metricas.cache('snapshots', resultado is not None)
+    if resultado is not None:
+        return resultado
+
+    meta_antigo, colunas_antigo = ler_colunas(antigo)
+    meta_novo, colunas_novo = ler_colunas(novo)
+    ids_antigo, ids_novo = set(colunas_antigo['id']), set(colunas_novo['id'])
+
+    def contar_por_bairro(colunas, ids):
+        contagem = defaultdict(int)
+        for tree_id, bairro in zip(colunas['id'], colunas['bairro']):
+            if tree_id in ids:
+                contagem[bairro] += 1
+        return contagem
+
+    incluidas = contar_por_bairro(colunas_novo, ids_novo - ids_antigo)
+    removidas = contar_por_bairro(colunas_antigo, ids_antigo - ids_novo)
+    totais_antigo = _por_bairro(meta_antigo, colunas_antigo)
+    totais_novo = _por_bairro(meta_novo, colunas_novo)
+    codigos = sorted(
+        {servico['codigo'] for servico in meta_antigo['servicos']}
+        | {servico['codigo'] for servico in meta_novo['servicos']}
+    )
+
+    por_bairro = {}
+    for bairro in sorted(set(totais_antigo) | set(totais_novo)):
+        diferencas = {
+            codigo: round(totais_novo[bairro][codigo] - totais_antigo[bairro][codigo], 4)
+            for codigo in codigos
+        }
+        linha = {
+            'incluidas': incluidas.get(bairro, 0),
+            'removidas': removidas.get(bairro, 0),
+            'servicos': {codigo: valor for codigo, valor in diferencas.items() if valor},
+        }
+        if linha['incluidas'] or linha['removidas'] or linha['servicos']:
+            por_bairro[bairro] = linha
+
+    servicos = {}
+    for codigo in codigos:
+        antes = antigo.totais.get(codigo, [0.0, 0.0])
+        depois = novo.totais.get(codigo, [0.0, 0.0])
+        servicos[codigo] = {
+            'antes': antes[0],
+            'depois': depois[0],
+            'diferenca': round(depois[0] - antes[0], 4),
+            'diferenca_monetaria': round(depois[1] - antes[1], 2),
+        }
+
+    resultado = {
+        'de': antigo.resumo(),
+        'para': novo.resumo(),
+        'arvores': {
+            'antes': meta_antigo['arvores'],
+            'depois': meta_novo['arvores'],
+            'incluidas': len(ids_novo - ids_antigo),
+            'removidas': len(ids_antigo - ids_novo),
+        },
+        'servicos': servicos,
+        'por_bairro': por_bairro,
+    }
+    cache.set(chave, resultado, None)
+    return resultado
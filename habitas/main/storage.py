@@ -0,0 +1,74 @@
+"""
+Armazenamento endereçado por conteúdo para os uploads (laudos e credenciais).
+
+O arquivo é gravado com o nome "<pasta>/<sha256[:2]>/<sha256><extensão>",
+calculado enquanto o upload é copiado para o disco. Um reenvio do mesmo
+conteúdo (por exemplo ao editar um laudo sem trocar o PDF) reaproveita o
+arquivo existente. Cada arquivo tem uma linha em ArquivoConteudo com o
+número de referências, mantido pelos signals; o comando coletar_arquivos
+remove os que ficaram sem referência.
+"""
+
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.core.files.move import file_move_safe
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+TAMANHO_BLOCO = 64 * 1024
+
+
+@deconstructible
+class ConteudoEnderecadoStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # Nomes iguais significam conteúdo igual: nunca renomeia
+        return name
+
+    def _save(self, name, content):
+        from .models import ArquivoConteudo
+
+        pasta = posixpath.dirname(name)
+        extensao = os.path.splitext(name)[1].lower()
+        diretorio_temporario = self.path(pasta or '.')
+        os.makedirs(diretorio_temporario, exist_ok=True)
+
+        # Copia e calcula o hash em uma única passada
+        digest = hashlib.sha256()
+        tamanho = 0
+        descritor, temporario = tempfile.mkstemp(dir=diretorio_temporario, suffix='.upload')
+        try:
+            with os.fdopen(descritor, 'wb') as destino:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for bloco in content.chunks(TAMANHO_BLOCO):
+                    digest.update(bloco)
+                    tamanho += len(bloco)
+                    destino.write(bloco)
+
+            sha256 = digest.hexdigest()
+            nome = posixpath.join(pasta, sha256[:2], f"{sha256}{extensao}")
+            caminho = self.path(nome)
+            if os.path.exists(caminho):
+                os.remove(temporario)
+            else:
+                os.makedirs(os.path.dirname(caminho), exist_ok=True)
+                file_move_safe(temporario, caminho, allow_overwrite=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(caminho, self.file_permissions_mode)
+        except BaseException:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+
+        ArquivoConteudo.objects.update_or_create(
+            nome=nome, defaults={'sha256': sha256, 'tamanho': tamanho, 'enviado_em': timezone.now()}
+        )
+        return nome
+
+
+armazenamento_deduplicado = ConteudoEnderecadoStorage()
@@ -0,0 +1,280 @@
+{% load static %}// Service worker do mapa Habitas
+//
+// - Arquivos estáticos (incluindo os GeoJSON de limites em city.js/bairros.js)
+//   ficam no Cache Storage, com nome versionado.
+// - Posições das árvores e detalhes já visualizados ficam no IndexedDB.
+//   As posições são atualizadas via /api/trees/changes/?since=<versao>, e os
+//   detalhes são invalidados quando a árvore muda ou quando a configuração
+//   de serviços ecossistêmicos (versao_config) muda.
+// - Sem rede, a página inicial, as posições e os detalhes são servidos do cache.
+
+const STATIC_CACHE = 'habitas-static-v1';
+const PAGES_CACHE = 'habitas-pages-v1';
+const STATIC_ASSETS = [
+  '{% static "js/city.js" %}',
+  '{% static "js/bairros.js" %}',
+  '{% static "js/tree_layer.js" %}',
+  '{% static "css/index.css" %}',
+  '{% static "css/output.css" %}',
+  '{% static "image/habitas.png" %}',
+];
+const CDN_HOSTS = ['unpkg.com'];
+
+const DB_NAME = 'habitas';
+const DB_VERSION = 1;
+const POSITIONS_URL = '/api/trees/positions/';
+const CHANGES_URL = '/api/trees/changes/';
+const DETAIL_RE = /^\/api\/tree\/(\d+)\/$/;
+
+self.addEventListener('install', (event) => {
+  event.waitUntil(
+    caches.open(STATIC_CACHE)
+      .then((cache) => cache.addAll(STATIC_ASSETS))
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener('activate', (event) => {
+  const keep = [STATIC_CACHE, PAGES_CACHE];
+  event.waitUntil(
+    caches.keys()
+      .then((keys) => Promise.all(keys.filter((key) => !keep.includes(key)).map((key) => caches.delete(key))))
+      .then(() => self.clients.claim())
+  );
+});
+
+self.addEventListener('fetch', (event) => {
+  const request = event.request;
+  if (request.method !== 'GET') {
+    return;
+  }
+  const url = new URL(request.url);
+
+  if (url.origin === self.location.origin) {
+    if (url.pathname === POSITIONS_URL && !url.search) {
+      event.respondWith(positionsResponse());
+      return;
+    }
+    const detail = url.pathname.match(DETAIL_RE);
+    if (detail) {
+      event.respondWith(detailResponse(request, Number(detail[1])));
+      return;
+    }
+    if (request.mode === 'navigate' && url.pathname === '/') {
+      event.respondWith(networkFirst(request, PAGES_CACHE));
+      return;
+    }
+    if (url.pathname.startsWith('{% get_static_prefix %}')) {
+      event.respondWith(cacheFirst(request, STATIC_CACHE));
+    }
+  } else if (CDN_HOSTS.includes(url.hostname)) {
+    event.respondWith(cacheFirst(request, STATIC_CACHE));
+  }
+});
+
+// ==================== CACHE STORAGE ====================
+
+async function cacheFirst(request, cacheName) {
+  const cache = await caches.open(cacheName);
+  const cached = await cache.match(request);
+  if (cached) {
+    return cached;
+  }
+  const response = await fetch(request);
+  if (response.ok || response.type === 'opaque') {
+    cache.put(request, response.clone());
+  }
+  return response;
+}
+
+async function networkFirst(request, cacheName) {
+  const cache = await caches.open(cacheName);
+  try {
+    const response = await fetch(request);
+    if (response.ok) {
+      cache.put(request, response.clone());
+    }
+    return response;
+  } catch (error) {
+    const cached = await cache.match(request);
+    if (cached) {
+      return cached;
+    }
+    throw error;
+  }
+}
+
+// ==================== INDEXEDDB ====================
+
+function openDB() {
+  return new Promise((resolve, reject) => {
+    const req = indexedDB.open(DB_NAME, DB_VERSION);
+    req.onupgradeneeded = () => {
+      const db = req.result;
+      db.createObjectStore('meta');
+      db.createObjectStore('detalhes');
+    };
+    req.onsuccess = () => resolve(req.result);
+    req.onerror = () => reject(req.error);
+  });
+}
+
+function idbRequest(req) {
+  return new Promise((resolve, reject) => {
+    req.onsuccess = () => resolve(req.result);
+    req.onerror = () => reject(req.error);
+  });
+}
+
+async function idbGet(store, key) {
+  const db = await openDB();
+  return idbRequest(db.transaction(store).objectStore(store).get(key));
+}
+
+async function idbPut(store, key, value) {
+  const db = await openDB();
+  return idbRequest(db.transaction(store, 'readwrite').objectStore(store).put(value, key));
+}
+
+async function idbDeleteMany(store, keys) {
+  const db = await openDB();
+  const tx = db.transaction(store, 'readwrite');
+  keys.forEach((key) => tx.objectStore(store).delete(key));
+  return new Promise((resolve, reject) => {
+    tx.oncomplete = () => resolve();
+    tx.onerror = () => reject(tx.error);
+  });
+}
+
+async function idbClear(store) {
+  const db = await openDB();
+  return idbRequest(db.transaction(store, 'readwrite').objectStore(store).clear());
+}
+
+function jsonResponse(data) {
+  return new Response(JSON.stringify(data), {
+    headers: {'Content-Type': 'application/json'},
+  });
+}
+
+// ==================== POSIÇÕES ====================
+
+async function positionsResponse() {
+  const cached = await idbGet('meta', 'positions');
+  try {
+    const positions = cached ? await syncPositions(cached) : await fetchPositions();
+    return jsonResponse(positions);
+  } catch (error) {
+    if (cached) {
+      return jsonResponse(cached);
+    }
+    throw error;
+  }
+}
+
+async function fetchPositions() {
+  const response = await fetch(POSITIONS_URL);
+  if (!response.ok) {
+    throw new Error('Erro ao carregar posições');
+  }
+  const positions = await response.json();
+  await checkConfigVersion(positions.versao_config);
+  await idbPut('meta', 'positions', positions);
+  return positions;
+}
+
+async function syncPositions(positions) {
+  // Índice id -> posição nas listas colunares
+  const index = new Map();
+  positions.ids.forEach((id, i) => index.set(id, i));
+  const removed = new Set();
+  let versao = positions.versao;
+  // O cursor pagina o lote; a versão guardada pode ficar parada em
+  // versao_segura enquanto houver alterações recentes
+  let cursor = versao;
+  let versaoConfig = positions.versao_config;
+  let changed = false;
+
+  for (;;) {
+    const response = await fetch(`${CHANGES_URL}?since=${versao}&cursor=${cursor}`);
+    if (!response.ok) {
+      throw new Error('Erro ao sincronizar posições');
+    }
+    const delta = await response.json();
+    versaoConfig = delta.versao_config;
+    const invalidated = [];
+
+    for (const tree of delta.alteradas) {
+      const i = index.get(tree.id);
+      if (i === undefined) {
+        index.set(tree.id, positions.ids.length);
+        positions.ids.push(tree.id);
+        positions.lat.push(tree.latitude);
+        positions.lon.push(tree.longitude);
+        positions.n_posts.push(tree.n_posts);
+      } else {
+        positions.lat[i] = tree.latitude;
+        positions.lon[i] = tree.longitude;
+        positions.n_posts[i] = tree.n_posts;
+        removed.delete(tree.id);
+      }
+      invalidated.push(tree.id);
+    }
+    for (const id of delta.excluidas) {
+      if (index.has(id)) {
+        removed.add(id);
+      }
+      invalidated.push(id);
+    }
+    if (invalidated.length) {
+      await idbDeleteMany('detalhes', invalidated);
+      changed = true;
+    }
+    versao = delta.versao;
+    cursor = delta.cursor;
+    if (!delta.tem_mais) {
+      break;
+    }
+  }
+
+  if (removed.size) {
+    const keep = positions.ids.map((id) => !removed.has(id));
+    for (const column of ['ids', 'lat', 'lon', 'n_posts']) {
+      positions[column] = positions[column].filter((_, i) => keep[i]);
+    }
+  }
+  if (versaoConfig !== positions.versao_config) {
+    await checkConfigVersion(versaoConfig);
+    changed = true;
+  }
+  if (changed || versao !== positions.versao) {
+    positions.versao = versao;
+    positions.versao_config = versaoConfig;
+    await idbPut('meta', 'positions', positions);
+  }
+  return positions;
+}
+
+async function checkConfigVersion(versaoConfig) {
+  // Mudança nos serviços/variáveis invalida todos os detalhes (valores calculados)
+  const atual = await idbGet('meta', 'versao_config');
+  if (atual !== versaoConfig) {
+    await idbClear('detalhes');
+    await idbPut('meta', 'versao_config', versaoConfig);
+  }
+}
+
+// ==================== DETALHES DAS ÁRVORES ====================
+
+async function detailResponse(request, treeId) {
+  const cached = await idbGet('detalhes', treeId);
+  if (cached) {
+    return jsonResponse(cached);
+  }
+  const response = await fetch(request);
+  if (response.ok) {
+    const data = await response.clone().json();
+    await idbPut('detalhes', treeId, data);
+  }
+  return response;
+}
@@ -0,0 +1,26 @@
+"""
+Executor dos testes (TEST_RUNNER).
+
+As métricas de cada processo (main/metricas.py) vão para um diretório
+temporário, removido no final, e não para o METRICAS_DIR real.
+"""
+
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class ExecutorTestes(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._metricas = tempfile.mkdtemp(prefix='habitas-metricas-')
+        settings.METRICAS_DIR = self._metricas
+
+    def teardown_test_environment(self, **kwargs):
+        super().teardown_test_environment(**kwargs)
+        shutil.rmtree(self._metricas, ignore_errors=True)
+        # Sem a gravação ao sair (recriaria o diretório removido)
+        settings.METRICAS_ATIVAS = False
@@ -0,0 +1,177 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from main import acervo
+from main.models import Tree, TreeMedia
+from PIL import Image
+
+
+def _jpeg(tamanho=(1200, 900)):
+    buffer = io.BytesIO()
+    Image.new("RGB", tamanho, "green").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class OrigemStub(BaseHTTPRequestHandler):
+    """Imita o site da prefeitura, contando os acessos por caminho"""
+
+    arquivos = {
+        "/Arvore/DownloadImg/1": ("image/jpeg", _jpeg()),
+        "/Arvore/DownloadImg/2": ("image/jpeg", _jpeg((400, 300))),
+        "/Arvore/DownloadLaudo/1": ("application/pdf", b"%PDF-1.4 laudo"),
+    }
+    redirecionamentos = {
+        "/Arvore/Antiga/2": "/Arvore/DownloadImg/2",
+        "/Arvore/Externa/1": "http://exemplo.invalid/laudo.pdf",
+    }
+    acessos = {}
+
+    def do_GET(self):
+        OrigemStub.acessos[self.path] = OrigemStub.acessos.get(self.path, 0) + 1
+        if self.path in self.redirecionamentos:
+            self.send_response(302)
+            self.send_header("Location", self.redirecionamentos[self.path])
+            self.end_headers()
+            return
+        if self.path not in self.arquivos:
+            self.send_error(404)
+            return
+        content_type, conteudo = self.arquivos[self.path]
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(conteudo)))
+        self.end_headers()
+        self.wfile.write(conteudo)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestAcervo(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor = ThreadingHTTPServer(("127.0.0.1", 0), OrigemStub)
+        threading.Thread(target=cls.servidor.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        OrigemStub.acessos.clear()
+        self.cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache, ignore_errors=True)
+        configuracao = override_settings(
+            ACERVO_ORIGEM=f"http://127.0.0.1:{self.servidor.server_port}",
+            ACERVO_CACHE_DIR=self.cache,
+        )
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.tree = Tree.objects.create(
+            N_placa="001", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=-23.2, longitude=-45.9,
+        )
+        TreeMedia.objects.bulk_create(TreeMedia.criar_para(
+            self.tree.id,
+            laudos="/Arvore/DownloadLaudo/1",
+            imagens="/Arvore/DownloadImg/1, /Arvore/DownloadImg/2",
+        ))
+
+    def _url(self, tipo, indice):
+        return reverse("api_acervo", args=[self.tree.id, tipo, indice])
+
+    def test_baixa_uma_vez(self):
+        for _ in range(2):
+            response = self.client.get(self._url("laudo", 0))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4 laudo")
+
+        self.assertEqual(OrigemStub.acessos["/Arvore/DownloadLaudo/1"], 1)
+        self.assertTrue(TreeMedia.objects.get(tipo="laudo").arquivo_local)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertIn("max-age", response["Cache-Control"])
+
+    def test_miniatura_e_etag(self):
+        response = self.client.get(self._url("imagem", 0), {"miniatura": "1"})
+        self.assertEqual(response["Content-Type"], "image/webp")
+        with Image.open(io.BytesIO(b"".join(response.streaming_content))) as imagem:
+            self.assertEqual(max(imagem.size), acervo.TAMANHO_MINIATURA)
+
+        response = self.client.get(
+            self._url("imagem", 0), {"miniatura": "1"}, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_indice_inexistente(self):
+        self.assertEqual(self.client.get(self._url("laudo", 1)).status_code, 404)
+        self.assertEqual(self.client.get(self._url("outro", 0)).status_code, 404)
+
+    def test_caminho_fora_da_origem(self):
+        TreeMedia.objects.filter(tipo="laudo").update(url="http://exemplo.com/laudo.pdf")
+        self.assertEqual(self.client.get(self._url("laudo", 0)).status_code, 502)
+
+    def test_redirecionamento_so_na_origem(self):
+        arquivo, content_type, _ = acervo.obter("/Arvore/Antiga/2")
+        self.assertEqual(content_type, "image/jpeg")
+        self.assertEqual(OrigemStub.acessos["/Arvore/DownloadImg/2"], 1)
+
+        with self.assertRaises(acervo.ErroAcervo):
+            acervo.obter("/Arvore/Externa/1")
+
+    def test_remove_menos_usados(self):
+        segundo, _, _ = acervo.obter("/Arvore/DownloadLaudo/1")
+        primeiro, _, _ = acervo.obter("/Arvore/DownloadImg/1")
+        # Baixado por último, mas com o grupo todo (original, metadados e
+        # miniatura) sem uso há muito tempo
+        for arquivo in primeiro.parent.glob(f"{primeiro.name}*"):
+            os.utime(arquivo, (1, 1))
+
+        with override_settings(ACERVO_CACHE_MAX_BYTES=os.path.getsize(primeiro)):
+            terceiro, _, _ = acervo.obter("/Arvore/DownloadImg/2")
+
+        self.assertFalse(primeiro.exists())
+        self.assertTrue(segundo.exists())
+        self.assertTrue(terceiro.exists())
+
+
+class TestTreeMedia(TestCase):
+
+    def setUp(self):
+        self.tree = Tree.objects.create(
+            N_placa="001", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=-23.2, longitude=-45.9,
+        )
+        Tree.objects.create(
+            N_placa="002", nome_popular="Jacarandá", nome_cientifico="Jacaranda",
+            dap=20, altura=8, latitude=-23.3, longitude=-45.8
+        )
+
+    def test_tem_laudo_e_filtro(self):
+        laudo = TreeMedia.objects.create(tree=self.tree, tipo="laudo", url="/Arvore/DownloadLaudo/1")
+        self.tree.refresh_from_db()
+        self.assertTrue(self.tree.tem_laudo)
+
+        response = self.client.get(reverse("api_tree_positions"), {"laudo_only": "1"})
+        self.assertEqual(response.json()["ids"], [self.tree.id])
+
+        laudo.delete()
+        self.tree.refresh_from_db()
+        self.assertFalse(self.tree.tem_laudo)
+
+    def test_detalhe_lista_midias(self):
+        TreeMedia.objects.bulk_create(TreeMedia.criar_para(
+            self.tree.id, laudos="/l/1", imagens="/i/1, /i/2"
+        ))
+        data = self.client.get(reverse("api_tree_detail", args=[self.tree.id])).json()
+        self.assertEqual(data["imagens"], ["/i/1", "/i/2"])
+        self.assertEqual(data["laudos"], ["/l/1"])
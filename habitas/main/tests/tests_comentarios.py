@@ -0,0 +1,49 @@
+from django.test import TestCase
+from django.test.client import RequestFactory
+from main.components.posts import PostsView, POSTS_POR_PAGINA
+from main.models import CustomUser, Tree, Post
+
+class TestComentariosPaginados(TestCase):
+
+    def setUp(self):
+        self.tree = Tree.objects.create(
+            N_placa="001", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=-23.2, longitude=-45.9
+        )
+        for i in range(POSTS_POR_PAGINA + 5):
+            Post.objects.create(tree=self.tree, author="cid", content=f"Comentário {i}")
+        self.request = RequestFactory().get("/")
+        self.request.user = CustomUser.objects.create_user(username="cid", password="123456")
+        self.view = PostsView(component_id="posts1", component_name="posts", request=self.request)
+        self.view.update(self.tree.id)
+
+    def test_primeira_pagina(self):
+        self.assertEqual(self.view.total, POSTS_POR_PAGINA + 5)
+        self.assertEqual(len(self.view.posts), POSTS_POR_PAGINA)
+        self.assertTrue(self.view.tem_mais)
+        self.assertEqual(self.view.posts[0].content, f"Comentário {POSTS_POR_PAGINA + 4}")
+
+    def test_carregar_mais(self):
+        self.view.load_more()
+
+        self.assertEqual(len(self.view.posts), POSTS_POR_PAGINA + 5)
+        self.assertFalse(self.view.tem_mais)
+        self.assertEqual(self.view.posts[-1].content, "Comentário 0")
+
+    def test_submit_insere_no_topo(self):
+        self.view.content = "Novo"
+        self.view.submit()
+
+        self.assertEqual(self.view.posts[0].content, "Novo")
+        self.assertEqual(len(self.view.posts), POSTS_POR_PAGINA + 1)
+        self.assertEqual(self.view.total, POSTS_POR_PAGINA + 6)
+
+    def test_recarrega_janela_sem_cache(self):
+        self.view.load_more()
+        self.view.posts = None
+        self.view.hydrate()
+
+        self.assertEqual(len(self.view.posts), POSTS_POR_PAGINA + 5)
+
+    def test_comentarios_nao_vao_para_o_cliente(self):
+        self.assertNotIn('"posts"', self.view.get_frontend_context_variables())
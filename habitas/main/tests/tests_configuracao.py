@@ -0,0 +1,271 @@
+import io
+import threading
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from main import configuracao as modulo_configuracao
+from main.configuracao import obter_configuracao
+from main.impacto import previa_impacto
+from main import sandbox
+from main.sandbox import FormulaBloqueada, avaliar
+from main.models import (
+    CustomUser, EcosystemServiceConfig, Tree, TreeServiceValue, TreeVariable, VersaoConfiguracao,
+    biomassa_estimada,
+)
+
+
+class TestConfiguracaoEmMemoria(TestCase):
+
+    def setUp(self):
+        self.servico = EcosystemServiceConfig.objects.create(
+            nome="Diâmetro", codigo="diametro", formula="dap * fator", valor_monetario_unitario=2.0
+        )
+        TreeVariable.objects.create(nome="Fator", codigo="fator", valor_padrao_geral=3)
+        self.tree = Tree.objects.create(
+            N_placa="001", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=-23.2, longitude=-45.9
+        )
+
+    def test_lote_consulta_a_configuracao_uma_vez(self):
+        # Fora de uma requisição, cada obter_configuracao() consulta a versão
+        arvores = [self.tree] * 50
+        with CaptureQueriesContext(connection) as consultas:
+            valores = self.servico.calcular_lote(arvores)
+        self.assertEqual(valores, [30] * 50)
+        versoes = [q for q in consultas.captured_queries if "versaoconfiguracao" in q["sql"]]
+        self.assertEqual(len(versoes), 1)
+
+    def test_alteracao_local_recarrega(self):
+        versao = obter_configuracao().versao
+        self.assertEqual(self.tree.get_all_ecosystem_services()["diametro"]["valor_fisico"], 30)
+
+        self.servico.formula = "dap * 2"
+        self.servico.save()
+
+        self.assertGreater(obter_configuracao().versao, versao)
+        self.assertEqual(self.tree.get_ecosystem_service_value("diametro"), 20)
+
+    def test_alteracao_de_outro_processo(self):
+        configuracao = obter_configuracao()
+        self.assertIs(obter_configuracao(), configuracao)
+
+        # Alteração sem signals neste processo: só o contador avisa
+        EcosystemServiceConfig.objects.filter(id=self.servico.id).update(ativo=False)
+        VersaoConfiguracao.incrementar()
+
+        self.assertNotIn("diametro", obter_configuracao().servicos_por_codigo)
+
+    def test_uma_consulta_de_versao_por_requisicao(self):
+        obter_configuracao()
+        # Mesmo efeito dos signals request_started/request_finished
+        modulo_configuracao._inicio_requisicao()
+        self.addCleanup(modulo_configuracao._fim_requisicao)
+
+        with self.assertNumQueries(1):
+            obter_configuracao()
+            obter_configuracao()
+            self.assertEqual(self.servico.formula_compilada().co_filename, "<servico diametro>")
+
+    def test_resolve_apenas_variaveis_usadas(self):
+        self.assertEqual(self.servico.dependencias(), {"dap", "fator"})
+        outro = EcosystemServiceConfig.objects.create(
+            nome="Altura", codigo="altura", formula=" math.sqrt(altura) * 2"
+        )
+        self.assertEqual(outro.dependencias(), {"math", "altura"})
+
+        obter_configuracao()
+        modulo_configuracao._inicio_requisicao()
+        self.addCleanup(modulo_configuracao._fim_requisicao)
+        obter_configuracao()
+
+        # Sem variáveis na fórmula: nenhuma consulta de TreeVariableValue
+        with self.assertNumQueries(0):
+            self.assertEqual(outro.calcular(self.tree), round(5 ** 0.5 * 2, 4))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.servico.calcular(self.tree), 30)
+
+
+class TestMedidasDerivadas(TestCase):
+
+    def setUp(self):
+        self.tree = Tree.objects.create(
+            N_placa="001", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=20, altura=8, latitude=-23.2, longitude=-45.9
+        )
+
+    def test_gravadas_ao_salvar_e_usadas_nas_formulas(self):
+        self.tree.refresh_from_db()
+        self.assertAlmostEqual(self.tree.biomassa, biomassa_estimada(20, 8))
+        self.assertAlmostEqual(self.tree.area_copa, 3.14159 * 0.4 ** 2, places=4)
+        self.assertEqual(self.tree.stored_co2, round(biomassa_estimada(20, 8), 4))
+
+        # A fórmula lê a coluna gravada (sem recalcular)
+        Tree.objects.filter(id=self.tree.id).update(biomassa=1.5, area_copa=2.5)
+        servico = EcosystemServiceConfig.objects.create(
+            nome="Teste", codigo="teste", formula="biomassa + area_copa"
+        )
+        self.assertEqual(servico.calcular(Tree.objects.get(id=self.tree.id)), 4)
+
+    def test_alteracao_de_dap_nao_usa_valor_antigo(self):
+        tree = Tree.objects.get(id=self.tree.id)
+        tree.dap = 40
+        self.assertEqual(tree.stored_co2, round(biomassa_estimada(40, 8), 4))
+        tree.save()
+        self.assertAlmostEqual(Tree.objects.get(id=tree.id).biomassa, biomassa_estimada(40, 8))
+
+    def test_comando_preenche_arvores_antigas(self):
+        Tree.objects.update(biomassa=None, area_copa=None)
+        call_command("atualizar_medidas_derivadas", stdout=io.StringIO())
+        self.tree.refresh_from_db()
+        self.assertAlmostEqual(self.tree.biomassa, biomassa_estimada(20, 8))
+
+
+class TestPreviaImpacto(TestCase):
+
+    def setUp(self):
+        self.servico = EcosystemServiceConfig.objects.create(
+            nome="Diâmetro", codigo="diametro", formula="dap", valor_monetario_unitario=1.0
+        )
+        for placa, dap in (("001", 10), ("002", 20), ("003", 30)):
+            Tree.objects.create(
+                N_placa=placa, nome_popular="Ipê", nome_cientifico="Tabebuia",
+                dap=dap, altura=5, latitude=-23.2, longitude=-45.9
+            )
+        CustomUser.objects.create_user(
+            username="gestor", password="123456", user_type=CustomUser.UserType.GESTOR
+        )
+
+    def test_compara_totais(self):
+        previa = previa_impacto("dap * k", {"k": 2}, 0.5, self.servico)
+
+        self.assertFalse(previa["estimado"])
+        self.assertEqual(previa["atual"]["fisico"], 60)
+        self.assertEqual(previa["novo"]["fisico"], 120)
+        self.assertEqual(previa["novo"]["monetario"], 60)
+        self.assertEqual(previa["variacao_percentual"], 100)
+        self.assertEqual(previa["maiores_mudancas"][0]["id"], Tree.objects.get(dap=30).id)
+        self.assertEqual(sum(faixa["novo"] for faixa in previa["distribuicao"]), 3)
+        # Nada foi salvo
+        self.servico.refresh_from_db()
+        self.assertEqual(self.servico.formula, "dap")
+
+    def test_endpoint_recusa_nome_desconhecido(self):
+        self.client.login(username="gestor", password="123456")
+        response = self.client.post(reverse("previa_impacto_servico"), {
+            "formula": "dap * fator_inexistente",
+            "servico_id": self.servico.id,
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("fator_inexistente", response.json()["erro"])
+
+        response = self.client.post(reverse("previa_impacto_servico"), {
+            "formula": "sum(x for x in [dap])", "coeficientes": "{}",
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("sum", response.json()["erro"])
+
+
+@override_settings(FORMULAS_SANDBOX=True, FORMULAS_SANDBOX_TEMPO_CPU=1, FORMULAS_SANDBOX_MEMORIA_MB=256)
+class TestSandbox(TestCase):
+
+    def setUp(self):
+        CustomUser.objects.create_user(
+            username="gestor", password="123456", user_type=CustomUser.UserType.GESTOR
+        )
+
+    def test_limites(self):
+        self.assertEqual(avaliar("math.sqrt(dap)", {"dap": 16.0}), (4.0, None, ""))
+        self.assertEqual(avaliar("[0] * 10 ** 9", {})[1], "MemoryError")
+        with self.assertRaises(FormulaBloqueada):
+            avaliar("10 ** 10 ** 8", {})
+        # Só o worker travado é substituído
+        self.assertEqual(avaliar("dap * 2", {"dap": 1.0})[0], 2.0)
+
+    def test_bloqueio_nao_afeta_outras_tarefas(self):
+        avaliar("1", {})
+        pool = sandbox._pool
+        erros = []
+
+        def travar():
+            try:
+                avaliar("10 ** 10 ** 8", {})
+            except FormulaBloqueada as e:
+                erros.append(e)
+
+        thread = threading.Thread(target=travar)
+        thread.start()
+        # Tarefa de outra requisição enquanto a primeira está travada
+        self.assertEqual(avaliar("dap * 3", {"dap": 2.0})[0], 6.0)
+        thread.join()
+        self.assertEqual(len(erros), 1)
+        self.assertIs(sandbox._pool, pool)
+        self.assertEqual(avaliar("dap + 1", {"dap": 1.0})[0], 2.0)
+
+    def test_materializacao_mantem_valores_se_bloqueada(self):
+        servico = EcosystemServiceConfig.objects.create(nome="Dobro", codigo="dobro", formula="dap * 2")
+        tree = Tree.objects.create(
+            N_placa="002", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=-23.2, longitude=-45.9
+        )
+        servico.formula = "10 ** 10 ** 8"
+        servico.save()
+        with self.assertRaises(FormulaBloqueada) as contexto:
+            TreeServiceValue.materializar([tree])
+        self.assertEqual(contexto.exception.servicos, ["dobro"])
+        # Sem zeros gravados no lugar do valor anterior
+        self.assertEqual(tree.valores_servicos.get().valor_fisico, 20.0)
+
+    def test_formula_bloqueada_nao_e_salva(self):
+        servico = EcosystemServiceConfig.objects.create(nome="Dobro", codigo="dobro", formula="dap * 2")
+        self.client.login(username="gestor", password="123456")
+        response = self.client.post(reverse("editar_servico_ecossistemico", args=[servico.id]), {
+            "nome": "Dobro", "codigo": "dobro", "formula": "10 ** 10 ** 8",
+            "valor_monetario_unitario": "0", "ordem_exibicao": "0",
+        })
+        self.assertEqual(response.status_code, 200)
+        servico.refresh_from_db()
+        self.assertEqual(servico.formula, "dap * 2")
+
+        # O admin valida pelo clean() do model
+        servico.formula = "10 ** 10 ** 8"
+        with self.assertRaises(ValidationError) as contexto:
+            servico.full_clean()
+        self.assertIn("formula", contexto.exception.message_dict)
+
+    def test_calculo_de_uma_arvore_no_sandbox(self):
+        servico = EcosystemServiceConfig.objects.create(nome="Dobro", codigo="dobro", formula="dap * 2")
+        tree = Tree.objects.create(
+            N_placa="002", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=-23.2, longitude=-45.9
+        )
+        self.assertEqual(tree.get_all_ecosystem_services()["dobro"]["valor_fisico"], 20.0)
+        # Gravada sem validação: o detalhe da árvore não trava, o valor vira 0
+        servico.formula = "10 ** 10 ** 8"
+        servico.save(update_fields=["formula"])
+        data = self.client.get(reverse("api_tree_detail", args=[tree.id])).json()
+        self.assertEqual(data["services"]["dobro"]["valor_fisico"], 0.0)
+
+    def test_validar_formula(self):
+        self.client.login(username="gestor", password="123456")
+        response = self.client.post(reverse("validar_formula"), {"formula": "dap * 2"}).json()
+        self.assertTrue(response["valido"])
+        self.assertEqual(response["resultado_exemplo"], 60)
+
+        response = self.client.post(reverse("validar_formula"), {"formula": "math.log(-dap)"}).json()
+        self.assertIn("Erro matemático", response["erro"])
+
+    def test_materializacao_no_sandbox(self):
+        servico = EcosystemServiceConfig.objects.create(
+            nome="Biodiversidade", codigo="bio",
+            formula='tree.species.bio_index if tree.species is not None else 1.0',
+        )
+        tree = Tree.objects.create(
+            N_placa="001", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=-23.2, longitude=-45.9
+        )
+        self.assertEqual(servico.calcular_lote([tree]), [servico.calcular(tree)])
+        self.assertEqual(tree.valores_servicos.get().valor_fisico, 1.0)
@@ -1,6 +1,20 @@
+import importlib
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from main.models import CustomUser
+from main.models import (
+    CustomUser, Tree, Notificacao, ContadorPainel, EcosystemServiceConfig, Post, ResumoInventario,
+    TreeServiceValue,
+)
 
 class TestDashboards(TestCase):
 
@@ -33,3 +47,178 @@ class TestDashboards(TestCase):
         self.client.login(username="tec", password="123456")
         response = self.client.get(reverse("dashboard_gestor"))
         self.assertEqual(response.status_code, 403)
+
+
+class TestContadoresPainel(TestCase):
+
+    def setUp(self):
+        self.cidadao = CustomUser.objects.create_user(username="cid", password="123456")
+        self.tecnico = CustomUser.objects.create_user(
+            username="tec", password="123456",
+            user_type=CustomUser.UserType.TECNICO,
+            aprovacao_status=CustomUser.ApprovalStatus.APROVADO
+        )
+        self.tree = Tree.objects.create(
+            N_placa="001", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=0, longitude=0
+        )
+        # Materializa os contadores antes das alterações
+        ContadorPainel.recalcular([
+            "arvores", "tecnicos_pendentes", "notificacoes:PENDENTE",
+            "notificacoes:EM_ANALISE", f"analises_tecnico:{self.tecnico.id}",
+        ])
+
+    def _valor(self, chave):
+        return ContadorPainel.ler([chave])[chave]
+
+    def test_mudanca_de_status_da_notificacao(self):
+        notificacao = Notificacao.objects.create(
+            titulo="Galho", tipo="DENUNCIA", descricao="d", autor=self.cidadao, tree=self.tree
+        )
+        self.assertEqual(self._valor("notificacoes:PENDENTE"), 1)
+
+        notificacao = Notificacao.objects.get(id=notificacao.id)
+        notificacao.status = Notificacao.StatusNotificacao.EM_ANALISE
+        notificacao.tecnico_responsavel = self.tecnico
+        notificacao.save()
+
+        self.assertEqual(self._valor("notificacoes:PENDENTE"), 0)
+        self.assertEqual(self._valor("notificacoes:EM_ANALISE"), 1)
+        self.assertEqual(self._valor(f"analises_tecnico:{self.tecnico.id}"), 1)
+
+        notificacao.delete()
+        self.assertEqual(self._valor("notificacoes:EM_ANALISE"), 0)
+
+    def test_arvores_e_tecnicos_pendentes(self):
+        CustomUser.objects.create_user(
+            username="tec2", password="123456", user_type=CustomUser.UserType.TECNICO
+        )
+        Tree.objects.create(
+            N_placa="002", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=0, longitude=0
+        )
+        self.assertEqual(self._valor("tecnicos_pendentes"), 1)
+        self.assertEqual(self._valor("arvores"), 2)
+
+    def test_reconciliacao(self):
+        Tree.objects.filter(id=self.tree.id).delete()
+        ContadorPainel.objects.filter(chave="arvores").update(valor=10)
+
+        call_command("reconciliar_contadores", stdout=StringIO())
+
+        self.assertEqual(self._valor("arvores"), 0)
+
+    def test_contador_criado_por_outra_requisicao(self):
+        # Outra requisição cria o contador depois que esta viu que ele não existia
+        self.assertTrue(ContadorPainel.objects.filter(chave="arvores").update(valor=99))
+        update = QuerySet.update
+        chamadas = []
+
+        def update_atrasado(queryset, **campos):
+            chamadas.append(campos)
+            return 0 if len(chamadas) == 1 else update(queryset, **campos)
+
+        with mock.patch.object(QuerySet, "update", update_atrasado):
+            valores = ContadorPainel.recalcular(["arvores"])
+
+        self.assertEqual(valores, {"arvores": 1})
+        self.assertEqual(ContadorPainel.objects.get(chave="arvores").valor, 1)
+
+    def test_dashboard_em_uma_consulta(self):
+        gestor = CustomUser.objects.create_user(
+            username="gestor", password="123456",
+            user_type=CustomUser.UserType.GESTOR,
+            aprovacao_status=CustomUser.ApprovalStatus.APROVADO
+        )
+        ContadorPainel.recalcular(["laudos:PENDENTE"])
+        self.client.force_login(gestor)
+
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse("dashboard_gestor"))
+
+        self.assertEqual(response.context["total_trees"], 1)
+        contadores = [q for q in consultas.captured_queries if "contadorpainel" in q["sql"]]
+        self.assertEqual(len(contadores), 1)
+
+
+class TestResumoInventario(TestCase):
+
+    def setUp(self):
+        EcosystemServiceConfig.objects.create(
+            nome="Diâmetro", codigo="diametro", formula="dap", valor_monetario_unitario=2.0
+        )
+        self.ipe = self.criar(1, "Tabebuia", -23.207, -45.7870, dap=10)
+        self.criar(2, "Tabebuia", -23.207, -45.7870, dap=20)
+        self.criar(3, "Caesalpinia", -23.2, -45.9, dap=5)
+
+    def criar(self, placa, cientifico, latitude, longitude, dap):
+        return Tree.objects.create(
+            N_placa=placa, nome_popular="?", nome_cientifico=cientifico,
+            dap=dap, altura=5, latitude=latitude, longitude=longitude
+        )
+
+    def test_mantido_pelos_signals(self):
+        self.assertEqual(ResumoInventario.objects.count(), 2)
+        bairro = ResumoInventario.somar({"bairro": "Paineiras II- Jd"})
+        self.assertEqual(bairro["arvores"], 2)
+        self.assertEqual(bairro["especies"], 1)
+        self.assertEqual(bairro["servicos"]["diametro"], {"valor_fisico": 30, "valor_monetario": 60})
+
+        Post.objects.create(tree=self.ipe, author="cidadao", content="Bonita")
+        self.ipe.dap = 40
+        self.ipe.save()
+        self.assertEqual(ResumoInventario.somar({"bairro": "Paineiras II- Jd"})["comentarios"], 1)
+        self.assertEqual(
+            ResumoInventario.somar({"bairro": "Paineiras II- Jd"})["servicos"]["diametro"]["valor_fisico"], 60
+        )
+
+        # Mudou de bairro: a linha antiga também é recalculada
+        self.ipe.latitude, self.ipe.longitude = -23.2, -45.9
+        self.ipe.save()
+        self.assertEqual(ResumoInventario.somar({"bairro": "Paineiras II- Jd"})["arvores"], 1)
+        self.ipe.delete()
+
+        geral = ResumoInventario.somar(agrupar="nome_cientifico")
+        self.assertEqual(geral["arvores"], 2)
+        self.assertEqual(geral["comentarios"], 0)
+        self.assertEqual(geral["grupos"]["Tabebuia"]["servicos"]["diametro"]["valor_fisico"], 20)
+
+    def test_endpoint_e_reconstrucao(self):
+        ResumoInventario.objects.all().delete()
+        call_command("recalcular_resumos", stdout=StringIO())
+        self.assertEqual(ResumoInventario.objects.count(), 2)
+
+        resposta = self.client.get(reverse("api_estatisticas"), {"agrupar": "bairro"})
+        dados = resposta.json()
+        self.assertEqual(dados["arvores"], 3)
+        self.assertEqual(dados["especies"], 2)
+        self.assertEqual(dados["servicos"]["diametro"]["valor_monetario"], 70)
+        self.assertEqual(dados["grupos"]["Paineiras II- Jd"]["arvores"], 2)
+        self.assertEqual(self.client.get(reverse("api_estatisticas"), {"agrupar": "dap"}).status_code, 400)
+
+    def test_arvores_sem_valor_materializado(self):
+        # Ex.: inventário anterior à materialização
+        TreeServiceValue.objects.filter(tree=self.ipe).delete()
+        ResumoInventario.recalcular()
+        bairro = ResumoInventario.somar({"bairro": "Paineiras II- Jd"})
+        self.assertEqual(bairro["servicos"]["diametro"], {"valor_fisico": 30, "valor_monetario": 60})
+
+    def test_migracao_preenche_bairro(self):
+        Tree.objects.update(bairro="")
+        migracao = importlib.import_module("main.migrations.0022_preencher_bairro")
+        migracao.preencher_bairros(apps, None)
+        self.assertEqual(Tree.objects.get(id=self.ipe.id).bairro, "Paineiras II- Jd")
+        self.assertEqual(ResumoInventario.somar({"bairro": "Paineiras II- Jd"})["arvores"], 2)
+
+    def test_importacao_materializa_servicos(self):
+        with tempfile.TemporaryDirectory() as diretorio:
+            csv_path = Path(diretorio) / "arvores.csv"
+            csv_path.write_text(
+                "ID;Nome Popular;Nome Cientifico;DAP;Altura;Data;Latitude;Longitude;Laudos;Imagens\n"
+                "10;Ipê;Tabebuia;8 cm;4,5 m;;-23,207;-45,787;;\n",
+                encoding="utf-8",
+            )
+            call_command("import_trees_csv", csv_path=str(csv_path), stdout=StringIO())
+        tree = Tree.objects.get(N_placa=10)
+        self.assertEqual(tree.valores_servicos.get().valor_fisico, 8)
+        self.assertEqual(ResumoInventario.somar({"bairro": "Paineiras II- Jd"})["servicos"]["diametro"]["valor_fisico"], 38)
@@ -0,0 +1,61 @@
+import io
+
+from django.core.management import call_command
+from django.test import TestCase
+from main.especies import IndiceEspecies, normalizar_nome
+from main.models import SinonimoEspecie, Species, Tree, TreeChange
+
+
+class TestVinculoEspecies(TestCase):
+
+    def setUp(self):
+        self.ipe = Species.objects.create(name="Handroanthus impetiginosus", bio_index=3)
+        self.sibipiruna = Species.objects.create(name="Cenostigma pluviosum", bio_index=2)
+        SinonimoEspecie.objects.create(species=self.ipe, nome="Ipê-roxo")
+        SinonimoEspecie.objects.create(
+            species=self.sibipiruna, nome="Caesalpinia peltophoroides",
+            tipo=SinonimoEspecie.Tipo.CIENTIFICO,
+        )
+
+    def criar(self, placa, cientifico, popular):
+        return Tree.objects.create(
+            N_placa=placa, nome_popular=popular, nome_cientifico=cientifico,
+            dap=10, altura=5, latitude=-23.2, longitude=-45.9
+        )
+
+    def test_normalizacao(self):
+        self.assertEqual(
+            normalizar_nome("Handroanthus impetiginosus (Mart. ex DC.) Mattos"),
+            "handroanthus impetiginosus mattos",
+        )
+        self.assertEqual(normalizar_nome("  IPÊ ROXO "), normalizar_nome("Ipê-roxo"))
+        self.assertEqual(normalizar_nome("Ficus sp."), "ficus")
+
+        indice = IndiceEspecies()
+        self.assertEqual(indice.resolver("Handroanthus impetiginosus (Mart.) Mattos"), self.ipe.id)
+        self.assertEqual(indice.resolver("CAESALPINIA PELTOPHOROIDES"), self.sibipiruna.id)
+        self.assertEqual(indice.resolver("Desconhecida", "IPE ROXO"), self.ipe.id)
+        self.assertIsNone(indice.resolver("Desconhecida", "Outra"))
+
+    def test_comando_vincula_incrementalmente(self):
+        ipe = self.criar(1, "Handroanthus impetiginosus", "Ipê")
+        sibipiruna = self.criar(2, "Caesalpinia peltophoroides Benth.", "Sibipiruna")
+        desconhecida = self.criar(3, "Indeterminada", "?")
+        versao = TreeChange.versao_atual()
+
+        saida = io.StringIO()
+        call_command("vincular_especies", stdout=saida)
+
+        ipe.refresh_from_db()
+        sibipiruna.refresh_from_db()
+        desconhecida.refresh_from_db()
+        self.assertEqual(ipe.species, self.ipe)
+        self.assertEqual(ipe.biodiversity, 3)
+        self.assertEqual(sibipiruna.species, self.sibipiruna)
+        self.assertIsNone(desconhecida.species)
+        self.assertIn("Indeterminada: 1", saida.getvalue())
+        self.assertGreater(TreeChange.versao_atual(), versao)
+
+        # Só as árvores sem espécie são revistas
+        with self.assertNumQueries(4):
+            call_command("vincular_especies", stdout=io.StringIO())
@@ -0,0 +1,79 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from main.models import CustomUser, Tree, EcosystemServiceConfig
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+class TestExportacao(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="cid", password="123456")
+        self.servico = EcosystemServiceConfig.objects.create(
+            nome="Diâmetro", codigo="diametro", formula="dap", valor_monetario_unitario=2.0
+        )
+        self.ipe = Tree.objects.create(
+            N_placa="001", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=-23.2, longitude=-45.9
+        )
+        Tree.objects.create(
+            N_placa="002", nome_popular="Jacarandá", nome_cientifico="Jacaranda",
+            dap=20, altura=8, latitude=-23.3, longitude=-45.8
+        )
+
+    def _conteudo(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_exige_login(self):
+        response = self.client.get(reverse("exportar_arvores"))
+        self.assertEqual(response.status_code, 302)
+
+    def test_csv_com_filtro_e_servicos(self):
+        self.client.login(username="cid", password="123456")
+        response = self.client.get(
+            reverse("exportar_arvores"), {"species": "Ipê", "servicos": "1"}
+        )
+        self.assertTrue(response.streaming)
+
+        linhas = list(csv.DictReader(io.StringIO(self._conteudo(response).decode()), delimiter=";"))
+        self.assertEqual(len(linhas), 1)
+        self.assertEqual(linhas[0]["nome_popular"], "Ipê")
+        self.assertEqual(float(linhas[0]["diametro"]), 10)
+        self.assertEqual(float(linhas[0]["diametro_valor_monetario"]), 20)
+
+    def test_geojson(self):
+        self.client.login(username="cid", password="123456")
+        response = self.client.get(reverse("exportar_arvores"), {"formato": "geojson"})
+
+        data = json.loads(self._conteudo(response))
+        self.assertEqual(len(data["features"]), 2)
+        self.assertEqual(data["features"][0]["geometry"]["coordinates"], [-45.9, -23.2])
+
+    def test_formato_invalido(self):
+        self.client.login(username="cid", password="123456")
+        response = self.client.get(reverse("exportar_arvores"), {"formato": "xls"})
+        self.assertEqual(response.status_code, 400)
+
+    @unittest.skipIf(pq is None, "pyarrow não instalado")
+    def test_comando_parquet(self):
+        with tempfile.TemporaryDirectory() as diretorio:
+            saida = os.path.join(diretorio, "arvores.parquet")
+            call_command(
+                "export_trees", formato="parquet", saida=saida, servicos=True,
+                chunk_size=1, stdout=io.StringIO()
+            )
+            tabela = pq.read_table(saida)
+
+        self.assertEqual(tabela.num_rows, 2)
+        self.assertEqual(tabela.column("diametro").to_pylist(), [10, 20])
@@ -0,0 +1,86 @@
+import io
+import math
+import tempfile
+from pathlib import Path
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+from main.models import Tree, EcosystemServiceConfig, TreeServiceValue, HeatmapCell
+
+
+def tile_da_posicao(latitude, longitude, z):
+    n = 2 ** z
+    x = int((longitude + 180.0) / 360.0 * n)
+    lat = math.radians(latitude)
+    y = int((1.0 - math.asinh(math.tan(lat)) / math.pi) / 2.0 * n)
+    return x, y
+
+
+class TestMapaDeCalor(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        # MEDIA_ROOT: materializar_servicos também grava um snapshot do inventário
+        self.override = override_settings(
+            HEATMAP_CACHE_DIR=self.cache_dir.name, MEDIA_ROOT=self.cache_dir.name
+        )
+        self.override.enable()
+
+        self.servico = EcosystemServiceConfig.objects.create(
+            nome="Diâmetro", codigo="diametro", formula="dap", valor_monetario_unitario=2.0
+        )
+        self.tree = Tree.objects.create(
+            N_placa="001", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=-23.2, longitude=-45.9
+        )
+
+    def tearDown(self):
+        self.override.disable()
+        self.cache_dir.cleanup()
+
+    def test_materializacao_ao_salvar(self):
+        valor = TreeServiceValue.objects.get(tree=self.tree, servico=self.servico)
+        self.assertEqual(valor.valor_fisico, 10)
+        self.assertEqual(valor.valor_monetario, 20)
+
+    def test_tile_com_arvore(self):
+        call_command("materializar_servicos", stdout=io.StringIO())
+        self.assertTrue(HeatmapCell.objects.exists())
+
+        x, y = tile_da_posicao(-23.2, -45.9, 15)
+        response = self.client.get(reverse("api_heatmap_tile", args=["diametro", 15, x, y]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+        imagem = Image.open(io.BytesIO(response.content))
+        self.assertIsNotNone(imagem.getbbox())
+
+    def test_tile_vazio_fora_da_cidade(self):
+        call_command("materializar_servicos", stdout=io.StringIO())
+        response = self.client.get(reverse("api_heatmap_tile", args=["arvores", 15, 0, 0]))
+        imagem = Image.open(io.BytesIO(response.content))
+        self.assertIsNone(imagem.getbbox())
+
+    def test_medida_inexistente(self):
+        response = self.client.get(reverse("api_heatmap_tile", args=["inexistente", 15, 0, 0]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_tile_fora_da_grade(self):
+        response = self.client.get(reverse("api_heatmap_tile", args=["arvores", 12, 2 ** 12, 0]))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse("api_heatmap_tile", args=["arvores", 12, 0, 2 ** 12]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_cache_limitado(self):
+        call_command("materializar_servicos", stdout=io.StringIO())
+        diretorio = Path(self.cache_dir.name) / "heatmap"
+        with override_settings(HEATMAP_CACHE_DIR=diretorio, HEATMAP_CACHE_MAX_BYTES=1):
+            for x in range(3):
+                self.client.get(reverse("api_heatmap_tile", args=["arvores", 15, x, 0]))
+            # Cada gravação acima do limite remove os tiles mais antigos
+            self.assertLessEqual(len(list(diretorio.rglob("*.png"))), 1)
+            # Zoom fora da faixa do mapa não é gravado
+            self.client.get(reverse("api_heatmap_tile", args=["arvores", 3, 0, 0]))
+            self.assertEqual(list(diretorio.glob("*/arvores/3")), [])
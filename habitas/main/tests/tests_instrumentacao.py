@@ -0,0 +1,151 @@
+import json
+import tempfile
+from pathlib import Path
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from main import metricas
+from main.instrumentacao import Medicao, normalizar_sql
+from main.models import CustomUser, EcosystemServiceConfig, Tree
+
+
+class TestInstrumentacao(TestCase):
+
+    def setUp(self):
+        self.tree = Tree.objects.create(
+            N_placa=1, nome_popular="Ipê", nome_cientifico="Handroanthus",
+            dap=20, altura=8, latitude=-23.2, longitude=-45.9
+        )
+
+    def test_normalizacao_agrupa_parametros(self):
+        self.assertEqual(
+            normalizar_sql('SELECT * FROM "main_tree" WHERE "id" IN (%s, %s, %s) LIMIT 21'),
+            normalizar_sql('SELECT *  FROM "main_tree"\nWHERE "id" IN (%s, %s) LIMIT 5'),
+        )
+        self.assertNotIn("'abc'", normalizar_sql("SELECT 'abc'"))
+
+    def test_repeticoes_sem_debug(self):
+        for placa in range(2, 5):
+            Tree.objects.create(
+                N_placa=placa, nome_popular="Ipê", nome_cientifico="Handroanthus",
+                dap=20, altura=8, latitude=-23.2, longitude=-45.9
+            )
+        medicao = Medicao()
+        with connection.execute_wrapper(medicao):
+            for tree in Tree.objects.all():
+                tree.posts.count()  # N+1
+
+        self.assertEqual(medicao.consultas, 5)
+        self.assertGreater(medicao.tempo_banco, 0)
+        sql, vezes = medicao.repetidas()[0]
+        self.assertEqual(vezes, 4)
+        self.assertIn("main_post", sql)
+
+    @override_settings(INSTRUMENTACAO_ATIVA=True, INSTRUMENTACAO_LIMITE_CONSULTAS=2)
+    def test_requisicao_acima_do_limite_e_registrada(self):
+        with self.assertLogs("habitas.instrumentacao", level="WARNING") as logs:
+            response = self.client.get(reverse("api_tree_detail", args=[self.tree.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("db;dur=", response["Server-Timing"])
+        self.assertIn("api_tree_detail", logs.output[0])
+        registro = logs.records[0].instrumentacao
+        self.assertGreaterEqual(registro["consultas"], 2)
+        self.assertEqual(registro["bytes"], len(response.content))
+
+    @override_settings(INSTRUMENTACAO_ATIVA=True)
+    def test_requisicao_normal_apenas_debug(self):
+        with self.assertLogs("habitas.instrumentacao", level="DEBUG") as logs:
+            self.client.get(reverse("api_tree_detail", args=[self.tree.id]))
+        self.assertEqual([registro.levelname for registro in logs.records], ["DEBUG"])
+
+    @override_settings(INSTRUMENTACAO_ATIVA=True)
+    def test_streaming_medido_ate_o_fim_do_envio(self):
+        EcosystemServiceConfig.objects.create(nome="Diâmetro", codigo="diametro", formula="dap")
+        CustomUser.objects.create_user(username="cid", password="123456")
+        self.client.login(username="cid", password="123456")
+        with self.assertLogs("habitas.instrumentacao", level="DEBUG") as logs:
+            response = self.client.get(reverse("exportar_arvores"), {"servicos": "1"})
+            self.assertEqual(logs.records, [])  # ainda não enviada
+            conteudo = b"".join(response.streaming_content)
+        registro = logs.records[0].instrumentacao
+        self.assertEqual(registro["view"], "exportar_arvores")
+        self.assertEqual(registro["bytes"], len(conteudo))
+        # Inclui as consultas feitas durante o envio (árvores e valores dos serviços)
+        self.assertGreaterEqual(registro["consultas"], 3)
+
+    def test_desativada_por_padrao(self):
+        response = self.client.get(reverse("api_tree_detail", args=[self.tree.id]))
+        self.assertFalse(response.has_header("Server-Timing"))
+
+
+class TestMetricas(TestCase):
+
+    def setUp(self):
+        self.diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.diretorio.cleanup)
+        override = override_settings(METRICAS_DIR=self.diretorio.name, METRICAS_INTERVALO=0)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.tree = Tree.objects.create(
+            N_placa=1, nome_popular="Ipê", nome_cientifico="Handroanthus",
+            dap=20, altura=8, latitude=-23.2, longitude=-45.9
+        )
+
+    def test_formulas_por_servico(self):
+        servico = EcosystemServiceConfig.objects.create(
+            nome="Diâmetro", codigo="diametro", formula="dap * 2"
+        )
+        antes = metricas.coletar()["habitas_formula_avaliacoes_total"].get(("diametro",), 0)
+        servico.calcular(self.tree)
+        servico.calcular_lote([self.tree, self.tree])
+        depois = metricas.coletar()["habitas_formula_avaliacoes_total"][("diametro",)]
+        self.assertEqual(depois - antes, 3)
+
+    @override_settings(METRICAS_TOKEN="segredo")
+    def test_endpoint_soma_os_processos(self):
+        # Arquivo de outro worker
+        Path(self.diretorio.name, "outro.json").write_text(json.dumps({
+            "buckets": list(metricas.buckets()),
+            "series": [["habitas_scraper_erros_total", [], 3]],
+        }))
+        self.client.get(reverse("api_tree_detail", args=[self.tree.id]))
+
+        response = self.client.get(reverse("metricas"), HTTP_AUTHORIZATION="Bearer segredo")
+        self.assertEqual(response.status_code, 200)
+        texto = response.content.decode()
+        self.assertIn("# TYPE habitas_requisicao_segundos histogram", texto)
+        self.assertIn('habitas_requisicao_segundos_bucket{view="api_tree_detail",metodo="GET",le="+Inf"}', texto)
+        erros = [linha for linha in texto.splitlines() if linha.startswith("habitas_scraper_erros_total ")]
+        self.assertGreaterEqual(float(erros[0].split()[1]), 3)
+
+    @override_settings(METRICAS_TOKEN="segredo")
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse("metricas")).status_code, 401)
+        response = self.client.get(reverse("metricas"), HTTP_AUTHORIZATION="Bearer segredo")
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICAS_TOKEN=None)
+    def test_sem_token_apenas_gestores(self):
+        self.assertEqual(self.client.get(reverse("metricas")).status_code, 401)
+        CustomUser.objects.create_user(
+            username="gestor", password="123456", user_type=CustomUser.UserType.GESTOR
+        )
+        self.client.login(username="gestor", password="123456")
+        self.assertEqual(self.client.get(reverse("metricas")).status_code, 200)
+
+    def test_processos_encerrados_incorporados(self):
+        metricas.incrementar("habitas_scraper_erros_total", valor=1)
+        metricas.gravar()
+        # Arquivo de um worker que já terminou (pid inexistente)
+        encerrado = Path(self.diretorio.name, "999999999-abcdef12.json")
+        encerrado.write_text(json.dumps({
+            "buckets": list(metricas.buckets()),
+            "series": [["habitas_scraper_erros_total", [], 5]],
+        }))
+        antes = metricas.coletar()["habitas_scraper_erros_total"][()]
+        self.assertFalse(encerrado.exists())
+        self.assertTrue(Path(self.diretorio.name, metricas.ARQUIVO_ACUMULADO).exists())
+        # Os valores do processo encerrado continuam somados
+        self.assertEqual(metricas.coletar()["habitas_scraper_erros_total"][()], antes)
+        self.assertGreaterEqual(antes, 6)
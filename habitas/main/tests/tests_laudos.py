@@ -1,10 +1,24 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.urls import reverse
-from main.models import CustomUser, Tree, Laudo
+from main.models import ArquivoConteudo, CustomUser, Tree, Laudo
+from main.storage import armazenamento_deduplicado
 
 class TestLaudos(TestCase):
 
     def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        configuracao = override_settings(MEDIA_ROOT=self.media)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
         self.tecnico = CustomUser.objects.create_user(
             username="tec", password="123456",
             user_type=CustomUser.UserType.TECNICO,
@@ -51,3 +65,138 @@ class TestLaudos(TestCase):
         self.assertEqual(response.status_code, 302)
         laudo.refresh_from_db()
         self.assertEqual(laudo.status, Laudo.LaudoStatus.APROVADO)
+
+
+class TestArmazenamentoDeduplicado(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        configuracao = override_settings(MEDIA_ROOT=self.media)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+        self.tecnico = CustomUser.objects.create_user(
+            username="tec", password="123456", user_type=CustomUser.UserType.TECNICO
+        )
+        self.tree = Tree.objects.create(
+            N_placa="001", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=0.0, longitude=0.0
+        )
+
+    def _laudo(self, conteudo, nome="laudo.pdf"):
+        return Laudo.objects.create(
+            titulo="Laudo", descricao="d", autor=self.tecnico, tree=self.tree,
+            arquivo=SimpleUploadedFile(nome, conteudo, content_type="application/pdf"),
+        )
+
+    def test_conteudo_igual_um_arquivo(self):
+        primeiro = self._laudo(b"%PDF-1.4 igual", "a.pdf")
+        segundo = self._laudo(b"%PDF-1.4 igual", "b.PDF")
+
+        self.assertEqual(primeiro.arquivo.name, segundo.arquivo.name)
+        self.assertTrue(primeiro.arquivo.name.startswith("laudos/"))
+        self.assertTrue(armazenamento_deduplicado.exists(primeiro.arquivo.name))
+        self.assertEqual(ArquivoConteudo.objects.get().referencias, 2)
+
+        segundo.delete()
+        self.assertEqual(ArquivoConteudo.objects.get().referencias, 1)
+
+    def test_troca_de_arquivo_e_coleta(self):
+        laudo = self._laudo(b"%PDF-1.4 antigo")
+        antigo = laudo.arquivo.name
+
+        laudo = Laudo.objects.get(id=laudo.id)
+        laudo.arquivo = SimpleUploadedFile("novo.pdf", b"%PDF-1.4 novo")
+        laudo.save()
+
+        self.assertEqual(ArquivoConteudo.objects.get(nome=antigo).referencias, 0)
+        self.assertEqual(ArquivoConteudo.objects.get(nome=laudo.arquivo.name).referencias, 1)
+
+        # Órfão recente é preservado; depois do prazo é removido
+        call_command("coletar_arquivos", stdout=open(os.devnull, "w"))
+        self.assertTrue(armazenamento_deduplicado.exists(antigo))
+
+        ArquivoConteudo.objects.filter(nome=antigo).update(
+            enviado_em=ArquivoConteudo.objects.get(nome=antigo).enviado_em - timedelta(days=2)
+        )
+        call_command("coletar_arquivos", stdout=open(os.devnull, "w"))
+        self.assertFalse(armazenamento_deduplicado.exists(antigo))
+        self.assertFalse(ArquivoConteudo.objects.filter(nome=antigo).exists())
+        self.assertTrue(armazenamento_deduplicado.exists(laudo.arquivo.name))
+
+
+@override_settings(MEDIA_OFFLOAD=None)
+class TestArquivoLaudo(TestCase):
+
+    CONTEUDO = b"%PDF-1.4 " + bytes(range(256)) * 8
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        configuracao = override_settings(MEDIA_ROOT=self.media)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+        self.autor = CustomUser.objects.create_user(
+            username="autor", password="123456",
+            user_type=CustomUser.UserType.TECNICO,
+            aprovacao_status=CustomUser.ApprovalStatus.APROVADO
+        )
+        CustomUser.objects.create_user(
+            username="outro", password="123456",
+            user_type=CustomUser.UserType.TECNICO,
+            aprovacao_status=CustomUser.ApprovalStatus.APROVADO
+        )
+        tree = Tree.objects.create(
+            N_placa="001", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=0.0, longitude=0.0
+        )
+        self.laudo = Laudo.objects.create(
+            titulo="Laudo", descricao="d", autor=self.autor, tree=tree,
+            status=Laudo.LaudoStatus.PENDENTE,
+            arquivo=SimpleUploadedFile("laudo.pdf", self.CONTEUDO),
+        )
+        self.url = reverse("arquivo_laudo", args=[self.laudo.id])
+
+    def test_permissoes(self):
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+        self.client.login(username="outro", password="123456")
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+        Laudo.objects.filter(id=self.laudo.id).update(status=Laudo.LaudoStatus.APROVADO)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_range_e_condicional(self):
+        self.client.login(username="autor", password="123456")
+
+        response = self.client.get(self.url)
+        self.assertEqual(b"".join(response.streaming_content), self.CONTEUDO)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertIn("private", response["Cache-Control"])
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=9-18")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 9-18/{len(self.CONTEUDO)}")
+        self.assertEqual(b"".join(response.streaming_content), self.CONTEUDO[9:19])
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-4")
+        self.assertEqual(b"".join(response.streaming_content), self.CONTEUDO[-4:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f"bytes={len(self.CONTEUDO)}-")
+        self.assertEqual(response.status_code, 416)
+
+        # If-Range desatualizado: arquivo inteiro
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-3", HTTP_IF_RANGE='"outro"')
+        self.assertEqual(response.status_code, 200)
+
+        etag = response["ETag"]
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    @override_settings(MEDIA_OFFLOAD="x-accel")
+    def test_x_accel_redirect(self):
+        self.client.login(username="autor", password="123456")
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Accel-Redirect"], f"/protegido/{self.laudo.arquivo.name}")
+        self.assertEqual(response.content, b"")
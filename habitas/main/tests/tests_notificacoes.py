@@ -1,6 +1,14 @@
-from django.test import TestCase
+import io
+import tempfile
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from main import imagens
 from main.models import CustomUser, Tree, Notificacao
+from main.views import NOTIFICACOES_POR_PAGINA
+from PIL import Image
 
 class TestNotificacoes(TestCase):
 
@@ -80,3 +88,180 @@ class TestNotificacoes(TestCase):
 
         notif.refresh_from_db()
         self.assertEqual(notif.status, Notificacao.StatusNotificacao.RESOLVIDA)
+
+class TestListarNotificacoes(TestCase):
+
+    def setUp(self):
+        self.cidadao = CustomUser.objects.create_user(username="cid", password="123456")
+        self.tecnico = CustomUser.objects.create_user(
+            username="tec", password="123456",
+            user_type=CustomUser.UserType.TECNICO,
+            aprovacao_status=CustomUser.ApprovalStatus.APROVADO
+        )
+        self.tree = Tree.objects.create(
+            N_placa="001", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=0, longitude=0
+        )
+        for i in range(NOTIFICACOES_POR_PAGINA + 3):
+            Notificacao.objects.create(
+                titulo=f"Pendente {i}", tipo="DENUNCIA", descricao="d",
+                autor=self.cidadao, tree=self.tree,
+            )
+        # Resolvida pelo técnico: só entra na fila dele pela atribuição
+        self.resolvida = Notificacao.objects.create(
+            titulo="Resolvida", tipo="DENUNCIA", descricao="d", autor=self.cidadao,
+            tree=self.tree, status="RESOLVIDA", tecnico_responsavel=self.tecnico,
+        )
+        # Resolvida por outro técnico: não aparece
+        Notificacao.objects.create(
+            titulo="Outra", tipo="DENUNCIA", descricao="d", autor=self.cidadao,
+            tree=self.tree, status="RESOLVIDA",
+        )
+        self.client.login(username="tec", password="123456")
+
+    def test_paginas_do_tecnico(self):
+        response = self.client.get(reverse("listar_notificacoes"))
+        primeira = response.context["notificacoes"]
+        self.assertEqual(len(primeira), NOTIFICACOES_POR_PAGINA)
+        self.assertEqual(primeira[0], self.resolvida)
+        self.assertIsNotNone(response.context["proxima_pagina"])
+
+        response = self.client.get(reverse("listar_notificacoes") + "?" + response.context["proxima_pagina"])
+        segunda = response.context["notificacoes"]
+        self.assertEqual(len(segunda), 4)
+        self.assertIsNone(response.context["proxima_pagina"])
+        self.assertEqual(segunda[-1].titulo, "Pendente 0")
+        self.assertFalse({n.id for n in primeira} & {n.id for n in segunda})
+
+    def test_cursor_invalido_volta_ao_inicio(self):
+        response = self.client.get(reverse("listar_notificacoes"), {"cursor": "x"})
+        self.assertEqual(response.context["notificacoes"][0], self.resolvida)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), FOTOS_PROCESSAMENTO_ASSINCRONO=False)
+class TestFotosNotificacao(TestCase):
+
+    def setUp(self):
+        self.cidadao = CustomUser.objects.create_user(username="cid", password="123456")
+        self.tree = Tree.objects.create(
+            N_placa="001", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=0, longitude=0
+        )
+
+    def _foto(self):
+        # Foto "de celular": grande, deitada e com EXIF (orientação 6 = girar 90°)
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = "Celular"
+        buffer = io.BytesIO()
+        Image.new("RGB", (3000, 2000), "green").save(buffer, format="JPEG", exif=exif)
+        return SimpleUploadedFile("foto.jpg", buffer.getvalue(), content_type="image/jpeg")
+
+    def test_gera_variantes_sem_exif(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notificacao = Notificacao.objects.create(
+                titulo="Galho", tipo="DENUNCIA", descricao="d",
+                autor=self.cidadao, tree=self.tree, foto=self._foto(),
+            )
+
+        notificacao.refresh_from_db()
+        self.assertEqual(set(notificacao.foto_variantes), {"miniatura", "exibicao"})
+        self.assertTrue(notificacao.foto_miniatura["webp"].endswith(".webp"))
+
+        storage = notificacao.foto.storage
+        with Image.open(storage.path(notificacao.foto_variantes["exibicao"]["jpeg"])) as imagem:
+            # Orientação aplicada: a foto fica em pé
+            self.assertEqual(imagem.height, 1280)
+            self.assertLess(imagem.width, imagem.height)
+            self.assertEqual(len(imagem.getexif()), 0)
+        with Image.open(storage.path(notificacao.foto_variantes["miniatura"]["webp"])) as imagem:
+            self.assertEqual(max(imagem.size), 256)
+        # O original (linkado na análise) também perde o EXIF, já em pé
+        with Image.open(storage.path(notificacao.foto.name)) as imagem:
+            self.assertEqual(imagem.format, "JPEG")
+            self.assertEqual(imagem.size, (2000, 3000))
+            self.assertEqual(len(imagem.getexif()), 0)
+
+    def test_original_nao_aparece_antes_do_processamento(self):
+        # Sem executar os callbacks do commit: a foto fica pendente
+        notificacao = Notificacao.objects.create(
+            titulo="Galho", tipo="DENUNCIA", descricao="d",
+            autor=self.cidadao, tree=self.tree, foto=self._foto(),
+        )
+        gestor = CustomUser.objects.create_user(
+            username="gestor", password="123456",
+            user_type=CustomUser.UserType.GESTOR,
+            aprovacao_status=CustomUser.ApprovalStatus.APROVADO
+        )
+        self.client.force_login(gestor)
+
+        response = self.client.get(reverse("listar_notificacoes"))
+
+        self.assertContains(response, "Processando foto")
+        self.assertNotContains(response, notificacao.foto.url)
+
+    def test_listagem_usa_miniatura(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notificacao = Notificacao.objects.create(
+                titulo="Galho", tipo="DENUNCIA", descricao="d",
+                autor=self.cidadao, tree=self.tree, foto=self._foto(),
+            )
+        gestor = CustomUser.objects.create_user(
+            username="gestor", password="123456",
+            user_type=CustomUser.UserType.GESTOR,
+            aprovacao_status=CustomUser.ApprovalStatus.APROVADO
+        )
+        self.client.force_login(gestor)
+
+        response = self.client.get(reverse("listar_notificacoes"))
+
+        notificacao.refresh_from_db()
+        self.assertContains(response, notificacao.foto_miniatura["webp"])
+        self.assertNotContains(response, f'src="{notificacao.foto.url}"')
+
+    def test_original_substituido_pela_copia_limpa(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notificacao = Notificacao.objects.create(
+                titulo="Galho", tipo="DENUNCIA", descricao="d",
+                autor=self.cidadao, tree=self.tree, foto=self._foto(),
+            )
+        enviado = notificacao.foto.name
+        storage = notificacao.foto.storage
+
+        notificacao.refresh_from_db()
+        # A cópia sem metadados é gravada antes (com outro nome) e o enviado sai
+        self.assertNotEqual(notificacao.foto.name, enviado)
+        self.assertTrue(storage.exists(notificacao.foto.name))
+        self.assertFalse(storage.exists(enviado))
+
+    def test_foto_trocada_durante_o_processamento(self):
+        notificacao = Notificacao.objects.create(
+            titulo="Galho", tipo="DENUNCIA", descricao="d",
+            autor=self.cidadao, tree=self.tree, foto=self._foto(),
+        )
+        enviado = notificacao.foto.name
+        storage = notificacao.foto.storage
+        arquivos = self._arquivos_gravados(storage)
+        gerar_variantes = imagens.gerar_variantes
+
+        def trocar_foto(arquivo):
+            # Outra requisição troca a foto enquanto as variantes são geradas
+            Notificacao.objects.filter(id=notificacao.id).update(foto="notificacoes/outra.jpg")
+            return gerar_variantes(arquivo)
+
+        with mock.patch.object(imagens, "gerar_variantes", trocar_foto):
+            imagens.processar_foto(notificacao.id)
+
+        notificacao.refresh_from_db()
+        self.assertEqual(notificacao.foto.name, "notificacoes/outra.jpg")
+        self.assertEqual(notificacao.foto_variantes, {})
+        # O arquivo enviado fica; as cópias descartadas não
+        self.assertTrue(storage.exists(enviado))
+        self.assertEqual(self._arquivos_gravados(storage), arquivos)
+
+    def _arquivos_gravados(self, storage):
+        arquivos = set()
+        for diretorio in ("notificacoes", imagens.DIRETORIO_VARIANTES):
+            if storage.exists(diretorio):
+                arquivos.update(f"{diretorio}/{nome}" for nome in storage.listdir(diretorio)[1])
+        return arquivos
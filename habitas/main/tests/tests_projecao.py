@@ -0,0 +1,212 @@
+import json
+
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from main.cenarios import invalidar_inventario, obter_inventario
+from main import projecao
+from main.projecao import projetar
+from main.models import (
+    CenarioSimulacao, CrescimentoEspecie, CustomUser, EcosystemServiceConfig, Species, Tree,
+    TreeVariable,
+)
+
+
+@override_settings(PROJECAO_CACHE_SEGUNDOS=0)
+class TestProjecao(TestCase):
+
+    def setUp(self):
+        self.ipe = Species.objects.create(name="Tabebuia", bio_index=1)
+        CrescimentoEspecie.objects.create(
+            species=self.ipe, incremento_dap=2, dap_maximo=20, altura_maxima=10, taxa_altura=0.1
+        )
+        EcosystemServiceConfig.objects.create(
+            nome="Diâmetro", codigo="diametro", formula="dap * fator", valor_monetario_unitario=1.0
+        )
+        TreeVariable.objects.create(nome="Fator", codigo="fator", valor_padrao_geral=1)
+        # Duas árvores iguais no mesmo bairro (uma coorte) e uma em outro
+        for placa, latitude, longitude in (
+            (1, -23.207, -45.7870), (2, -23.207, -45.7870), (3, -23.2, -45.9),
+        ):
+            Tree.objects.create(
+                N_placa=placa, nome_popular="Ipê", nome_cientifico="Tabebuia", species=self.ipe,
+                dap=10, altura=5, latitude=latitude, longitude=longitude
+            )
+        Tree.objects.create(
+            N_placa=4, nome_popular="Sem medidas", nome_cientifico="?", dap=0, altura=0,
+            latitude=-23.2, longitude=-45.9
+        )
+
+    def test_bairro_atribuido_ao_salvar(self):
+        self.assertEqual(Tree.objects.get(N_placa=1).bairro, "Paineiras II- Jd")
+
+    def test_series_seguem_parametros_da_especie(self):
+        resultado = projetar(10, agrupar='bairro')
+
+        self.assertEqual(resultado['anos'], list(range(11)))
+        self.assertEqual(resultado['arvores'], 3)
+        self.assertEqual(resultado['sem_medidas'], 1)
+        # Mesmas medidas nos dois bairros: uma coorte só
+        self.assertEqual(resultado['coortes'], 1)
+        # DAP 10 + 2/ano, limitado a 20
+        self.assertEqual(resultado['total']['diametro'][0], 30)
+        self.assertEqual(resultado['total']['diametro'][3], 48)
+        self.assertEqual(resultado['total']['diametro'][10], 60)
+        self.assertEqual(resultado['grupos']['Paineiras II- Jd']['diametro'][3], 32)
+
+    def test_agrupa_por_especie_com_passo(self):
+        resultado = projetar(5, agrupar='especie', passo=2)
+
+        self.assertEqual(resultado['anos'], [0, 2, 4, 5])
+        self.assertEqual(list(resultado['grupos']), ['Tabebuia'])
+        self.assertEqual(resultado['grupos']['Tabebuia']['diametro'], [30, 42, 54, 60])
+
+    def test_endpoint_restrito_a_gestor(self):
+        url = reverse('api_projecao')
+        self.assertNotEqual(self.client.get(url).status_code, 200)
+
+        CustomUser.objects.create_user(
+            username="gestor", password="123456", user_type=CustomUser.UserType.GESTOR
+        )
+        self.client.login(username="gestor", password="123456")
+        self.assertEqual(self.client.get(url, {'anos': 1000}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'agrupar': 'rua'}).status_code, 400)
+
+        resposta = self.client.get(url, {'anos': 3, 'bairro': 'Paineiras II- Jd'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json()['total']['diametro'], [20, 24, 28, 32])
+
+
+@override_settings(PROJECAO_CACHE_SEGUNDOS=300, PROJECAO_ASSINCRONA=True)
+class TestProjecaoAssincrona(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        EcosystemServiceConfig.objects.create(nome="Diâmetro", codigo="diametro", formula="dap")
+        Tree.objects.create(
+            N_placa=1, nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=-23.2, longitude=-45.9
+        )
+        CustomUser.objects.create_user(
+            username="gestor", password="123456", user_type=CustomUser.UserType.GESTOR
+        )
+        self.client.login(username="gestor", password="123456")
+
+    def test_calcula_em_segundo_plano(self):
+        url = reverse('api_projecao')
+        resposta = self.client.get(url, {'anos': 2})
+        self.assertEqual(resposta.status_code, 202)
+        # O pool tem uma thread: espera a projeção agendada terminar
+        projecao._pool().submit(lambda: None).result()
+
+        resposta = self.client.get(url, {'anos': 2})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json()['total']['diametro'][0], 10)
+
+    def test_bloqueio_nao_fica_no_cache(self):
+        EcosystemServiceConfig.objects.create(nome="Travada", codigo="travada", formula="10 ** 10 ** 8")
+        url = reverse('api_projecao')
+        with self.settings(FORMULAS_SANDBOX_TEMPO_CPU=1):
+            self.assertEqual(self.client.get(url, {'anos': 1}).status_code, 202)
+            projecao._pool().submit(lambda: None).result()
+        resposta = self.client.get(url, {'anos': 1})
+        self.assertEqual(resposta.status_code, 503)
+        self.assertEqual(resposta.json()['servicos'], ['travada'])
+
+
+class TestCenarios(TestCase):
+
+    def setUp(self):
+        invalidar_inventario()
+        cache.clear()
+        self.ipe = Species.objects.create(name="Tabebuia", bio_index=1)
+        self.servico = EcosystemServiceConfig.objects.create(
+            nome="Diâmetro", codigo="diametro", formula="dap * fator", coeficientes={"fator": 1},
+            valor_monetario_unitario=2.0
+        )
+        for placa, nome, latitude, longitude in (
+            (1, "Ipê", -23.207, -45.7870), (2, "Ipê", -23.207, -45.7870), (3, "Sibipiruna", -23.2, -45.9),
+        ):
+            Tree.objects.create(
+                N_placa=placa, nome_popular=nome, nome_cientifico="?", species=self.ipe,
+                dap=10, altura=5, latitude=latitude, longitude=longitude
+            )
+        CustomUser.objects.create_user(
+            username="gestor", password="123456", user_type=CustomUser.UserType.GESTOR
+        )
+        self.client.login(username="gestor", password="123456")
+
+    def criar(self, definicao):
+        return self.client.post(
+            reverse('api_cenarios'), json.dumps(definicao), content_type="application/json"
+        )
+
+    def test_plantio_remocao_e_coeficientes(self):
+        resposta = self.criar({
+            "nome": "Plano",
+            "plantios": [{"especie": self.ipe.id, "bairro": "Paineiras II- Jd", "quantidade": 5, "dap": 4}],
+            "remocoes": [{"nome_popular": "Sibipiruna"}],
+            "coeficientes": {"diametro": {"fator": 2}},
+        })
+        self.assertEqual(resposta.status_code, 200)
+        resultado = resposta.json()["resultado"]
+        servico = resultado["servicos"][0]
+
+        self.assertEqual(servico["atual"], 30)
+        # (2 árvores de DAP 10 + 5 mudas de DAP 4) * fator 2
+        self.assertEqual(servico["cenario"], 80)
+        self.assertEqual(servico["valor_monetario_cenario"], 160)
+        self.assertEqual(resultado["removidas"], 1)
+        self.assertEqual(resultado["arvores_cenario"], 7)
+        self.assertEqual(resultado["diferenca_por_bairro"]["Paineiras II- Jd"]["diametro"], 60)
+        # Nada foi gravado no inventário
+        self.assertEqual(Tree.objects.count(), 3)
+
+    def test_mesma_definicao_mesma_chave_e_comparacao(self):
+        primeiro = self.criar({"remocoes": [{"nome_popular": "Ipê"}]}).json()
+        repetido = self.criar({"nome": "Outro nome", "remocoes": [{"nome_popular": "Ipê"}]}).json()
+        vazio = self.criar({}).json()
+        self.assertEqual(primeiro["chave"], repetido["chave"])
+        self.assertEqual(CenarioSimulacao.objects.count(), 2)
+
+        resposta = self.client.get(
+            reverse('comparar_cenarios'), {"chave": [primeiro["chave"], vazio["chave"]]}
+        )
+        cenarios = resposta.json()["cenarios"]
+        self.assertEqual([c["resultado"]["servicos"][0]["cenario"] for c in cenarios], [10, 30])
+
+    def test_alteracao_rele_so_as_arvores_alteradas(self):
+        inventario = obter_inventario()
+        self.assertEqual(inventario.valores_servico(self.servico), [10])
+
+        tree = Tree.objects.get(N_placa=3)
+        tree.dap = 20
+        tree.save()
+        atualizado = obter_inventario()
+        self.assertIsNot(atualizado, inventario)
+        # O estado novo é acrescentado; a cópia anterior segue intacta
+        self.assertEqual(atualizado.valores_servico(self.servico), [10, 20])
+        self.assertEqual(len(inventario.estados), 1)
+        self.assertEqual(self.criar({}).json()["resultado"]["servicos"][0]["atual"], 40)
+
+        tree.delete()
+        self.assertEqual(sum(obter_inventario().contagem.values()), 2)
+
+    @override_settings(CENARIOS_VALORES_MAX=2)
+    def test_valores_guardados_limitados(self):
+        for fator in (2, 3, 4):
+            self.assertEqual(self.criar({"coeficientes": {"diametro": {"fator": fator}}}).status_code, 200)
+        self.assertEqual(len(obter_inventario().valores), 2)
+
+    @override_settings(FORMULAS_SANDBOX_TEMPO_CPU=1)
+    def test_formula_bloqueada_nao_entra_em_cache(self):
+        EcosystemServiceConfig.objects.create(nome="Travada", codigo="travada", formula="10 ** 10 ** 8")
+        resposta = self.criar({})
+        self.assertEqual(resposta.status_code, 503)
+        self.assertEqual(resposta.json()["servicos"], ["travada"])
+        self.assertNotIn("travada", [assinatura[0] for assinatura in obter_inventario().valores])
+
+    def test_definicao_invalida(self):
+        self.assertEqual(self.criar({"remocoes": [{}]}).status_code, 400)
+        self.assertEqual(self.criar({"plantios": [{"especie": self.ipe.id, "bairro": "?", "quantidade": 1}]}).status_code, 400)
+        self.assertEqual(self.criar({"coeficientes": {"inexistente": {}}}).status_code, 400)
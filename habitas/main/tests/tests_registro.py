@@ -1,10 +1,21 @@
-from django.test import TestCase
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from main.models import CustomUser
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 class TestRegistro(TestCase):
 
+    def setUp(self):
+        # O documento comprobatório é gravado em disco: usa uma MEDIA_ROOT temporária
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        configuracao = override_settings(MEDIA_ROOT=self.media)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
     def test_registro_cidadao(self):
         response = self.client.post(reverse("register_cidadao"), {
             "username": "novo",
@@ -0,0 +1,91 @@
+import json
+import os
+import shutil
+import struct
+import tempfile
+import zipfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from main.models import CustomUser, EcosystemServiceConfig, SnapshotInventario, Tree
+from main.snapshots import gravar_snapshot, ler_colunas
+
+
+class TestSnapshots(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        configuracao = override_settings(MEDIA_ROOT=self.media)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+        EcosystemServiceConfig.objects.create(
+            nome="Diâmetro", codigo="diametro", formula="dap", valor_monetario_unitario=2.0
+        )
+        self.ipe = self.criar(1, -23.207, -45.7870, 10)
+        self.criar(2, -23.2, -45.9, 20)
+        CustomUser.objects.create_user(
+            username="gestor", password="123456", user_type=CustomUser.UserType.GESTOR
+        )
+
+    def criar(self, placa, latitude, longitude, dap):
+        return Tree.objects.create(
+            N_placa=placa, nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=dap, altura=5, latitude=latitude, longitude=longitude
+        )
+
+    def test_arquivo_colunar(self):
+        snapshot = gravar_snapshot("teste")
+        self.assertEqual(snapshot.totais, {"diametro": [30, 60]})
+        self.assertIsNone(gravar_snapshot())  # nada mudou
+
+        meta, colunas = ler_colunas(snapshot, {"id", "bairro", "fisico:diametro"})
+        self.assertEqual(meta["arvores"], 2)
+        self.assertEqual(list(colunas["fisico:diametro"]), [10, 20])
+        self.assertEqual(colunas["bairro"][0], "Paineiras II- Jd")
+
+    def test_comparacao(self):
+        antigo = gravar_snapshot()
+        self.ipe.delete()
+        self.criar(3, -23.207, -45.7870, 30)
+        self.criar(4, -23.207, -45.7870, 5)
+        novo = gravar_snapshot()
+
+        self.client.login(username="gestor", password="123456")
+        self.assertEqual(len(self.client.get(reverse("api_snapshots")).json()["snapshots"]), 2)
+        # A comparação não consulta as tabelas vivas
+        with self.assertNumQueries(3):
+            resposta = self.client.get(reverse("comparar_snapshots"), {"de": antigo.id, "para": novo.id})
+        dados = resposta.json()
+        self.assertEqual(dados["arvores"], {"antes": 2, "depois": 3, "incluidas": 2, "removidas": 1})
+        self.assertEqual(dados["servicos"]["diametro"]["diferenca"], 25)
+        self.assertEqual(dados["servicos"]["diametro"]["diferenca_monetaria"], 50)
+        self.assertEqual(
+            dados["por_bairro"]["Paineiras II- Jd"],
+            {"incluidas": 2, "removidas": 1, "servicos": {"diametro": 25}},
+        )
+
+        arquivo = os.path.join(self.media, novo.arquivo.name)
+        novo.delete()
+        self.assertFalse(os.path.exists(arquivo))
+
+    def test_tipos_com_ordem_de_bytes_fixa(self):
+        snapshot = gravar_snapshot()
+        with snapshot.arquivo.open("rb") as bruto, zipfile.ZipFile(bruto) as arquivo:
+            meta = json.loads(arquivo.read("meta.json"))
+            dap = arquivo.read("dap.bin")
+            bairro = arquivo.read("bairro.bin")
+        self.assertEqual(meta["colunas"]["dap"], "<f8")
+        self.assertEqual(meta["colunas"]["bairro"], "texto:<i4")
+        self.assertEqual(struct.unpack("<2d", dap), (10.0, 20.0))
+        self.assertEqual(len(bairro), 8)
+
+    def test_materializacao_grava_snapshot(self):
+        gravar_snapshot()
+        # Mesmas versões de inventário e configuração, valores recalculados
+        call_command("materializar_servicos", stdout=StringIO())
+        self.assertEqual(SnapshotInventario.objects.count(), 2)
+
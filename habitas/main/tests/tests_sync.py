@@ -0,0 +1,137 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from main import views
+from main.models import Tree, Post, TreeChange
+
+@override_settings(SYNC_ATRASO_SEGUNDOS=0)
+class TestSincronizacao(TestCase):
+
+    def setUp(self):
+        self.tree = Tree.objects.create(
+            N_placa="001", nome_popular="Ipê", nome_cientifico="Tabebuia",
+            dap=10, altura=5, latitude=-23.2, longitude=-45.9
+        )
+        self.versao = TreeChange.versao_atual()
+
+    def test_sem_alteracoes(self):
+        response = self.client.get(reverse("api_tree_changes"), {"since": self.versao})
+        data = response.json()
+        self.assertEqual(data["versao"], self.versao)
+        self.assertEqual(data["alteradas"], [])
+        self.assertEqual(data["excluidas"], [])
+
+    def test_inclusao_e_exclusao(self):
+        nova = Tree.objects.create(
+            N_placa="002", nome_popular="Jacarandá", nome_cientifico="Jacaranda",
+            dap=20, altura=8, latitude=-23.3, longitude=-45.8
+        )
+        tree_id = self.tree.id
+        self.tree.delete()
+
+        response = self.client.get(reverse("api_tree_changes"), {"since": self.versao})
+        data = response.json()
+
+        self.assertEqual([t["id"] for t in data["alteradas"]], [nova.id])
+        self.assertEqual(data["excluidas"], [tree_id])
+        self.assertEqual(data["versao"], TreeChange.versao_atual())
+
+    def test_comentario_atualiza_arvore(self):
+        Post.objects.create(tree=self.tree, author="cid", content="Bonita")
+
+        response = self.client.get(reverse("api_tree_changes"), {"since": self.versao})
+        alteradas = response.json()["alteradas"]
+
+        self.assertEqual(len(alteradas), 1)
+        self.assertEqual(alteradas[0]["n_posts"], 1)
+
+    @override_settings(SYNC_ATRASO_SEGUNDOS=300)
+    def test_alteracoes_recentes_sao_reenviadas(self):
+        # Alterações antigas já estão estáveis
+        TreeChange.objects.update(data=timezone.now() - timedelta(hours=1))
+        estavel = TreeChange.versao_atual()
+        nova = Tree.objects.create(
+            N_placa="002", nome_popular="Jacarandá", nome_cientifico="Jacaranda",
+            dap=20, altura=8, latitude=-23.3, longitude=-45.8
+        )
+
+        data = self.client.get(reverse("api_tree_changes"), {"since": 0}).json()
+        self.assertIn(nova.id, [t["id"] for t in data["alteradas"]])
+        # A versão para antes da alteração recente, que volta na próxima chamada
+        self.assertEqual(data["versao"], estavel)
+        data = self.client.get(reverse("api_tree_changes"), {"since": data["versao"]}).json()
+        self.assertEqual([t["id"] for t in data["alteradas"]], [nova.id])
+        self.assertFalse(data["tem_mais"])
+
+    @override_settings(SYNC_ATRASO_SEGUNDOS=300)
+    def test_paginacao_com_alteracoes_recentes(self):
+        # Mais alterações recentes que o limite: a versão fica parada,
+        # mas o cursor avança até o fim
+        novas = [
+            Tree.objects.create(
+                N_placa=f"1{i}", nome_popular="Jacarandá", nome_cientifico="Jacaranda",
+                dap=20, altura=8, latitude=-23.3, longitude=-45.8
+            ).id
+            for i in range(3)
+        ]
+        recebidas = []
+        params = {"since": self.versao}
+        with mock.patch.object(views, "SYNC_MAX_ALTERACOES", 1):
+            for _ in range(5):
+                data = self.client.get(reverse("api_tree_changes"), params).json()
+                recebidas += [t["id"] for t in data["alteradas"]]
+                params = {"since": data["versao"], "cursor": data["cursor"]}
+                if not data["tem_mais"]:
+                    break
+
+        self.assertEqual(recebidas, novas)
+        self.assertFalse(data["tem_mais"])
+        self.assertEqual(data["versao"], self.versao)
+
+    def test_compactacao_mantem_ultimo_registro(self):
+        self.tree.save()
+        Post.objects.create(tree=self.tree, author="cid", content="Bonita")
+        outra = Tree.objects.create(
+            N_placa="002", nome_popular="Jacarandá", nome_cientifico="Jacaranda",
+            dap=20, altura=8, latitude=-23.3, longitude=-45.8
+        )
+        outra_id = outra.id
+        outra.delete()
+
+        removidos = TreeChange.compactar()
+
+        self.assertGreater(removidos, 0)
+        self.assertEqual(
+            sorted(TreeChange.objects.values_list("tree_id", "operacao")),
+            sorted([(self.tree.id, "UPSERT"), (outra_id, "DELETE")]),
+        )
+        data = self.client.get(reverse("api_tree_changes"), {"since": 0}).json()
+        self.assertEqual([t["id"] for t in data["alteradas"]], [self.tree.id])
+        self.assertEqual(data["excluidas"], [outra_id])
+
+    def test_since_invalido(self):
+        response = self.client.get(reverse("api_tree_changes"), {"since": "abc"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_posicoes_colunares_com_filtro(self):
+        Tree.objects.create(
+            N_placa="002", nome_popular="Jacarandá", nome_cientifico="Jacaranda",
+            dap=20, altura=8, latitude=-23.3, longitude=-45.8
+        )
+
+        response = self.client.get(reverse("api_tree_positions"), {"species": "Ipê"})
+        data = response.json()
+
+        self.assertEqual(data["ids"], [self.tree.id])
+        self.assertEqual(data["lat"], [-23.2])
+        self.assertEqual(data["n_posts"], [0])
+        self.assertEqual(data["versao"], TreeChange.versao_atual())
+
+    def test_service_worker(self):
+        response = self.client.get(reverse("service_worker"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/javascript")
+        self.assertIn(reverse("api_tree_changes"), response.content.decode())
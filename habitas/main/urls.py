@@ -6,6 +6,13 @@ urlpatterns = [
     
     # API
     path('api/tree/<int:tree_id>/', views.api_tree_detail, name='api_tree_detail'),
+    path('api/tree/<int:tree_id>/<slug:tipo>/<int:indice>/', views.api_acervo, name='api_acervo'),
+    path('api/trees/positions/', views.api_tree_positions, name='api_tree_positions'),
+    path('api/trees/export/', views.exportar_arvores, name='exportar_arvores'),
+    path('api/trees/changes/', views.api_tree_changes, name='api_tree_changes'),
+    path('api/estatisticas/', views.api_estatisticas, name='api_estatisticas'),
+    path('api/tiles/<slug:medida>/<int:z>/<int:x>/<int:y>.png', views.api_heatmap_tile, name='api_heatmap_tile'),
+    path('sw.js', views.service_worker, name='service_worker'),
     
     # Autenticação
     path('register/cidadao/', views.register_cidadao, name='register_cidadao'),
@@ -21,6 +28,7 @@ urlpatterns = [
     # Gestão de Técnicos (Nível 1)
     path('gestao/tecnicos/pendentes/', views.listar_tecnicos_pendentes, name='listar_tecnicos_pendentes'),
     path('gestao/tecnicos/<int:user_id>/aprovar/', views.aprovar_tecnico, name='aprovar_tecnico'),
+    path('gestao/tecnicos/<int:user_id>/documento/', views.documento_tecnico, name='documento_tecnico'),
     
     # Gestão de Serviços Ecossistêmicos e Variáveis
     path('gestao/configuracoes/', views.configurar_servicos_variaveis, name='configurar_servicos_variaveis'),
@@ -33,12 +41,20 @@ urlpatterns = [
     path('gestao/configuracoes/variaveis/<int:variavel_id>/valor-especie/', views.definir_valor_especie, name='definir_valor_especie'),
     path('gestao/configuracoes/variaveis/<int:variavel_id>/valor-especie/<int:especie_id>/remover/', views.remover_valor_especie, name='remover_valor_especie'),
     path('api/validar-formula/', views.validar_formula, name='validar_formula'),
+    path('api/previa-impacto/', views.previa_impacto_servico, name='previa_impacto_servico'),
+    path('api/projecao/', views.api_projecao, name='api_projecao'),
+    path('api/cenarios/', views.api_cenarios, name='api_cenarios'),
+    path('api/cenarios/comparar/', views.comparar_cenarios, name='comparar_cenarios'),
+    path('api/snapshots/', views.api_snapshots, name='api_snapshots'),
+    path('api/snapshots/comparar/', views.comparar_snapshots, name='comparar_snapshots'),
+    path('metrics', views.metricas_prometheus, name='metricas'),
     
     # Laudos
     path('laudos/criar/<int:tree_id>/', views.criar_laudo, name='criar_laudo'),
     path('laudos/pendentes/', views.listar_laudos_pendentes, name='listar_laudos_pendentes'),
     path('laudos/<int:laudo_id>/validar/', views.validar_laudo, name='validar_laudo'),
     path('laudos/meus/', views.meus_laudos, name='meus_laudos'),
+    path('laudos/<int:laudo_id>/arquivo/', views.arquivo_laudo, name='arquivo_laudo'),
     path('laudos/<int:laudo_id>/editar/', views.editar_laudo, name='editar_laudo'),
     path('laudos/<int:laudo_id>/excluir/', views.excluir_laudo, name='excluir_laudo'),
     
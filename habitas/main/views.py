@@ -2,12 +2,23 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import connection
 from django.db.models import Count
 from django.utils import timezone
 from django.conf import settings
-from django.http import JsonResponse
+from django.http import (
+    JsonResponse,
+    HttpResponse,
+    Http404,
+    StreamingHttpResponse,
+    FileResponse,
+    HttpResponseNotModified,
+)
+import hmac
 import json
 import sys
+import time
 from pathlib import Path
 from .models import (
     Tree,
@@ -21,6 +32,15 @@ from .models import (
     TreeVariableValue,
     SpeciesVariableDefault,
     Species,
+    TreeChange,
+    TreeMedia,
+    ContadorPainel,
+    CenarioSimulacao,
+    ResumoInventario,
+    SnapshotInventario,
+    area_copa_estimada,
+    biomassa_estimada,
+    versao_configuracao,
 )
 from .forms import (
     CidadaoRegistrationForm,
@@ -31,47 +51,30 @@ from .forms import (
     AprovacaoTecnicoForm,
 )
 from .decorators import gestor_required, tecnico_required, gestor_ou_tecnico_required
+from .heatmap import MEDIDA_ARVORES, renderizar_tile, tile_valido
+from . import acervo, metricas
+from .filtros import filtros_arvores
+from .paginacao import codificar_cursor, decodificar_cursor, antes_do_cursor
+from .exportacao import FORMATOS, FormatoIndisponivel, exportar
+from .arquivos import servir_arquivo
+from .configuracao import obter_configuracao
+from .impacto import previa_do_formulario
+from .projecao import AGRUPAMENTOS, projetar_em_cache
+from .cenarios import chave_cenario, normalizar, simular_em_cache
+from .snapshots import comparar
+from .sandbox import FormulaBloqueada, avaliar
 
 
 def index(request):
-    filters = {}
-    if request.GET.get("nome_popular"):
-        filters["nome_popular__icontains"] = request.GET["nome_popular"]
-    if request.GET.get("nome_cientifico"):
-        filters["nome_cientifico__icontains"] = request.GET["nome_cientifico"]
-    if request.GET.get("plantado_por"):
-        filters["plantado_por__icontains"] = request.GET["plantado_por"]
-    if request.GET.get("species"):
-        filters["nome_popular"] = request.GET["species"]
-    if request.GET.get("origem"):
-        filters["origem"] = request.GET["origem"]
-    if request.GET.get("laudo_only"):
-        filters["laudo__isnull"] = False
-        filters["laudo__gt"] = ""
-    if request.GET.get("altura_min"):
-        filters["altura__gte"] = request.GET["altura_min"]
-    if request.GET.get("altura_max"):
-        filters["altura__lte"] = request.GET["altura_max"]
-    if request.GET.get("dap_min"):
-        filters["dap__gte"] = request.GET["dap_min"]
-    if request.GET.get("dap_max"):
-        filters["dap__lte"] = request.GET["dap_max"]
-    # Otimização: carrega apenas posições inicialmente
-    trees = (
-        Tree.objects.filter(**filters)
-        .annotate(n_posts=Count("posts"))
-        .values("id", "latitude", "longitude", "n_posts")
-    )
-    ecosystem_services = EcosystemServiceConfig.objects.filter(ativo=True).order_by(
-        "ordem_exibicao"
-    )
+    # Otimização: as posições são carregadas via api_tree_positions,
+    # o que permite ao service worker mantê-las em cache entre visitas
+    ecosystem_services = obter_configuracao().servicos
     species_list = (
         Tree.objects.values_list("nome_popular", flat=True)
         .distinct()
         .order_by("nome_popular")
     )
     context = {
-        "trees": trees,
         "ecosystem_services": ecosystem_services,
         "species_list": species_list,
         "request": request,
@@ -79,12 +82,162 @@ def index(request):
     return render(request, "index.html", context)
 
 
+def api_tree_positions(request):
+    """API com as posições das árvores (mesmos filtros do index)
+
+    O formato é colunar (listas paralelas) para reduzir o tamanho do JSON.
+    "versao" é a versão do conjunto de posições, usada pelo cliente para
+    sincronizar depois via api_tree_changes.
+    """
+    versao = TreeChange.versao_segura()
+    trees = (
+        Tree.objects.filter(**filtros_arvores(request.GET))
+        .annotate(n_posts=Count("posts"))
+        .order_by("id")
+        .values_list("id", "latitude", "longitude", "n_posts")
+    )
+    ids, latitudes, longitudes, n_posts = [], [], [], []
+    for tree_id, latitude, longitude, posts in trees.iterator(chunk_size=5000):
+        ids.append(tree_id)
+        latitudes.append(latitude)
+        longitudes.append(longitude)
+        n_posts.append(posts)
+
+    return JsonResponse(
+        {
+            "versao": versao,
+            "versao_config": versao_configuracao(),
+            "ids": ids,
+            "lat": latitudes,
+            "lon": longitudes,
+            "n_posts": n_posts,
+        }
+    )
+
+
+@login_required
+def exportar_arvores(request):
+    """Exporta as árvores filtradas (mesmos filtros do index) em streaming
+
+    ?formato=csv|geojson|parquet e ?servicos=1 para incluir as colunas dos
+    serviços ecossistêmicos.
+    """
+    formato = request.GET.get("formato", "csv")
+    try:
+        conteudo = exportar(
+            formato,
+            filtros_arvores(request.GET),
+            incluir_servicos=bool(request.GET.get("servicos")),
+        )
+    except FormatoIndisponivel as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    content_type, extensao = FORMATOS[formato]
+    response = StreamingHttpResponse(conteudo, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="arvores.{extensao}"'
+    return response
+
+
+def service_worker(request):
+    """Service worker do mapa, servido na raiz para controlar a página inicial"""
+    response = render(request, "sw.js", content_type="application/javascript")
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+# Máximo de registros de alteração processados por requisição de sincronização
+SYNC_MAX_ALTERACOES = 5000
+
+
+def api_tree_changes(request):
+    """API de sincronização incremental das posições das árvores
+
+    Recebe ?since=<versao> e devolve apenas as árvores incluídas/alteradas
+    e os ids excluídos desde essa versão, junto com a nova versão que o
+    cliente deve guardar. Se houver mais alterações que o limite, o campo
+    "tem_mais" indica que o cliente deve repetir a chamada com a nova versão
+    e com ?cursor=<cursor>, o id da última alteração já lida.
+    A versão não passa de TreeChange.versao_segura(): alterações recentes
+    são reenviadas na chamada seguinte (reaplicá-las não muda o resultado).
+    Por isso a paginação usa o cursor, e não a versão, que pode ficar parada.
+    """
+    try:
+        since = int(request.GET.get("since", 0))
+        cursor = max(since, int(request.GET.get("cursor", since)))
+    except ValueError:
+        return JsonResponse({"error": "Parâmetro 'since' inválido"}, status=400)
+
+    versao_segura = TreeChange.versao_segura()
+    alteracoes = list(
+        TreeChange.objects.filter(id__gt=cursor)
+        .order_by("id")
+        .values_list("id", "tree_id", "operacao")[: SYNC_MAX_ALTERACOES + 1]
+    )
+    tem_mais = len(alteracoes) > SYNC_MAX_ALTERACOES
+    alteracoes = alteracoes[:SYNC_MAX_ALTERACOES]
+
+    if not alteracoes:
+        return JsonResponse(
+            {
+                "versao": since,
+                "cursor": cursor,
+                "versao_config": versao_configuracao(),
+                "tem_mais": False,
+                "alteradas": [],
+                "excluidas": [],
+            }
+        )
+
+    # Alterações recentes são enviadas, mas a versão não passa de
+    # versao_segura: transações ainda abertas podem gravar ids menores,
+    # então essas alterações voltam na próxima sincronização
+    cursor = alteracoes[-1][0]
+    versao = max(since, min(cursor, versao_segura))
+
+    # Apenas a última operação de cada árvore importa
+    ultima_operacao = {}
+    for _, tree_id, operacao in alteracoes:
+        ultima_operacao[tree_id] = operacao
+
+    ids_alterados = [
+        tree_id
+        for tree_id, operacao in ultima_operacao.items()
+        if operacao == TreeChange.Operacao.UPSERT
+    ]
+    alteradas = list(
+        Tree.objects.filter(id__in=ids_alterados)
+        .annotate(n_posts=Count("posts"))
+        .values("id", "latitude", "longitude", "n_posts")
+    )
+    # Árvores que sumiram sem tombstone posterior (ex.: excluídas no mesmo lote)
+    encontrados = {tree["id"] for tree in alteradas}
+    excluidas = [
+        tree_id
+        for tree_id, operacao in ultima_operacao.items()
+        if operacao == TreeChange.Operacao.DELETE or tree_id not in encontrados
+    ]
+
+    return JsonResponse(
+        {
+            "versao": versao,
+            "cursor": cursor,
+            "versao_config": versao_configuracao(),
+            "tem_mais": tem_mais,
+            "alteradas": alteradas,
+            "excluidas": excluidas,
+        }
+    )
+
+
 def api_tree_detail(request, tree_id):
     """API endpoint para buscar dados completos de uma árvore"""
     try:
         tree = Tree.objects.select_related("species").annotate(
             n_posts=Count("posts")
         ).get(id=tree_id)
+        midias = {TreeMedia.Tipo.IMAGEM: [], TreeMedia.Tipo.LAUDO: []}
+        for tipo, url in tree.midias.values_list("tipo", "url"):
+            midias[tipo].append(url)
         
         # Prepara dados da árvore
         tree_data = {
@@ -100,8 +253,8 @@ def api_tree_detail(request, tree_id):
             "n_comentarios": tree.n_posts,
             "color": "yellow" if tree.n_posts > 0 else "green",
             "plantado_por": tree.plantado_por,
-            "imagens": [img.strip() for img in tree.imagem.split(',') if img.strip()] if tree.imagem else [],
-            "laudos": [laudo.strip() for laudo in tree.laudo.split(',') if laudo.strip()] if tree.laudo else [],
+            "imagens": midias[TreeMedia.Tipo.IMAGEM],
+            "laudos": midias[TreeMedia.Tipo.LAUDO],
             "services": tree.get_all_ecosystem_services(),
             # Compatibilidade com código antigo
             "co2": tree.stored_co2,
@@ -117,6 +270,44 @@ def api_tree_detail(request, tree_id):
         return JsonResponse({"error": str(e)}, status=500)
 
 
+def api_acervo(request, tree_id, tipo, indice):
+    """Imagem ou laudo da árvore servido a partir do cache local (?miniatura=1 para imagens)"""
+    midia = get_object_or_404(TreeMedia, tree_id=tree_id, tipo=tipo, ordem=indice)
+
+    try:
+        arquivo, content_type, etag = acervo.obter(
+            midia.url, miniatura=bool(request.GET.get("miniatura"))
+        )
+    except acervo.ArquivoGrande:
+        return redirect(acervo.url_remota(midia.url))
+    except acervo.ErroAcervo as e:
+        return JsonResponse({"error": str(e)}, status=502)
+
+    if not midia.arquivo_local:
+        TreeMedia.objects.filter(id=midia.id).update(arquivo_local=etag.split("-")[0])
+
+    etag = f'"{etag}"'
+    if request.headers.get("If-None-Match") == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(open(arquivo, "rb"), content_type=content_type)
+    response["ETag"] = etag
+    response["Cache-Control"] = "public, max-age=2592000"
+    return response
+
+
+def api_heatmap_tile(request, medida, z, x, y):
+    """Tile PNG do mapa de calor (contagem de árvores ou serviço ecossistêmico)"""
+    if medida != MEDIDA_ARVORES and medida not in obter_configuracao().servicos_por_codigo:
+        raise Http404("Medida não encontrada")
+    if not tile_valido(z, x, y):
+        raise Http404("Tile fora da grade")
+
+    response = HttpResponse(renderizar_tile(medida, z, x, y), content_type="image/png")
+    response["Cache-Control"] = "public, max-age=3600"
+    return response
+
+
 # ==================== AUTENTICAÇÃO ====================
 
 
@@ -201,18 +392,17 @@ def user_logout(request):
 @gestor_required
 def dashboard_gestor(request):
     """Dashboard para gestores (Nível 1)"""
+    contadores = ContadorPainel.ler([
+        "arvores",
+        "tecnicos_pendentes",
+        f"laudos:{Laudo.LaudoStatus.PENDENTE}",
+        f"notificacoes:{Notificacao.StatusNotificacao.PENDENTE}",
+    ])
     context = {
-        "total_trees": Tree.objects.count(),
-        "tecnicos_pendentes": CustomUser.objects.filter(
-            user_type=CustomUser.UserType.TECNICO,
-            aprovacao_status=CustomUser.ApprovalStatus.PENDENTE,
-        ).count(),
-        "laudos_pendentes": Laudo.objects.filter(
-            status=Laudo.LaudoStatus.PENDENTE
-        ).count(),
-        "notificacoes_pendentes": Notificacao.objects.filter(
-            status=Notificacao.StatusNotificacao.PENDENTE
-        ).count(),
+        "total_trees": contadores["arvores"],
+        "tecnicos_pendentes": contadores["tecnicos_pendentes"],
+        "laudos_pendentes": contadores[f"laudos:{Laudo.LaudoStatus.PENDENTE}"],
+        "notificacoes_pendentes": contadores[f"notificacoes:{Notificacao.StatusNotificacao.PENDENTE}"],
     }
     return render(request, "dashboards/gestor.html", context)
 
@@ -233,10 +423,19 @@ def atualizar_arvores(request):
         
         # Executa o scraper sem checagem de gaps (modo padrão)
         # verbose=False para não poluir o output do Django
-        resultado = run_scraper(check_gaps=False, verbose=False)
+        inicio = time.monotonic()
+        try:
+            resultado = run_scraper(check_gaps=False, verbose=False)
+        except Exception:
+            metricas.incrementar("habitas_scraper_erros_total")
+            raise
+        finally:
+            metricas.incrementar("habitas_scraper_segundos_total", valor=time.monotonic() - inicio)
         
         collected = resultado.get('collected', 0)
         not_found = resultado.get('not_found', 0)
+        metricas.incrementar("habitas_scraper_arvores_total", "coletada", valor=collected)
+        metricas.incrementar("habitas_scraper_arvores_total", "nao_encontrada", valor=not_found)
         
         if collected > 0:
             messages.success(
@@ -263,15 +462,13 @@ def atualizar_arvores(request):
 @tecnico_required
 def dashboard_tecnico(request):
     """Dashboard para técnicos (Nível 2)"""
-    context = {
-        "meus_laudos": Laudo.objects.filter(autor=request.user).count(),
-        "notificacoes_disponiveis": Notificacao.objects.filter(
-            status=Notificacao.StatusNotificacao.PENDENTE
-        ).count(),
-        "minhas_analises": Notificacao.objects.filter(
-            tecnico_responsavel=request.user
-        ).count(),
+    chaves = {
+        "meus_laudos": f"laudos_autor:{request.user.id}",
+        "notificacoes_disponiveis": f"notificacoes:{Notificacao.StatusNotificacao.PENDENTE}",
+        "minhas_analises": f"analises_tecnico:{request.user.id}",
     }
+    contadores = ContadorPainel.ler(list(chaves.values()))
+    context = {nome: contadores[chave] for nome, chave in chaves.items()}
     return render(request, "dashboards/tecnico.html", context)
 
 
@@ -321,6 +518,15 @@ def aprovar_tecnico(request, user_id):
     )
 
 
+@gestor_required
+def documento_tecnico(request, user_id):
+    """Documento comprobatório enviado pelo técnico no cadastro"""
+    tecnico = get_object_or_404(CustomUser, id=user_id)
+    if not tecnico.documento_comprobatorio:
+        raise Http404("Documento não enviado")
+    return servir_arquivo(request, tecnico.documento_comprobatorio)
+
+
 # ==================== LAUDOS TÉCNICOS ====================
 
 
@@ -424,6 +630,21 @@ def meus_laudos(request):
     return render(request, "laudos/meus_laudos.html", context)
 
 
+@gestor_ou_tecnico_required
+def arquivo_laudo(request, laudo_id):
+    """PDF do laudo (gestores, o autor, ou qualquer técnico se aprovado)"""
+    laudo = get_object_or_404(Laudo, id=laudo_id)
+    if not (
+        request.user.is_gestor()
+        or laudo.autor_id == request.user.id
+        or laudo.status == Laudo.LaudoStatus.APROVADO
+    ):
+        raise PermissionDenied
+    if not laudo.arquivo:
+        raise Http404("Laudo sem arquivo")
+    return servir_arquivo(request, laudo.arquivo, f"laudo-{laudo.id}{Path(laudo.arquivo.name).suffix}")
+
+
 @tecnico_required
 def editar_laudo(request, laudo_id):
     """Técnico edita seu próprio laudo (apenas se ainda não aprovado)"""
@@ -530,31 +751,93 @@ def criar_notificacao(request, tree_id):
     )
 
 
+# Notificações exibidas por página na fila
+NOTIFICACOES_POR_PAGINA = 20
+
+
 @gestor_ou_tecnico_required
 def listar_notificacoes(request):
-    """Lista notificações para gestores e técnicos"""
+    """Lista notificações para gestores e técnicos (paginação por chave)"""
     filters = {}
     if request.GET.get("status"):
         filters["status"] = request.GET.get("status")
     if request.GET.get("tipo"):
         filters["tipo"] = request.GET.get("tipo")
 
+    chave = decodificar_cursor(request.GET.get("cursor"))
+    ordem = ("-data_criacao", "-id")
+    limite = NOTIFICACOES_POR_PAGINA + 1
+
+    def pagina(queryset):
+        if chave:
+            queryset = queryset.filter(antes_do_cursor("data_criacao", *chave))
+        return queryset.order_by(*ordem)
+
     if request.user.is_gestor():
-        notificacoes = Notificacao.objects.filter(**filters)
+        notificacoes = list(
+            pagina(Notificacao.objects.filter(**filters)).select_related(
+                "tree", "autor", "tecnico_responsavel"
+            )[:limite]
+        )
     else:  # Técnico
-        notificacoes = Notificacao.objects.filter(
-            status__in=[
-                Notificacao.StatusNotificacao.PENDENTE,
-                Notificacao.StatusNotificacao.EM_ANALISE,
-            ],
-            **filters,
-        ) | Notificacao.objects.filter(tecnico_responsavel=request.user, **filters)
+        # UNION em vez de OR: cada ramo é servido pelo seu índice
+        # (status, data_criacao) ou (tecnico_responsavel, data_criacao)
+        fila = pagina(
+            Notificacao.objects.filter(
+                status__in=[
+                    Notificacao.StatusNotificacao.PENDENTE,
+                    Notificacao.StatusNotificacao.EM_ANALISE,
+                ],
+                **filters,
+            )
+        ).values("id", "data_criacao")
+        atribuidas = pagina(
+            Notificacao.objects.filter(tecnico_responsavel=request.user, **filters)
+        ).values("id", "data_criacao")
+        if connection.features.supports_slicing_ordering_in_compound:
+            fila, atribuidas = fila[:limite], atribuidas[:limite]
+        else:
+            fila, atribuidas = fila.order_by(), atribuidas.order_by()
+        ids = [n["id"] for n in fila.union(atribuidas).order_by(*ordem)[:limite]]
+        notificacoes = list(
+            Notificacao.objects.filter(id__in=ids)
+            .select_related("tree", "autor", "tecnico_responsavel")
+            .order_by(*ordem)
+        )
 
-    notificacoes = notificacoes.select_related(
-        "tree", "autor", "tecnico_responsavel"
-    ).order_by("-data_criacao")
+    proxima_pagina = None
+    if len(notificacoes) > NOTIFICACOES_POR_PAGINA:
+        notificacoes = notificacoes[:NOTIFICACOES_POR_PAGINA]
+        params = request.GET.copy()
+        ultima = notificacoes[-1]
+        params["cursor"] = codificar_cursor(ultima.data_criacao, ultima.id)
+        proxima_pagina = params.urlencode()
+
+    primeira_pagina = None
+    if chave:
+        params = request.GET.copy()
+        del params["cursor"]
+        primeira_pagina = params.urlencode()
+
+    status = Notificacao.StatusNotificacao
+    contadores = ContadorPainel.ler([f"notificacoes:{valor}" for valor in status.values])
+    stats = {
+        "pendentes": contadores[f"notificacoes:{status.PENDENTE}"],
+        "em_analise": contadores[f"notificacoes:{status.EM_ANALISE}"],
+        "resolvidas": contadores[f"notificacoes:{status.RESOLVIDA}"],
+        "arquivadas": contadores[f"notificacoes:{status.ARQUIVADA}"],
+    }
 
-    return render(request, "notificacoes/listar.html", {"notificacoes": notificacoes})
+    return render(
+        request,
+        "notificacoes/listar.html",
+        {
+            "notificacoes": notificacoes,
+            "stats": stats,
+            "proxima_pagina": proxima_pagina,
+            "primeira_pagina": primeira_pagina,
+        },
+    )
 
 
 @gestor_ou_tecnico_required
@@ -670,7 +953,7 @@ def criar_servico_ecossistemico(request):
             
             coeficientes = json.loads(coeficientes_json) if coeficientes_json else {}
             
-            servico = EcosystemServiceConfig.objects.create(
+            servico = EcosystemServiceConfig(
                 nome=nome,
                 codigo=codigo,
                 descricao=descricao,
@@ -684,9 +967,14 @@ def criar_servico_ecossistemico(request):
                 ordem_exibicao=ordem_exibicao,
                 criado_por=request.user
             )
+            # Fórmulas que excedem os limites do sandbox não são salvas
+            servico.validar_no_sandbox()
+            servico.save()
             
             messages.success(request, f"Serviço '{nome}' criado com sucesso!")
             return redirect('configurar_servicos_variaveis')
+        except ValidationError as e:
+            messages.error(request, f"Erro ao criar serviço: {'; '.join(e.messages)}")
         except Exception as e:
             messages.error(request, f"Erro ao criar serviço: {str(e)}")
     
@@ -729,10 +1017,14 @@ def editar_servico_ecossistemico(request, servico_id):
                                 coeficientes[nome] = valor
             
             servico.coeficientes = coeficientes
+            # Fórmulas que excedem os limites do sandbox não são salvas
+            servico.validar_no_sandbox()
             servico.save()
             
             messages.success(request, f"Serviço '{servico.nome}' atualizado com sucesso!")
             return redirect('configurar_servicos_variaveis')
+        except ValidationError as e:
+            messages.error(request, f"Erro ao atualizar serviço: {'; '.join(e.messages)}")
         except Exception as e:
             messages.error(request, f"Erro ao atualizar serviço: {str(e)}")
     
@@ -931,15 +1223,15 @@ def validar_formula(request):
             # Dados de exemplo para teste
             dap = 30.0
             altura = 10.0
-            biomassa = math.exp(-0.906586 + 1.60421 * math.log(dap) + 0.37162 * math.log(altura)) / 1000
+            biomassa = biomassa_estimada(dap, altura)
             
             coeficientes = json.loads(coeficientes_json) if coeficientes_json else {}
             
             context = {
-                'math': math,
                 'dap': dap,
                 'altura': altura,
                 'biomassa': biomassa,
+                'area_copa': area_copa_estimada(dap),
                 'coeficientes': coeficientes,
             }
             
@@ -948,17 +1240,26 @@ def validar_formula(request):
                 context[key] = value
             
             # Adiciona variáveis customizadas (com valores de exemplo)
-            variaveis = TreeVariable.objects.filter(ativo=True)
+            variaveis = obter_configuracao().variaveis
             for var in variaveis:
                 if var.tipo_dado in ['FLOAT', 'INTEGER']:
                     context[var.codigo] = 1.0  # Valor de exemplo
                 else:
                     context[var.codigo] = None
             
-            # Tenta avaliar a fórmula
-            resultado = eval(formula, {"__builtins__": {}}, context)
+            # Avalia a fórmula em um worker isolado (limites de CPU e memória)
+            try:
+                resultado, tipo_erro, mensagem = avaliar(formula, context)
+            except FormulaBloqueada as e:
+                return JsonResponse({'valido': False, 'erro': str(e)})
+            if tipo_erro == 'SyntaxError':
+                return JsonResponse({'valido': False, 'erro': f'Erro de sintaxe: {mensagem}'})
+            if tipo_erro == 'matematico':
+                return JsonResponse({'valido': False, 'erro': f'Erro matemático: {mensagem}'})
+            if tipo_erro is not None and tipo_erro != 'ResultadoInvalido':
+                return JsonResponse({'valido': False, 'erro': f'Erro: {mensagem}'})
             
-            if not isinstance(resultado, (int, float)) or math.isnan(resultado) or math.isinf(resultado):
+            if tipo_erro == 'ResultadoInvalido' or math.isnan(resultado) or math.isinf(resultado):
                 return JsonResponse({
                     'valido': False,
                     'erro': 'A fórmula retornou um valor inválido'
@@ -986,4 +1287,170 @@ def validar_formula(request):
                 'erro': f'Erro: {str(e)}'
             })
     
-    return JsonResponse({'valido': False, 'erro': 'Método não permitido'})
\ No newline at end of file
+    return JsonResponse({'valido': False, 'erro': 'Método não permitido'})
+
+
+@gestor_required
+def previa_impacto_servico(request):
+    """Prévia (AJAX) do efeito de uma fórmula/coeficientes em todo o inventário"""
+    if request.method != "POST":
+        return JsonResponse({"erro": "Método não permitido"}, status=405)
+
+    try:
+        return JsonResponse(previa_do_formulario(request.POST))
+    except ValueError as e:
+        return JsonResponse({"erro": str(e)}, status=400)
+
+
+@gestor_required
+def api_projecao(request):
+    """Projeção anual dos serviços ecossistêmicos (JSON), por bairro ou espécie
+
+    Parâmetros: anos (padrão 30), agrupar (bairro|especie), passo (padrão 1)
+    e os mesmos filtros do mapa. Responde 202 enquanto a projeção é
+    calculada em segundo plano.
+    """
+    try:
+        anos = int(request.GET.get("anos", 30))
+        passo = int(request.GET.get("passo", 1))
+    except ValueError:
+        return JsonResponse({"erro": "anos e passo devem ser inteiros"}, status=400)
+    agrupar = request.GET.get("agrupar", "bairro")
+    anos_max = getattr(settings, "PROJECAO_ANOS_MAX", 100)
+    if not 1 <= anos <= anos_max:
+        return JsonResponse({"erro": f"anos deve estar entre 1 e {anos_max}"}, status=400)
+    if not 1 <= passo <= anos:
+        return JsonResponse({"erro": "passo deve estar entre 1 e anos"}, status=400)
+    if agrupar not in AGRUPAMENTOS:
+        return JsonResponse({"erro": f"agrupar deve ser um de: {', '.join(AGRUPAMENTOS)}"}, status=400)
+
+    try:
+        resultado = projetar_em_cache(anos, agrupar, filtros_arvores(request.GET), passo)
+    except FormulaBloqueada as e:
+        return JsonResponse({"erro": str(e), "servicos": e.servicos}, status=503)
+    if resultado is None:
+        # Calculando em segundo plano: o cliente repete a mesma consulta
+        response = JsonResponse({"status": "calculando"}, status=202)
+        response["Retry-After"] = "2"
+        return response
+    return JsonResponse(resultado)
+
+
+@gestor_required
+def api_cenarios(request):
+    """Cria (ou reaproveita) um cenário "e se" e devolve seu resultado
+
+    Corpo JSON: {"nome", "plantios", "remocoes", "coeficientes"} (ver
+    main/cenarios.py). Cenários iguais têm a mesma chave.
+    """
+    if request.method != "POST":
+        return JsonResponse({"erro": "Método não permitido"}, status=405)
+    try:
+        dados = json.loads(request.body or b"{}")
+        definicao = normalizar(dados)
+    except json.JSONDecodeError:
+        return JsonResponse({"erro": "JSON inválido"}, status=400)
+    except ValueError as e:
+        return JsonResponse({"erro": str(e)}, status=400)
+
+    chave = chave_cenario(definicao)
+    cenario, _ = CenarioSimulacao.objects.get_or_create(
+        chave=chave,
+        defaults={
+            "nome": str(dados.get("nome") or "")[:200],
+            "definicao": definicao,
+            "criado_por": request.user,
+        },
+    )
+    try:
+        resultado = simular_em_cache(chave, definicao)
+    except FormulaBloqueada as e:
+        return JsonResponse({"erro": str(e), "servicos": e.servicos}, status=503)
+    return JsonResponse({
+        "chave": chave,
+        "nome": cenario.nome,
+        "definicao": definicao,
+        "resultado": resultado,
+    })
+
+
+@gestor_required
+def comparar_cenarios(request):
+    """Resultados de vários cenários lado a lado (?chave=...&chave=...)"""
+    chaves = request.GET.getlist("chave")
+    if not chaves:
+        return JsonResponse({"erro": "Informe ao menos uma chave"}, status=400)
+    cenarios = CenarioSimulacao.objects.in_bulk(chaves, field_name="chave")
+    faltando = [chave for chave in chaves if chave not in cenarios]
+    if faltando:
+        return JsonResponse({"erro": f"Cenário não encontrado: {', '.join(faltando)}"}, status=404)
+
+    try:
+        return JsonResponse({
+            "cenarios": [
+                {
+                    "chave": chave,
+                    "nome": cenarios[chave].nome,
+                    "definicao": cenarios[chave].definicao,
+                    "resultado": simular_em_cache(chave, cenarios[chave].definicao),
+                }
+                for chave in chaves
+            ]
+        })
+    except FormulaBloqueada as e:
+        return JsonResponse({"erro": str(e), "servicos": e.servicos}, status=503)
+
+
+def api_estatisticas(request):
+    """Estatísticas (árvores, espécies, comentários e serviços) a partir dos resumos
+
+    Filtros opcionais: bairro, nome_cientifico e origem; agrupar=<dimensão>
+    inclui os totais de cada grupo (relatórios por bairro, espécie ou origem).
+    """
+    filtros = {
+        campo: request.GET[campo] for campo in ResumoInventario.DIMENSOES if request.GET.get(campo)
+    }
+    agrupar = request.GET.get("agrupar") or None
+    if agrupar is not None and agrupar not in ResumoInventario.DIMENSOES:
+        return JsonResponse(
+            {"erro": f"agrupar deve ser um de: {', '.join(ResumoInventario.DIMENSOES)}"}, status=400
+        )
+    return JsonResponse(ResumoInventario.somar(filtros, agrupar))
+
+
+@gestor_required
+def api_snapshots(request):
+    """Catálogo dos snapshots do inventário"""
+    return JsonResponse({
+        "snapshots": [snapshot.resumo() for snapshot in SnapshotInventario.objects.all()]
+    })
+
+
+@gestor_required
+def comparar_snapshots(request):
+    """Diferenças entre dois snapshots (?de=<id>&para=<id>), lidas só dos arquivos"""
+    try:
+        de, para = int(request.GET["de"]), int(request.GET["para"])
+    except (KeyError, ValueError):
+        return JsonResponse({"erro": "Informe os ids dos snapshots em de e para"}, status=400)
+    snapshots = SnapshotInventario.objects.in_bulk([de, para])
+    if de not in snapshots or para not in snapshots:
+        return JsonResponse({"erro": "Snapshot não encontrado"}, status=404)
+    return JsonResponse(comparar(snapshots[de], snapshots[para]))
+
+
+def metricas_prometheus(request):
+    """Métricas no formato de texto do Prometheus (todos os processos)
+
+    Com METRICAS_TOKEN definido, exige o cabeçalho Authorization: Bearer
+    <token>; sem ele, só gestores autenticados (o endpoint nunca é público).
+    """
+    token = getattr(settings, "METRICAS_TOKEN", None)
+    if token:
+        recebido = request.headers.get("Authorization", "")
+        autorizado = hmac.compare_digest(recebido.encode(), f"Bearer {token}".encode())
+    else:
+        autorizado = request.user.is_authenticated and request.user.is_gestor()
+    if not autorizado:
+        return HttpResponse(status=401)
+    return HttpResponse(metricas.exposicao(), content_type="text/plain; version=0.0.4; charset=utf-8")
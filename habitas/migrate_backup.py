@@ -1,10 +1,60 @@
 #!/usr/bin/env python3
 """
 Script para migrar dados do banco antigo para o novo
+
+O banco antigo guarda laudos e imagens nas colunas main_tree.laudo e
+main_tree.imagem; no novo eles ficam em TreeMedia. As árvores são gravadas
+pelo ORM (os demais campos de Tree recebem os mesmos valores da importação
+do CSV).
 """
+import os
 import sqlite3
 import sys
 
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'habitas.settings')
+django.setup()
+
+from django.db import transaction  # noqa: E402
+from main.bairros import localizar  # noqa: E402
+from main.models import (  # noqa: E402
+    ResumoInventario, Tree, TreeChange, TreeMedia, area_copa_estimada, biomassa_estimada,
+)
+
+
+def migrate_trees(old_cursor):
+    """Copia as árvores do banco antigo, com laudos e imagens em TreeMedia"""
+    old_cursor.execute("""
+        SELECT id, N_placa, nome_popular, nome_cientifico, dap, altura,
+               latitude, longitude, laudo, imagem, plantado_por, species_id
+        FROM main_tree
+    """)
+    existentes = set(Tree.objects.values_list('id', flat=True))
+    trees, midias = [], []
+    for (tree_id, placa, nome_popular, nome_cientifico, dap, altura,
+         latitude, longitude, laudos, imagens, plantado_por, species_id) in old_cursor.fetchall():
+        if tree_id in existentes:
+            print(f"Tree {tree_id} já existe, pulando...")
+            continue
+        trees.append(Tree(
+            id=tree_id, N_placa=placa, nome_popular=nome_popular, nome_cientifico=nome_cientifico,
+            dap=dap, altura=altura, latitude=latitude, longitude=longitude,
+            bairro=localizar(latitude, longitude),
+            biomassa=biomassa_estimada(dap, altura), area_copa=area_copa_estimada(dap),
+            tem_laudo=bool(TreeMedia.separar(laudos)),
+            plantado_por=plantado_por, species_id=species_id,
+        ))
+        midias += TreeMedia.criar_para(tree_id, laudos, imagens)
+
+    with transaction.atomic():
+        Tree.objects.bulk_create(trees, batch_size=1000)
+        TreeMedia.objects.bulk_create(midias, batch_size=1000)
+        TreeChange.registrar(tree.id for tree in trees)
+    ResumoInventario.recalcular()
+    return len(trees)
+
+
 def migrate_data():
     # Conectar aos bancos
     old_db = sqlite3.connect('db.sqlite3.backup')
@@ -28,28 +78,13 @@ def migrate_data():
                 print(f"Species {sp[0]} já existe, pulando...")
         
         print(f"✓ {len(species)} espécies migradas")
+        # As árvores são gravadas por outra conexão (ORM)
+        new_db.commit()
         
         # Migrar Trees
         print("Migrando Trees...")
-        old_cursor.execute("""
-            SELECT id, N_placa, nome_popular, nome_cientifico, dap, altura, 
-                   latitude, longitude, laudo, imagem, plantado_por, species_id
-            FROM main_tree
-        """)
-        trees = old_cursor.fetchall()
-        
-        for tree in trees:
-            try:
-                new_cursor.execute("""
-                    INSERT INTO main_tree 
-                    (id, N_placa, nome_popular, nome_cientifico, dap, altura, 
-                     latitude, longitude, laudo, imagem, plantado_por, species_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, tree)
-            except sqlite3.IntegrityError:
-                print(f"Tree {tree[0]} já existe, pulando...")
-        
-        print(f"✓ {len(trees)} árvores migradas")
+        migradas = migrate_trees(old_cursor)
+        print(f"✓ {migradas} árvores migradas")
         
         # Migrar Posts (comentários)
         print("Migrando Posts...")
@@ -0,0 +1,218 @@
+// Camada de pontos das árvores desenhada em <canvas>
+//
+// Substitui um L.circle (elemento SVG) por árvore. As posições ficam em
+// arrays tipados, projetadas uma única vez em coordenadas Web Mercator
+// normalizadas; cada redesenho só aplica escala e deslocamento. O clique é
+// resolvido por um "id-buffer": um Int32Array do tamanho do canvas em que
+// cada pixel guarda o índice (+1) do ponto desenhado ali.
+
+const TREE_COLORS = ['green', 'yellow', 'red'];
+const COLOR_GREEN = 0;
+const COLOR_YELLOW = 1;
+const COLOR_RED = 2;
+
+L.TreePointLayer = L.Layer.extend({
+  options: {
+    radius: 5,          // raio em metros (como o antigo L.circle)
+    minPixelRadius: 1.5,
+    fillOpacity: 0.5,
+    pane: 'overlayPane',
+  },
+
+  initialize: function (lat, lon, colors, options) {
+    L.setOptions(this, options);
+    const n = lat.length;
+    this._n = n;
+    this._colors = colors;              // Uint8Array com índice em TREE_COLORS
+    this._mask = null;                  // Uint8Array (1 = visível) ou null para todos
+    this._x = new Float64Array(n);
+    this._y = new Float64Array(n);
+    for (let i = 0; i < n; i++) {
+      const sin = Math.sin(lat[i] * Math.PI / 180);
+      this._x[i] = (lon[i] + 180) / 360;
+      this._y[i] = 0.5 - Math.log((1 + sin) / (1 - sin)) / (4 * Math.PI);
+    }
+    this._pickBuffer = null;
+    this._pickDirty = true;
+  },
+
+  onAdd: function (map) {
+    this._canvas = L.DomUtil.create('canvas', 'leaflet-zoom-hide');
+    this._ctx = this._canvas.getContext('2d');
+    // Os cliques são tratados no container; o canvas não pode bloquear os polígonos
+    this._canvas.style.pointerEvents = 'none';
+    this.getPane().appendChild(this._canvas);
+    // Fase de captura: o clique em uma árvore tem prioridade sobre os polígonos dos bairros
+    this._clickHandler = this._onClick.bind(this);
+    map.getContainer().addEventListener('click', this._clickHandler, true);
+    map.on('moveend zoomend resize viewreset', this._redraw, this);
+    this._redraw();
+  },
+
+  onRemove: function (map) {
+    map.getContainer().removeEventListener('click', this._clickHandler, true);
+    map.off('moveend zoomend resize viewreset', this._redraw, this);
+    L.DomUtil.remove(this._canvas);
+    this._canvas = null;
+  },
+
+  // Define quais pontos ficam visíveis (null mostra todos) e redesenha
+  setMask: function (mask) {
+    this._mask = mask;
+    this._redraw();
+  },
+
+  setColor: function (index, color) {
+    this._colors[index] = color;
+    this._redraw();
+  },
+
+  _pixelRadius: function () {
+    const map = this._map;
+    const center = map.getCenter();
+    const metersPerPixel = 40075016.686 * Math.cos(center.lat * Math.PI / 180) / (256 * Math.pow(2, map.getZoom()));
+    return Math.max(this.options.radius / metersPerPixel, this.options.minPixelRadius);
+  },
+
+  _redraw: function () {
+    if (!this._map) {
+      return;
+    }
+    const map = this._map;
+    const size = map.getSize();
+    const topLeft = map.containerPointToLayerPoint([0, 0]);
+    L.DomUtil.setPosition(this._canvas, topLeft);
+    this._canvas.width = size.x;
+    this._canvas.height = size.y;
+
+    // Origem da tela em pixels do "mundo" no zoom atual
+    const scale = 256 * Math.pow(2, map.getZoom());
+    const origin = map.getPixelOrigin().add(topLeft);
+    const r = this._pixelRadius();
+    const ctx = this._ctx;
+    const mask = this._mask;
+    const colors = this._colors;
+
+    // Um único path por cor: evita trocar fillStyle a cada ponto
+    ctx.globalAlpha = this.options.fillOpacity;
+    for (let color = 0; color < TREE_COLORS.length; color++) {
+      ctx.beginPath();
+      for (let i = 0; i < this._n; i++) {
+        if (colors[i] !== color || (mask && !mask[i])) {
+          continue;
+        }
+        const px = this._x[i] * scale - origin.x;
+        const py = this._y[i] * scale - origin.y;
+        if (px < -r || py < -r || px > size.x + r || py > size.y + r) {
+          continue;
+        }
+        if (r < 3) {
+          ctx.rect(px - r, py - r, 2 * r, 2 * r);
+        } else {
+          ctx.moveTo(px + r, py);
+          ctx.arc(px, py, r, 0, 2 * Math.PI);
+        }
+      }
+      ctx.fillStyle = TREE_COLORS[color];
+      ctx.fill();
+    }
+    this._scale = scale;
+    this._origin = origin;
+    this._size = size;
+    this._pickDirty = true;
+  },
+
+  // Id-buffer construído sob demanda (só quando há clique após um redesenho)
+  _buildPickBuffer: function () {
+    const width = this._size.x;
+    const height = this._size.y;
+    if (!this._pickBuffer || this._pickBuffer.length !== width * height) {
+      this._pickBuffer = new Int32Array(width * height);
+    } else {
+      this._pickBuffer.fill(0);
+    }
+    const buffer = this._pickBuffer;
+    // Área de clique mínima de alguns pixels para facilitar o toque em celulares
+    const r = Math.max(Math.ceil(this._pixelRadius()), 4);
+    const mask = this._mask;
+    for (let i = 0; i < this._n; i++) {
+      if (mask && !mask[i]) {
+        continue;
+      }
+      const px = Math.round(this._x[i] * this._scale - this._origin.x);
+      const py = Math.round(this._y[i] * this._scale - this._origin.y);
+      if (px < -r || py < -r || px >= width + r || py >= height + r) {
+        continue;
+      }
+      const x0 = Math.max(px - r, 0), x1 = Math.min(px + r, width - 1);
+      const y0 = Math.max(py - r, 0), y1 = Math.min(py + r, height - 1);
+      for (let y = y0; y <= y1; y++) {
+        const row = y * width;
+        for (let x = x0; x <= x1; x++) {
+          buffer[row + x] = i + 1;
+        }
+      }
+    }
+    this._pickDirty = false;
+  },
+
+  _onClick: function (e) {
+    if (!this._size || !this.options.onClick) {
+      return;
+    }
+    // Fim de arraste do mapa não é clique
+    if (this._map.dragging && this._map.dragging.moved()) {
+      return;
+    }
+    if (this._pickDirty) {
+      this._buildPickBuffer();
+    }
+    const point = this._map.mouseEventToContainerPoint(e);
+    const x = Math.round(point.x), y = Math.round(point.y);
+    if (x < 0 || y < 0 || x >= this._size.x || y >= this._size.y) {
+      return;
+    }
+    const hit = this._pickBuffer[y * this._size.x + x];
+    if (hit > 0) {
+      L.DomEvent.stopPropagation(e);
+      this.options.onClick(hit - 1);
+    }
+  },
+});
+
+L.treePointLayer = function (lat, lon, colors, options) {
+  return new L.TreePointLayer(lat, lon, colors, options);
+};
+
+// Máscara dos pontos dentro de um polígono GeoJSON (anéis [lon, lat, ...]),
+// com pré-filtro pela bounding box. Substitui turf.booleanPointInPolygon ponto a ponto.
+function pointsInPolygonMask(lat, lon, geometry) {
+  const n = lat.length;
+  const mask = new Uint8Array(n);
+  const rings = geometry.coordinates;
+  let minLon = Infinity, maxLon = -Infinity, minLat = Infinity, maxLat = -Infinity;
+  for (const coord of rings[0]) {
+    minLon = Math.min(minLon, coord[0]); maxLon = Math.max(maxLon, coord[0]);
+    minLat = Math.min(minLat, coord[1]); maxLat = Math.max(maxLat, coord[1]);
+  }
+  for (let i = 0; i < n; i++) {
+    const x = lon[i], y = lat[i];
+    if (x < minLon || x > maxLon || y < minLat || y > maxLat) {
+      continue;
+    }
+    // Ray casting (par-ímpar) sobre todos os anéis, o que trata buracos
+    let inside = false;
+    for (const ring of rings) {
+      for (let a = 0, b = ring.length - 1; a < ring.length; b = a++) {
+        const xa = ring[a][0], ya = ring[a][1], xb = ring[b][0], yb = ring[b][1];
+        if ((ya > y) !== (yb > y) && x < (xb - xa) * (y - ya) / (yb - ya) + xa) {
+          inside = !inside;
+        }
+      }
+    }
+    if (inside) {
+      mask[i] = 1;
+    }
+  }
+  return mask;
+}
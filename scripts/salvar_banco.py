@@ -2,12 +2,13 @@
 # python manage.py shell
 # exec(open('../scripts/salvar_banco.py').read())
 import csv
-from main.models import Tree
+from main.models import Tree, TreeChange, TreeMedia
 trees_in_db = set(Tree.objects.values_list('id', flat=True).all())
 with open('../trees_all.csv', encoding='utf-8') as csv_file:
     csv_reader = csv.reader(csv_file, delimiter=';')
     next(csv_reader, None)  # pular cabeçalho
     trees = []
+    midias = []
     for row in csv_reader:
         try:
             ID = int(row[0]) + 2000  # pular os ids que já estão no banco
@@ -22,8 +23,11 @@ with open('../trees_all.csv', encoding='utf-8') as csv_file:
             plantado_por = "Prefeitura"
             if ID not in trees_in_db:
                 trees.append(Tree(id=ID, N_placa=ID, nome_popular=nome_popular, nome_cientifico=nome_cientifico, dap=dap, altura=altura, latitude=latitude,
-                                  longitude=longitude, laudo=laudos, imagem=imagens, plantado_por=plantado_por))
+                                  longitude=longitude, tem_laudo=bool(TreeMedia.separar(laudos)), plantado_por=plantado_por))
+                midias += TreeMedia.criar_para(ID, laudos, imagens)
         except ValueError:
             print('Unable to convert row', row)
     print('salvando', len(trees), 'arvores')
     Tree.objects.bulk_create(trees)
+    TreeMedia.objects.bulk_create(midias, batch_size=1000)
+    TreeChange.registrar(tree.id for tree in trees)